@@ -1,19 +1,35 @@
-from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import logging
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.websockets import WebSocketState
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chat.application.chat_service import ChatApplicationService
+from chat.api.streaming import cancel_on_disconnect, format_sse, parse_client_frame
+from chat.application.chat_service import ChatApplicationService, ChatSessionState
 from chat.application.schemas import (
     Source, SourceCreate, SourceUpdate, SourceResponse, SourceListResponse,
-    Prompt, PromptCreate, PromptResponse,
+    Prompt, PromptCreate, PromptResponse, PromptBulkCreate,
     Tool, ToolCreate, ToolResponse,
     Chat, ChatCreate, ChatResponse, ChatListResponse,
-    ChatData, ChatDataCreate, MessageResponse, MessageListResponse,
-    ChatTool, ChatToolCreate, SendMessageRequest, EnableToolRequest,
-    StreamResponse
+    ChatData, ChatDataCreate, ChatDataBulkCreate, MessageResponse, MessageListResponse,
+    ChatTool, ChatToolCreate, SendMessageRequest, EnableToolRequest, BulkEnableToolRequest,
+    BulkCreateResponse,
+    StreamResponse, TurnJobInfo, TurnJobResponse
 )
+from common.exceptions import MCPException
 from infra.database import get_db
+from utils.auth_util import AuthUtil
+from chat.infrastructure.admission import AdmissionController, AdmissionRejected
+from chat.infrastructure.batch import parse_jsonl
+from chat.infrastructure.history_cache import ChatHistoryCache
+from chat.infrastructure.job_queue import TurnJobQueue
+from chat.infrastructure.model_router import ModelEndpoint, ModelRouter
+from chat.infrastructure.response_cache import ResponseCache
+from chat.infrastructure.turn_stream import EVENT_DONE, EVENT_MESSAGE, EVENT_REPLAY, TurnStream, TurnStreamRegistry, parse_event_id
 from chat.infrastructure.repositories import (
     SourceRepository,
     PromptRepository,
@@ -31,6 +47,8 @@ from chat.domain.models.chat import (
     ChatToolEntity
 )
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 # 导入配置
@@ -44,7 +62,69 @@ chat_app_service = ChatApplicationService(
     mcp_server_url=chat_config.mcp_server_url,
     model=chat_config.default_model,
     api_key=chat_config.available_models[0].api_key if chat_config.available_models else "your-api-key",
-    api_base=chat_config.available_models[0].api_base if chat_config.available_models else "https://api.openai.com/v1"
+    api_base=chat_config.available_models[0].api_base if chat_config.available_models else "https://api.openai.com/v1",
+    stream=chat_config.stream,
+    timeout=chat_config.api_timeout,
+    sync_client=chat_config.available_models[0].sync_client if chat_config.available_models else False,
+    mcp_pool_size=chat_config.mcp_pool_size,
+    mcp_health_check_interval=chat_config.mcp_health_check_interval,
+    mcp_transport=chat_config.mcp_transport,
+    tool_cache_ttl=chat_config.tool_cache_ttl,
+    tool_call_concurrency=chat_config.tool_call_concurrency,
+    tool_call_timeout=chat_config.tool_call_timeout,
+    max_tokens=chat_config.max_tokens,
+    max_history_length=chat_config.max_history_length,
+    summarize_history=chat_config.summarize_history,
+    response_cache=ResponseCache(
+        sources=chat_config.response_cache_sources,
+        ttl=chat_config.response_cache_ttl,
+        max_entries=chat_config.response_cache_max_entries,
+        semantic_threshold=chat_config.response_cache_semantic_threshold,
+        idempotent_tools=chat_config.idempotent_tools
+    ) if chat_config.response_cache_sources else None,
+    # 同一模型的多个端点之间按延迟和错误率分配请求
+    model_router=ModelRouter(
+        [
+            ModelEndpoint(
+                name=model.name,
+                api_key=model.api_key,
+                api_base=model.api_base,
+                sync_client=model.sync_client
+            )
+            for model in chat_config.available_models
+        ],
+        ewma_alpha=chat_config.model_ewma_alpha,
+        failure_threshold=chat_config.model_failure_threshold,
+        recovery_timeout=chat_config.model_recovery_timeout,
+        hedge_percentile=chat_config.model_hedge_percentile,
+        hedge_budget=chat_config.model_hedge_budget
+    ) if chat_config.available_models else None,
+    coalesce_requests=chat_config.coalesce_requests,
+    admission=AdmissionController(
+        max_concurrent=chat_config.max_concurrent_turns,
+        max_queue=chat_config.max_queued_turns,
+        queue_timeout=chat_config.turn_queue_timeout,
+        source_weights=chat_config.source_weights
+    ) if chat_config.max_concurrent_turns > 0 else None,
+    turn_streams=TurnStreamRegistry(
+        max_events=chat_config.turn_stream_max_events,
+        retention=chat_config.turn_stream_retention
+    ),
+    history_cache=ChatHistoryCache(
+        max_chats=chat_config.history_cache_max_chats,
+        max_bytes=chat_config.history_cache_max_bytes,
+        window=chat_config.max_history_length
+    ) if chat_config.history_cache_max_chats > 0 else None,
+    job_queue=TurnJobQueue(
+        chat_config.turn_job_queue_path,
+        max_attempts=chat_config.turn_job_max_attempts,
+        owner=chat_config.turn_job_owner or None,
+        lease_seconds=chat_config.turn_job_lease_seconds
+    ) if chat_config.turn_job_workers > 0 else None,
+    job_workers=chat_config.turn_job_workers,
+    max_queued_jobs=chat_config.turn_job_max_queued,
+    max_jobs_per_user=chat_config.turn_job_max_per_user,
+    bulk_batch_size=chat_config.bulk_insert_batch_size
 )
 
 # Source endpoints
@@ -111,17 +191,69 @@ async def update_source(
     return SourceResponse(data=Source.from_orm(updated))
 
 @router.delete("/sources/{source_id}")
-async def delete_source(
-    source_id: int, 
-    db: AsyncSession = Depends(get_db)
-):
-    """删除源"""
-    source_repo = SourceRepository(db)
-    result = await source_repo.delete_source(source_id)
+async def delete_source(source_id: int):
+    """删除源，级联删除的聊天同时从历史缓存中移除"""
+    result = await chat_app_service.delete_source(source_id)
     if not result:
         raise HTTPException(status_code=404, detail="Source not found")
     return {"message": "Source deleted successfully"}
 
+def _check_bulk_size(count: int) -> None:
+    """批量写入接口的条数上限"""
+    if count > chat_config.bulk_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many items: {count} > {chat_config.bulk_max_items}"
+        )
+
+@router.post("/sources/{source_id}/prompts/bulk", response_model=BulkCreateResponse, status_code=status.HTTP_201_CREATED)
+async def create_prompts(source_id: int, request: PromptBulkCreate):
+    """为源批量创建提示词"""
+    _check_bulk_size(len(request.prompts))
+    prompts = [
+        PromptEntity(name=p.name, content=p.content, type=p.type, source_id=source_id, extra=p.extra)
+        for p in request.prompts
+    ]
+    total = await chat_app_service.create_prompts(source_id, prompts)
+    if total is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return BulkCreateResponse(total=total)
+
+@router.post("/sources/{source_id}/batch")
+async def run_source_batch(
+    source_id: int,
+    http_request: Request,
+    concurrency: int = Query(chat_config.batch_concurrency, ge=1),
+    max_retries: int = Query(chat_config.batch_max_retries, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    批量推理，请求体为 JSONL，每行包含 id、content，可选 extra 和 history；
+    每个条目使用源的系统提示词和工具独立执行，结果按完成顺序以 JSONL 流式返回
+    """
+    try:
+        items = parse_jsonl((await http_request.body()).decode("utf-8").splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    template = await chat_app_service.open_batch(db, source_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Source not found")
+    
+    async def result_generator():
+        results = chat_app_service.run_batch(
+            template,
+            items,
+            concurrency=min(concurrency, chat_config.batch_max_concurrency),
+            max_retries=max_retries,
+            retry_backoff=chat_config.batch_retry_backoff
+        )
+        # 客户端断开时停止剩余条目
+        async for result in cancel_on_disconnect(http_request, results):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(result_generator(), media_type="application/x-ndjson")
+
 # Chat endpoints
 @router.post("/chats", response_model=ChatResponse, status_code=status.HTTP_201_CREATED)
 async def create_chat(
@@ -157,21 +289,49 @@ async def list_user_chats(
         total=len(chats)
     )
 
+@router.delete("/users/{user_id}/chats")
+async def delete_user_chats(user_id: int):
+    """删除用户的所有聊天(软删除)"""
+    deleted = await chat_app_service.delete_user_chats(user_id=user_id)
+    return {"message": "Chats deleted successfully", "total": deleted}
+
 @router.get("/chats/{chat_id}/messages", response_model=MessageListResponse)
 async def list_chat_messages(
     chat_id: str, 
+    before: Optional[int] = Query(None, description="只返回ID小于该值的消息，传入当前页第一条消息的ID向前翻页"),
+    after: Optional[int] = Query(None, description="只返回ID大于该值的消息，传入当前页最后一条消息的ID获取新消息"),
+    limit: int = Query(100, ge=1, le=500),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取聊天消息列表"""
-    messages = await chat_app_service.list_messages(
+    """获取聊天消息列表，按消息ID游标分页，未指定游标时返回最新的一页"""
+    messages, has_more = await chat_app_service.list_messages(
         session=db,
-        chat_id=chat_id
+        chat_id=chat_id,
+        limit=limit,
+        before=before,
+        after=after
     )
     return MessageListResponse(
         data=[ChatData.from_orm(m) for m in messages],
-        total=len(messages)
+        total=len(messages),
+        has_more=has_more
     )
 
+@router.post("/chats/{chat_id}/messages/bulk", response_model=BulkCreateResponse, status_code=status.HTTP_201_CREATED)
+async def import_chat_messages(chat_id: str, request: ChatDataBulkCreate):
+    """向聊天批量导入历史消息"""
+    _check_bulk_size(len(request.messages))
+    messages = []
+    for m in request.messages:
+        message = ChatDataEntity(content=m.content, content_type=m.content_type, role=m.role, extra=m.extra)
+        if m.created_at:
+            message.created_at = m.created_at
+        messages.append(message)
+    total = await chat_app_service.import_messages(chat_id, messages)
+    if total is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return BulkCreateResponse(total=total)
+
 @router.post("/chat-tools", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def enable_tool(
     request: EnableToolRequest, 
@@ -200,28 +360,303 @@ async def enable_tool(
         )
     )
 
+@router.post("/chat-tools/bulk", response_model=BulkCreateResponse, status_code=status.HTTP_201_CREATED)
+async def enable_tools(request: BulkEnableToolRequest):
+    """为多个聊天批量添加工具"""
+    _check_bulk_size(len(request.items))
+    total, missing = await chat_app_service.create_chat_tools(
+        [(item.chat_id, item.tool_id, item.parameters) for item in request.items]
+    )
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Chat not found: {', '.join(missing)}")
+    return BulkCreateResponse(total=total)
+
+def _too_many_requests(e: AdmissionRejected) -> JSONResponse:
+    """未准入时的 429 响应"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"code": status.HTTP_429_TOO_MANY_REQUESTS, "err_msg": e.reason, "status": "failure"},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def _to_stream_response(data: Dict[str, Any]) -> StreamResponse:
+    return StreamResponse(
+        content=data["content"],
+        content_type=data["content_type"],
+        delta=data.get("delta", False),
+        extra=data.get("extra")
+    )
+
+async def _sse_events(http_request: Request, stream: TurnStream, after: int):
+    """将对话流转换为 SSE 事件，客户端断开只结束订阅，不影响生成"""
+    async for event, seq, data in cancel_on_disconnect(http_request, stream.subscribe(after)):
+        if event == EVENT_MESSAGE:
+            payload = _to_stream_response(data).json()
+        elif isinstance(data, list):
+            payload = "[" + ",".join(_to_stream_response(item).json() for item in data) + "]"
+        else:
+            payload = json.dumps(data or {}, ensure_ascii=False)
+        yield format_sse(event, stream.event_id(seq), payload)
+
 @router.post("/chat-data")
 async def send_message(
     request: SendMessageRequest, 
-    db: AsyncSession = Depends(get_db)
+    http_request: Request
 ):
-    """发送消息，返回流式响应"""
+    """发送消息，返回流式响应；数据库会话由应用服务按读写需要短暂获取，不在整个流式响应期间占用"""
+    
+    # 开始输出之前完成准入，未准入时还能返回 429
+    try:
+        ticket = await chat_app_service.admit(request.chat_id)
+    except AdmissionRejected as e:
+        return _too_many_requests(e)
+    release = ticket.release if ticket else (lambda: None)
     
     # 创建一个异步生成器，将应用服务的响应转换为适合流式响应的格式
     async def response_generator():
-        async for response in chat_app_service.send_message(
-            session=db,
+        # 客户端断开后取消本轮对话，不再占用模型配额和工具调用
+        turn = chat_app_service.send_message(
             chat_id=request.chat_id,
             message_content=request.content
-        ):
-            # 将应用服务响应转换为JSON字符串
-            yield StreamResponse(
-                content=response["content"],
-                content_type=response["content_type"]
-            ).json() + "\n"
-    
-    # 返回流式响应
+        )
+        try:
+            async for response in cancel_on_disconnect(http_request, turn):
+                # 将应用服务响应转换为JSON字符串
+                yield _to_stream_response(response).json() + "\n"
+        finally:
+            release()
+    
+    # 返回流式响应；生成器未被启动时由后台任务兜底释放名额
     return StreamingResponse(
         response_generator(),
-        media_type="application/x-ndjson"
-    ) 
\ No newline at end of file
+        media_type="application/x-ndjson",
+        background=BackgroundTask(release)
+    )
+
+@router.post("/chat-data/sse")
+async def send_message_sse(
+    request: SendMessageRequest,
+    http_request: Request
+):
+    """发送消息，返回可续传的 SSE 流，事件ID为 "<turn_id>:<序号>" """
+    try:
+        ticket = await chat_app_service.admit(request.chat_id)
+    except AdmissionRejected as e:
+        return _too_many_requests(e)
+    
+    # 对话在后台运行，连接断开后仍会完成并保存
+    stream = chat_app_service.start_turn(request.chat_id, request.content, ticket)
+    return StreamingResponse(
+        _sse_events(http_request, stream, 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Turn-Id": stream.turn_id}
+    )
+
+@router.get("/chat-data/sse/{chat_id}")
+async def resume_message_sse(
+    chat_id: str,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """断线重连，按 Last-Event-ID 从断点继续；对话已结束且不在内存中时从数据库回放"""
+    turn_id, seq = parse_event_id(last_event_id)
+    if not turn_id:
+        raise HTTPException(status_code=400, detail="缺少有效的 Last-Event-ID")
+    
+    stream = chat_app_service.get_turn_stream(turn_id)
+    if stream and stream.chat_id == chat_id:
+        return StreamingResponse(
+            _sse_events(http_request, stream, seq),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Turn-Id": turn_id}
+        )
+    
+    messages = await chat_app_service.replay_turn(db, chat_id, turn_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="对话不存在或已过期")
+    return _replay_response(turn_id, seq, messages)
+
+def _replay_response(turn_id: str, seq: int, messages: List[ChatDataEntity]) -> StreamingResponse:
+    """对话已结束且不在内存中时，以一个 replay 事件返回数据库中保存的完整消息"""
+    async def replay_events():
+        payload = "[" + ",".join(
+            StreamResponse(
+                content=message.content,
+                content_type=message.content_type,
+                extra=message.extra
+            ).json()
+            for message in messages
+        ) + "]"
+        event_id = f"{turn_id}:{seq}"
+        yield format_sse(EVENT_REPLAY, event_id, payload)
+        yield format_sse(EVENT_DONE, event_id, "{}")
+    
+    return StreamingResponse(
+        replay_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Turn-Id": turn_id}
+    )
+
+def _job_not_enabled() -> HTTPException:
+    return HTTPException(status_code=404, detail="未启用任务模式")
+
+@router.post("/chat-data/jobs", response_model=TurnJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_message_job(request: SendMessageRequest):
+    """以任务模式发送消息，立即返回任务ID，之后轮询任务状态或订阅对话流"""
+    if not chat_app_service.job_pool:
+        raise _job_not_enabled()
+    try:
+        job = await chat_app_service.submit_job(request.chat_id, request.content)
+    except AdmissionRejected as e:
+        return _too_many_requests(e)
+    if not job:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return TurnJobResponse(data=TurnJobInfo.from_orm(job))
+
+@router.get("/chat-data/jobs/{job_id}", response_model=TurnJobResponse)
+async def get_message_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """轮询任务状态，任务成功后返回本轮产生的消息"""
+    if not chat_app_service.job_pool:
+        raise _job_not_enabled()
+    job = await chat_app_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    info = TurnJobInfo.from_orm(job)
+    if job.finished:
+        messages = await chat_app_service.replay_turn(db, job.chat_id, job.id)
+        info.messages = [ChatData.from_orm(m) for m in messages]
+    return TurnJobResponse(data=info)
+
+@router.get("/chat-data/jobs/{job_id}/sse")
+async def attach_message_job(
+    job_id: str,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """订阅任务的对话流，支持按 Last-Event-ID 续传；任务已结束且不在内存中时从数据库回放"""
+    if not chat_app_service.job_pool:
+        raise _job_not_enabled()
+    job = await chat_app_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    _, seq = parse_event_id(last_event_id)
+    
+    stream = chat_app_service.attach_job(job)
+    if stream:
+        return StreamingResponse(
+            _sse_events(http_request, stream, seq),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Turn-Id": job.id}
+        )
+    
+    messages = await chat_app_service.replay_turn(db, job.chat_id, job.id)
+    return _replay_response(job.id, seq, messages)
+
+@router.websocket("/ws/{chat_id}")
+async def chat_websocket(
+    websocket: WebSocket,
+    chat_id: str,
+    token: Optional[str] = Query(None)
+):
+    """
+    长连接聊天，连接建立时认证一次，之后在同一连接上进行多轮对话
+    
+    客户端发送 {"content": "..."} 开始一轮对话，{"type": "cancel"} 取消当前对话；
+    服务端依次返回 message 事件，每轮以 done 事件结束。
+    """
+    # 认证中间件不处理 WebSocket，这里在接受连接前认证；浏览器无法设置请求头时可用 token 参数
+    authorization = websocket.headers.get("Authorization", "")
+    token = token or (authorization[7:] if authorization.lower().startswith("bearer ") else None)
+    if not token:
+        await websocket.close(code=4401)
+        return
+    try:
+        user, _ = await AuthUtil.verify(token, websocket)
+    except MCPException as e:
+        logger.info(f"WebSocket认证失败: {str(e)}")
+        await websocket.close(code=4401)
+        return
+    
+    state = await chat_app_service.open_session(chat_id, user.id, user.is_superuser)
+    if not state:
+        await websocket.close(code=4404)
+        return
+    
+    await websocket.accept()
+    await websocket.send_json({"type": "ready", "chat_id": chat_id})
+    
+    # 接收循环与对话并行，断开或取消时立即中止进行中的对话
+    turn: Optional[asyncio.Task] = None
+    try:
+        while True:
+            # 不用 receive_json：格式错误的帧只返回错误，不中断连接
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            try:
+                data = parse_client_frame(message.get("text"))
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "code": 400, "err_msg": str(e)})
+                continue
+            if data.get("type") == "cancel":
+                if turn and not turn.done():
+                    turn.cancel()
+                continue
+            if turn and not turn.done():
+                await websocket.send_json({"type": "error", "code": 409, "err_msg": "上一轮对话尚未结束"})
+                continue
+            content = (data.get("content") or "").strip()
+            if not content:
+                await websocket.send_json({"type": "error", "code": 400, "err_msg": "消息内容不能为空"})
+                continue
+            turn = asyncio.create_task(_websocket_turn(websocket, state, content))
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket已断开: {chat_id}, 共 {state.turns} 轮对话")
+    finally:
+        if turn and not turn.done():
+            turn.cancel()
+            await asyncio.gather(turn, return_exceptions=True)
+
+async def _websocket_turn(websocket: WebSocket, state: ChatSessionState, content: str):
+    """在长连接上执行一轮对话"""
+    ticket = None
+    if chat_app_service.admission:
+        try:
+            ticket = await chat_app_service.admission.acquire(state.chat.user_id, state.chat.source_id)
+        except AdmissionRejected as e:
+            await websocket.send_json({
+                "type": "error",
+                "code": status.HTTP_429_TOO_MANY_REQUESTS,
+                "err_msg": e.reason,
+                "retry_after": e.retry_after
+            })
+            return
+    
+    try:
+        async for response in chat_app_service.session_turn(state, content):
+            await websocket.send_json({"type": "message", **_to_stream_response(response).dict()})
+        await websocket.send_json({"type": "done"})
+    except asyncio.CancelledError:
+        # 客户端主动取消时告知本轮结束；连接已断开时无需通知
+        if websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.send_json({"type": "done", "cancelled": True})
+            except Exception:
+                pass
+        raise
+    except Exception as e:
+        logger.error(f"WebSocket对话失败: {state.chat.chat_id}, {str(e)}")
+        await websocket.send_json({"type": "error", "code": 500, "err_msg": "对话执行失败"})
+    finally:
+        if ticket:
+            ticket.release()
+
+@router.get("/metrics")
+async def get_metrics():
+    """获取聊天服务运行指标"""
+    return chat_app_service.metrics()
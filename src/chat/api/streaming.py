@@ -0,0 +1,101 @@
+"""
+流式响应的辅助函数。
+"""
+import asyncio
+import json
+import logging
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """等待客户端断开连接"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    generator: AsyncGenerator[Any, None]
+) -> AsyncGenerator[Any, None]:
+    """
+    转发生成器的输出，客户端断开时立即取消生成器
+
+    StreamingResponse 只有在下一次写入时才会发现连接已断开，
+    等待LLM或工具调用期间无法感知；这里单独监听断开事件，
+    断开后取消正在等待的上游请求，并关闭生成器让其执行清理逻辑。
+
+    Args:
+        request: 当前请求
+        generator: 产生响应内容的异步生成器
+
+    Yields:
+        生成器的输出
+    """
+    watcher = asyncio.create_task(wait_for_disconnect(request))
+    step: Optional[asyncio.Future] = None
+    try:
+        while True:
+            step = asyncio.ensure_future(generator.__anext__())
+            await asyncio.wait({step, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                logger.info("客户端已断开连接，取消进行中的对话")
+                break
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                break
+            yield item
+    finally:
+        watcher.cancel()
+        if step is not None and not step.done():
+            # 取消会抛入生成器当前等待的位置，生成器随之结束
+            step.cancel()
+            await asyncio.gather(step, return_exceptions=True)
+        await generator.aclose()
+
+
+def parse_client_frame(text: Optional[str]) -> Dict[str, Any]:
+    """
+    解析 WebSocket 客户端发送的一帧消息
+
+    Args:
+        text: 文本帧的内容，二进制帧为空
+
+    Returns:
+        消息对象
+
+    Raises:
+        ValueError: 不是文本帧、不是JSON对象，或 content 不是字符串
+    """
+    if text is None:
+        raise ValueError("只支持JSON文本消息")
+    try:
+        data = json.loads(text)
+    except (ValueError, RecursionError):
+        raise ValueError("消息不是有效的JSON")
+    if not isinstance(data, dict):
+        raise ValueError("消息必须是JSON对象")
+    if data.get("content") is not None and not isinstance(data["content"], str):
+        raise ValueError("消息内容必须是字符串")
+    return data
+
+
+def format_sse(event: str, event_id: str, data: Any) -> str:
+    """
+    格式化一个 SSE 事件
+
+    Args:
+        event: 事件类型
+        event_id: 事件ID
+        data: 已序列化的JSON数据
+
+    Returns:
+        SSE 文本
+    """
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
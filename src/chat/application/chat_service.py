@@ -1,3 +1,8 @@
+import asyncio
+import logging
+import uuid
+from contextlib import aclosing
+from dataclasses import dataclass, field, replace
 from typing import List, Optional, Tuple, Dict, Any, AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -12,16 +17,38 @@ from ..domain.models.chat import (
 from ..domain.models.enums import ContentType, PromptType, Role
 from ..domain.services.chat_service import ChatDomainService
 from ..domain.services.llm_service import LLMDomainService
-from ...infra.database import UnitOfWork
+from ...infra.database import AutocommitSession, UnitOfWork
+from ..infrastructure.admission import AdmissionController, AdmissionRejected, AdmissionTicket
+from ..infrastructure.batch import BatchRunner
+from ..infrastructure.history_cache import ChatHistoryCache
+from ..infrastructure.job_queue import TurnJob, TurnJobQueue, TurnWorkerPool
+from ..infrastructure.llm_executor import sync_llm_executor
+from ..infrastructure.mcp_pool import close_mcp_session_pools, get_mcp_session_pool, is_local_url
+from ..infrastructure.model_router import ModelEndpoint, ModelRouter
+from ..infrastructure.response_cache import ResponseCache
+from ..infrastructure.singleflight import SingleFlight
+from ..infrastructure.tool_cache import ToolCatalogCache, current_server_version
+from ..infrastructure.turn_stream import TurnStream, TurnStreamRegistry
 from ..infrastructure.repositories import (
     ChatRepository,
     ChatDataRepository,
     ChatToolRepository,
+    ChatSummaryRepository,
     SourceRepository,
     PromptRepository,
     ToolRepository
 )
 
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ChatSessionState:
+    """长连接会话的状态，在连接存续期间保存在内存中"""
+    chat: ChatEntity
+    user_id: int
+    history: List[ChatDataEntity] = field(default_factory=list)
+    turns: int = 0
+
 class ChatApplicationService:
     """聊天应用服务，协调领域服务和仓储"""
     
@@ -30,31 +57,108 @@ class ChatApplicationService:
         mcp_server_url: str, 
         model: str, 
         api_key: str, 
-        api_base: str
+        api_base: str,
+        stream: bool = True,
+        timeout: Optional[float] = None,
+        sync_client: bool = False,
+        mcp_pool_size: int = 4,
+        mcp_health_check_interval: float = 30.0,
+        mcp_transport: str = "auto",
+        tool_cache_ttl: float = 300.0,
+        tool_call_concurrency: int = 4,
+        tool_call_timeout: Optional[float] = 30.0,
+        max_tokens: int = 4096,
+        max_history_length: int = 20,
+        summarize_history: bool = True,
+        response_cache: Optional[ResponseCache] = None,
+        model_router: Optional[ModelRouter] = None,
+        coalesce_requests: bool = True,
+        admission: Optional[AdmissionController] = None,
+        turn_streams: Optional[TurnStreamRegistry] = None,
+        history_cache: Optional[ChatHistoryCache] = None,
+        job_queue: Optional[TurnJobQueue] = None,
+        job_workers: int = 4,
+        max_queued_jobs: int = 1000,
+        max_jobs_per_user: int = 0,
+        bulk_batch_size: int = 1000
     ):
         self.mcp_server_url = mcp_server_url
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
-    
-    def _create_chat_domain_service(self, session: AsyncSession) -> ChatDomainService:
-        """创建聊天领域服务"""
+        self.stream = stream
+        self.timeout = timeout
+        self.sync_client = sync_client
+        self.mcp_pool = get_mcp_session_pool(
+            mcp_server_url,
+            transport=mcp_transport,
+            max_size=mcp_pool_size,
+            health_check_interval=mcp_health_check_interval
+        )
+        self.tool_cache = ToolCatalogCache(ttl=tool_cache_ttl)
+        # 进程内的工具注册版本只对应当前服务自身，远程MCP服务的缓存按TTL过期
+        self.tool_version = current_server_version if is_local_url(mcp_server_url) else None
+        self.tool_call_concurrency = tool_call_concurrency
+        self.tool_call_timeout = tool_call_timeout
+        self.max_tokens = max_tokens
+        self.max_history_length = max_history_length
+        self.summarize_history = summarize_history
+        self.response_cache = response_cache
+        # 未配置路由时只使用给定的单个端点
+        self.model_router = model_router or ModelRouter([
+            ModelEndpoint(name=model, api_key=api_key, api_base=api_base, sync_client=sync_client)
+        ])
+        self.singleflight = SingleFlight() if coalesce_requests else None
+        self.admission = admission
+        self.history_cache = history_cache
+        # 可续传的对话流，以及在后台运行的对话任务
+        self.turn_streams = turn_streams or TurnStreamRegistry()
+        self._turn_tasks = set()
+        # 后台的摘要刷新任务，按聊天主键单飞
+        self._summary_tasks: Dict[int, asyncio.Task] = {}
+        # 任务模式：对话在固定数量的工作协程中执行，队列持久化到本地
+        self.job_pool = TurnWorkerPool(
+            job_queue,
+            self._run_job,
+            workers=job_workers,
+            max_queued=max_queued_jobs,
+            max_pending_per_user=max_jobs_per_user
+        ) if job_queue else None
+        # 批量写入时每条INSERT语句的行数
+        self.bulk_batch_size = bulk_batch_size
+
+    async def start(self) -> None:
+        """启动后台任务，由应用生命周期调用"""
+        if self.job_pool:
+            await self.job_pool.start()
+
+    def _create_chat_domain_service(self, session: AsyncSession, uow: Optional[UnitOfWork] = None) -> ChatDomainService:
+        """创建聊天领域服务，在工作单元中写入时传入 uow，事务未提交时撤销对历史缓存的修改"""
         chat_repo = ChatRepository(session)
         chat_data_repo = ChatDataRepository(session)
         chat_tool_repo = ChatToolRepository(session)
         source_repo = SourceRepository(session)
         prompt_repo = PromptRepository(session)
+        chat_summary_repo = ChatSummaryRepository(session)
         
         return ChatDomainService(
             chat_repo=chat_repo,
             chat_data_repo=chat_data_repo,
             chat_tool_repo=chat_tool_repo,
             source_repo=source_repo,
-            prompt_repo=prompt_repo
+            prompt_repo=prompt_repo,
+            chat_summary_repo=chat_summary_repo,
+            history_cache=self.history_cache,
+            on_rollback=uow.on_rollback if uow else None
         )
     
-    def _create_llm_domain_service(self, session: AsyncSession) -> LLMDomainService:
-        """创建LLM领域服务"""
+    def _create_llm_domain_service(
+        self,
+        session: AsyncSession,
+        stream: Optional[bool] = None,
+        summarize_history: Optional[bool] = None
+    ) -> LLMDomainService:
+        """创建LLM领域服务，stream 和 summarize_history 为空时使用服务配置"""
         chat_domain_service = self._create_chat_domain_service(session)
         
         return LLMDomainService(
@@ -62,7 +166,22 @@ class ChatApplicationService:
             model=self.model,
             api_key=self.api_key,
             api_base=self.api_base,
-            chat_domain_service=chat_domain_service
+            chat_domain_service=chat_domain_service,
+            model_router=self.model_router,
+            mcp_pool=self.mcp_pool,
+            stream=self.stream if stream is None else stream,
+            timeout=self.timeout,
+            sync_executor=sync_llm_executor,
+            tool_cache=self.tool_cache,
+            tool_version=self.tool_version,
+            tool_call_concurrency=self.tool_call_concurrency,
+            tool_call_timeout=self.tool_call_timeout,
+            max_tokens=self.max_tokens,
+            max_history_length=self.max_history_length,
+            summarize_history=self.summarize_history if summarize_history is None else summarize_history,
+            response_cache=self.response_cache,
+            singleflight=self.singleflight,
+            summary_tasks=self._summary_tasks
         )
     
     async def create_chat(
@@ -94,44 +213,415 @@ class ChatApplicationService:
             extra=extra
         )
     
+    async def admit(self, chat_id: str) -> Optional[AdmissionTicket]:
+        """
+        申请开始一轮对话，按聊天所属的用户和源公平排队
+        
+        查询聊天使用独立的短会话，排队等待期间不占用数据库连接。
+        
+        Args:
+            chat_id: 聊天ID
+            
+        Returns:
+            准入凭证，对话结束后需要释放；未启用准入控制时为空
+            
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        if not self.admission:
+            return None
+        
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session)
+            chat = await chat_service.get_chat_by_chat_id(chat_id)
+        user_id = chat.user_id if chat else None
+        source_id = chat.source_id if chat else None
+        return await self.admission.acquire(user_id, source_id)
+    
     async def send_message(
         self,
-        session: AsyncSession,
         chat_id: str,
-        message_content: str
+        message_content: Optional[str],
+        turn_id: Optional[str] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         发送消息
         
+        数据库连接只在读写期间占用: 读取聊天、写入用户消息和读取历史在一个短事务中完成并提交，
+        等待LLM和工具调用期间不持有连接，摘要和本轮消息的写入各自使用短事务。
+        
         Args:
-            session: 数据库会话
             chat_id: 聊天ID
+            message_content: 消息内容，为空时用户消息已保存，直接按已有历史进行对话
+            turn_id: 对话轮ID，可续传的对话流使用
+            
+        Yields:
+            响应内容
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session, uow)
+            
+            # 获取聊天实体
+            chat = await chat_service.get_chat_by_chat_id(chat_id)
+            if not chat:
+                return
+            
+            # 创建用户消息
+            if message_content is not None:
+                await chat_service.create_message(
+                    chat_id=chat.id,
+                    content=message_content,
+                    role=Role.USER
+                )
+            
+            # 获取聊天历史，活跃聊天直接使用缓存
+            messages = await chat_service.get_chat_messages(chat)
+            await uow.commit()
+        
+        llm_service = self._create_llm_domain_service(AutocommitSession())
+        
+        # 与LLM对话，连接断开时关闭对话生成器，使其取消工具调用并保存已生成的内容
+        async with aclosing(llm_service.chat(chat, messages, turn_id=turn_id)) as responses:
+            async for response in responses:
+                yield response
+    
+    async def open_session(
+        self,
+        chat_id: str,
+        user_id: int,
+        is_superuser: bool = False
+    ) -> Optional[ChatSessionState]:
+        """
+        打开长连接会话，加载聊天和历史消息
+        
+        Args:
+            chat_id: 聊天ID
+            user_id: 当前用户ID
+            is_superuser: 是否超级用户，超级用户可以访问其他用户的聊天
+            
+        Returns:
+            会话状态，聊天不存在或不属于当前用户时为空
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session)
+            chat = await chat_service.get_chat_by_chat_id(chat_id)
+            if not chat or chat.is_deleted or (chat.user_id != user_id and not is_superuser):
+                return None
+            history = await chat_service.get_chat_messages(chat)
+        return ChatSessionState(chat=chat, user_id=user_id, history=history)
+    
+    async def session_turn(
+        self,
+        state: ChatSessionState,
+        message_content: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        在长连接会话中进行一轮对话
+        
+        聊天实体和历史消息来自内存，只有写入需要访问数据库；与 send_message 一样，
+        等待LLM期间不持有数据库连接。
+        
+        Args:
+            state: 会话状态
             message_content: 消息内容
             
         Yields:
             响应内容
         """
-        chat_service = self._create_chat_domain_service(session)
-        llm_service = self._create_llm_domain_service(session)
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session, uow)
+            
+            # 批量写入的消息没有ID，移出上下文窗口前需要从数据库重新加载，以便折叠进摘要
+            window = len(state.history) - self.max_history_length
+            if any(message.id is None for message in state.history[:max(window, 0)]):
+                state.history = await chat_service.get_messages(state.chat.chat_id)
+            
+            # 用户消息立即提交，用户取消或断开时也会保留
+            user_message = await chat_service.create_message(
+                chat_id=state.chat.id,
+                content=message_content,
+                role=Role.USER
+            )
+            await uow.commit()
+        state.history.append(user_message)
         
-        # 获取聊天实体
-        chat = await chat_service.get_chat_by_chat_id(chat_id)
-        if not chat:
-            return
+        llm_service = self._create_llm_domain_service(AutocommitSession())
+        try:
+            async with aclosing(llm_service.chat(state.chat, state.history)) as responses:
+                async for response in responses:
+                    yield response
+        finally:
+            # 已生成的部分在对话生成器关闭时写入
+            state.history.extend(llm_service.message_buffer.saved)
+            # 只保留最近的消息，更早的已折叠进摘要
+            state.history = state.history[-max(self.max_history_length * 2, 100):]
+            state.turns += 1
+    
+    def start_turn(
+        self,
+        chat_id: str,
+        message_content: str,
+        ticket: Optional[AdmissionTicket] = None
+    ) -> TurnStream:
+        """
+        在后台开始一轮对话，输出写入可续传的对话流
         
-        # 创建用户消息
-        await chat_service.create_message(
-            chat_id=chat.id,
-            content=message_content,
-            role=Role.USER
-        )
+        对话不依赖客户端连接，断线重连后可以从断点继续接收。
+        
+        Args:
+            chat_id: 聊天ID
+            message_content: 消息内容
+            ticket: 准入凭证，对话结束后释放
+            
+        Returns:
+            对话流
+        """
+        stream = self.turn_streams.create(chat_id)
+        task = asyncio.create_task(self._run_turn(stream, message_content, ticket))
+        self._turn_tasks.add(task)
+        task.add_done_callback(self._turn_tasks.discard)
+        return stream
+    
+    async def _run_turn(
+        self,
+        stream: TurnStream,
+        message_content: Optional[str],
+        ticket: Optional[AdmissionTicket]
+    ) -> None:
+        """运行一轮对话，数据库读写在 send_message 中按需使用短事务"""
+        try:
+            turn = self.send_message(
+                stream.chat_id,
+                message_content,
+                turn_id=stream.turn_id
+            )
+            async with aclosing(turn) as responses:
+                async for response in responses:
+                    stream.publish(response)
+            stream.close()
+        except asyncio.CancelledError:
+            self._invalidate_history(stream.chat_id)
+            stream.close("对话已取消")
+            raise
+        except Exception as e:
+            logger.error(f"对话执行失败: {stream.turn_id}, {str(e)}")
+            self._invalidate_history(stream.chat_id)
+            stream.close("对话执行失败")
+        finally:
+            if ticket:
+                ticket.release()
+    
+    async def submit_job(
+        self,
+        chat_id: str,
+        message_content: str
+    ) -> Optional[TurnJob]:
+        """
+        以任务模式发送消息，立即返回任务，对话由工作协程在后台执行
+        
+        用户消息在入队前写入并提交，记录任务ID作为对话轮ID；工作协程按已有历史进行对话，
+        任务重新执行时不会重复写入用户消息。
+        
+        Args:
+            chat_id: 聊天ID
+            message_content: 消息内容
+            
+        Returns:
+            任务，聊天不存在时为空；任务ID同时是对话轮ID，可用于订阅对话流
+            
+        Raises:
+            AdmissionRejected: 排队的任务过多，或该用户未结束的任务过多
+        """
+        job_id = uuid.uuid4().hex
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session, uow)
+            chat = await chat_service.get_chat_by_chat_id(chat_id)
+            if not chat:
+                return None
+            await chat_service.create_message(
+                chat_id=chat.id,
+                content=message_content,
+                role=Role.USER,
+                extra={"turn_id": job_id}
+            )
+            await uow.commit()
+        
+        job = await self.job_pool.submit(chat_id, message_content, job_id, chat.user_id)
+        if not job:
+            # 未入队的任务不会执行，撤回已保存的用户消息
+            async with UnitOfWork() as uow:
+                chat_service = self._create_chat_domain_service(uow.session)
+                await chat_service.delete_turn_messages(chat, job_id)
+                await uow.commit()
+            raise AdmissionRejected("排队的对话任务过多", retry_after=5)
+        # 对话流在订阅(attach_job)或工作协程开始执行时创建
+        return job
+    
+    async def _run_job(self, job: TurnJob) -> None:
+        """工作协程执行一个对话任务，失败时抛出异常"""
+        if job.attempts > 1:
+            # 上次执行被中断，删除已保存的部分回复，从用户消息重新开始
+            async with UnitOfWork() as uow:
+                chat_service = self._create_chat_domain_service(uow.session)
+                chat = await chat_service.get_chat_by_chat_id(job.chat_id)
+                if chat:
+                    await chat_service.delete_turn_messages(chat, job.id, replies_only=True)
+                await uow.commit()
+        stream = self.turn_streams.create(job.chat_id, job.id)
+        await self._run_turn(stream, None, None)
+        if stream.error:
+            raise RuntimeError(stream.error)
+    
+    async def get_job(self, job_id: str) -> Optional[TurnJob]:
+        """
+        获取任务状态
+        
+        Args:
+            job_id: 任务ID
+            
+        Returns:
+            任务，不存在时为空
+        """
+        return await self.job_pool.queue.get(job_id)
+    
+    def attach_job(self, job: TurnJob) -> Optional[TurnStream]:
+        """
+        获取任务的对话流，未结束的任务还没有对话流时新建一个，工作协程开始执行后写入其中；
+        没有订阅者且一直未开始的对话流由注册表按保留时间移除
         
-        # 获取聊天历史
-        messages = await chat_service.get_messages(chat_id)
+        Args:
+            job: 任务
+            
+        Returns:
+            对话流，任务已结束且对话流已过期时为空
+        """
+        stream = self.turn_streams.get(job.id)
+        if stream or job.finished:
+            return stream
+        return self.turn_streams.create(job.chat_id, job.id)
+    
+    def _invalidate_history(self, chat_id: str) -> None:
+        """事务回滚后，缓存中已追加的消息并未保存，需要重新加载"""
+        if self.history_cache:
+            self.history_cache.invalidate(chat_id)
+    
+    def get_turn_stream(self, turn_id: str) -> Optional[TurnStream]:
+        """
+        获取仍在内存中的对话流
         
-        # 与LLM对话
-        async for response in llm_service.chat(chat, messages):
-            yield response
+        Args:
+            turn_id: 对话轮ID
+            
+        Returns:
+            对话流，已过期或不在本进程时为空
+        """
+        return self.turn_streams.get(turn_id)
+    
+    async def replay_turn(
+        self,
+        session: AsyncSession,
+        chat_id: str,
+        turn_id: str
+    ) -> List[ChatDataEntity]:
+        """
+        从数据库读取已结束的一轮对话，用于回放
+        
+        Args:
+            session: 数据库会话
+            chat_id: 聊天ID
+            turn_id: 对话轮ID
+            
+        Returns:
+            本轮产生的消息
+        """
+        chat_service = self._create_chat_domain_service(session)
+        return await chat_service.get_turn_messages(chat_id, turn_id)
+    
+    async def open_batch(
+        self,
+        session: AsyncSession,
+        source_id: int
+    ) -> Optional[ChatEntity]:
+        """
+        准备批量推理，加载源的系统提示词
+        
+        Args:
+            session: 数据库会话
+            source_id: 源ID
+            
+        Returns:
+            作为模板的临时聊天实体，源不存在时为空
+        """
+        chat_service = self._create_chat_domain_service(session)
+        chat, source = await chat_service.prepare_chat("batch", 0, source_id)
+        return chat if source else None
+    
+    async def run_batch(
+        self,
+        template: ChatEntity,
+        items: List[Dict[str, Any]],
+        concurrency: int = 8,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        批量推理，每个条目是一轮独立的无状态对话，使用源的系统提示词和工具，不保存消息
+        
+        Args:
+            template: open_batch 返回的聊天实体
+            items: 条目列表，包含 id、content，可选 extra(格式化系统提示词)和 history(之前的消息)
+            concurrency: 同时执行的条目数
+            max_retries: 可重试错误的最大重试次数
+            retry_backoff: 首次重试的等待秒数，之后指数增长
+            
+        Yields:
+            结果，按完成顺序输出
+        """
+        async def handle(item: Dict[str, Any]) -> Dict[str, Any]:
+            # 批量推理不需要流式输出；上下文只有本条目，不生成摘要。
+            # 条目并发执行，不能共用一个会话；不保存消息，按需读取时各自使用短事务
+            llm_service = self._create_llm_domain_service(
+                AutocommitSession(),
+                stream=False,
+                summarize_history=False
+            )
+            chat = replace(template, extra=item.get("extra") or template.extra)
+            history = [
+                ChatDataEntity(content=message["content"], role=message["role"])
+                for message in item.get("history") or []
+            ]
+            history.append(ChatDataEntity(content=item["content"], role=Role.USER))
+            
+            produced = await llm_service.complete(chat, history)
+            answer = next(
+                (
+                    m.content for m in reversed(produced)
+                    if m.role == Role.ASSISTANT and m.content_type == ContentType.MSG
+                ),
+                ""
+            )
+            return {
+                "content": answer,
+                "messages": [
+                    {
+                        "role": m.role,
+                        "content": m.content,
+                        "content_type": m.content_type,
+                        "extra": m.extra
+                    }
+                    for m in produced
+                ]
+            }
+        
+        runner = BatchRunner(
+            handle,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            retry_backoff=retry_backoff
+        )
+        async with aclosing(runner.run(items)) as results:
+            async for result in results:
+                yield result
     
     async def create_chat_tool(
         self,
@@ -166,23 +656,103 @@ class ChatApplicationService:
             parameters=parameters
         )
     
+    async def import_messages(self, chat_id: str, messages: List[ChatDataEntity]) -> Optional[int]:
+        """
+        向聊天批量导入历史消息，在独立的事务中写入并提交
+        
+        Args:
+            chat_id: 聊天ID
+            messages: 按时间顺序排列的消息，chat_id 字段会被覆盖
+            
+        Returns:
+            写入的消息数，聊天不存在时为空
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session, uow)
+            chat = await chat_service.get_chat_by_chat_id(chat_id)
+            if not chat or chat.is_deleted:
+                return None
+            for message in messages:
+                message.chat_id = chat.id
+            await chat_service.create_messages(messages, batch_size=self.bulk_batch_size)
+            await uow.commit()
+        return len(messages)
+    
+    async def create_prompts(self, source_id: int, prompts: List[PromptEntity]) -> Optional[int]:
+        """
+        为源批量创建提示词，在独立的事务中写入并提交
+        
+        Args:
+            source_id: 源ID
+            prompts: 提示词列表，source_id 字段会被覆盖
+            
+        Returns:
+            写入的提示词数，源不存在时为空
+        """
+        async with UnitOfWork() as uow:
+            source = await SourceRepository(uow.session).get_source(source_id)
+            if not source:
+                return None
+            for prompt in prompts:
+                prompt.source_id = source_id
+            chat_service = self._create_chat_domain_service(uow.session)
+            await chat_service.create_prompts(prompts, batch_size=self.bulk_batch_size)
+            await uow.commit()
+        return len(prompts)
+    
+    async def create_chat_tools(
+        self,
+        items: List[Tuple[str, int, Dict[str, Any]]]
+    ) -> Tuple[int, List[str]]:
+        """
+        为多个聊天批量添加工具，在独立的事务中写入并提交
+        
+        Args:
+            items: (聊天ID, 工具ID, 参数) 列表
+            
+        Returns:
+            写入的条数，以及不存在的聊天ID；有不存在的聊天时不写入任何数据
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session)
+            chat_ids = list(dict.fromkeys(chat_id for chat_id, _, _ in items))
+            chats = await chat_service.get_chats_by_chat_ids(chat_ids)
+            pks = {chat.chat_id: chat.id for chat in chats if not chat.is_deleted}
+            missing = [chat_id for chat_id in chat_ids if chat_id not in pks]
+            if missing:
+                return 0, missing
+            
+            chat_tools = [
+                ChatToolEntity(chat_id=pks[chat_id], tool_id=tool_id, parameters=parameters)
+                for chat_id, tool_id, parameters in items
+            ]
+            await chat_service.create_tools(chat_tools, batch_size=self.bulk_batch_size)
+            await uow.commit()
+        return len(chat_tools), []
+    
     async def list_messages(
         self,
         session: AsyncSession,
-        chat_id: str
-    ) -> List[ChatDataEntity]:
+        chat_id: str,
+        limit: int = 100,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> Tuple[List[ChatDataEntity], bool]:
         """
-        获取聊天消息列表
+        按消息ID游标分页获取聊天消息
         
         Args:
             session: 数据库会话
             chat_id: 聊天ID
+            limit: 每页条数
+            before: 只返回ID小于该值的消息，用于向前翻页
+            after: 只返回ID大于该值的消息，用于获取新消息
             
         Returns:
-            聊天消息列表
+            按时间顺序排列的一页消息，以及是否还有更多消息
         """
         chat_service = self._create_chat_domain_service(session)
-        return await chat_service.get_messages(chat_id)
+        return await chat_service.list_messages(chat_id, limit, before=before, after=after)
     
     async def list_user_chats(
         self,
@@ -206,4 +776,82 @@ class ChatApplicationService:
         chat_repo = ChatRepository(session)
         return await chat_repo.get_chats_by_user(user_id, skip, limit)
     
+    async def delete_user_chats(self, user_id: int) -> int:
+        """
+        软删除用户的所有聊天(单条UPDATE)，在独立的事务中执行并提交
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            删除的聊天数
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session)
+            deleted = await chat_service.delete_user_chats(user_id)
+            await uow.commit()
+        if self.history_cache:
+            # 提交前读取的请求可能已把旧数据重新写入缓存
+            self.history_cache.invalidate_user(user_id)
+        return deleted
+    
+    async def delete_source(self, source_id: int) -> bool:
+        """
+        删除源(单条DELETE，提示词、工具和聊天级联删除)，在独立的事务中执行并提交
+        
+        Args:
+            source_id: 源ID
+            
+        Returns:
+            是否删除成功
+        """
+        async with UnitOfWork() as uow:
+            chat_service = self._create_chat_domain_service(uow.session)
+            deleted = await chat_service.delete_source(source_id)
+            await uow.commit()
+        if deleted and self.history_cache:
+            # 提交前读取的请求可能已把旧数据重新写入缓存
+            self.history_cache.invalidate_source(source_id)
+        return deleted
+    
+    def metrics(self) -> Dict[str, Any]:
+        """
+        获取聊天服务的运行指标
+        
+        Returns:
+            各组件的指标
+        """
+        metrics = {}
+        if self.response_cache:
+            metrics["response_cache"] = self.response_cache.stats()
+        metrics["model_router"] = self.model_router.stats()
+        if self.singleflight:
+            metrics["singleflight"] = self.singleflight.stats()
+        if self.admission:
+            metrics["admission"] = self.admission.stats()
+        if self.history_cache:
+            metrics["history_cache"] = self.history_cache.stats()
+        metrics["turn_streams"] = self.turn_streams.stats()
+        if self.job_pool:
+            metrics["jobs"] = self.job_pool.stats()
+        return metrics
+    
+    async def shutdown(self) -> None:
+        """释放进程内共享的资源"""
+        # 先停止工作协程，进行中的任务保持运行中状态，下次启动时重新执行
+        if self.job_pool:
+            await self.job_pool.stop()
+        tasks = list(self._turn_tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # 对话结束时才会启动摘要刷新，所以在对话任务之后取消；未折叠的消息会在下一轮重新折叠
+        summaries = list(self._summary_tasks.values())
+        for task in summaries:
+            task.cancel()
+        if summaries:
+            await asyncio.gather(*summaries, return_exceptions=True)
+        await close_mcp_session_pools()
+    
     # 源、提示词、工具相关方法也可以类似实现 
\ No newline at end of file
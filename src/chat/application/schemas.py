@@ -50,6 +50,17 @@ class PromptCreate(PromptBase):
     """提示词创建模型"""
     pass
 
+class PromptItem(BaseModel):
+    """批量创建时的单个提示词，源由路径指定"""
+    name: str = Field(..., description="提示词名称")
+    content: str = Field(..., description="提示词内容")
+    type: PromptType = Field(..., description="提示词类型")
+    extra: Optional[Dict[str, Any]] = Field(None, description="额外参数")
+
+class PromptBulkCreate(BaseModel):
+    """批量创建提示词请求"""
+    prompts: List[PromptItem] = Field(..., description="提示词列表")
+
 class PromptUpdate(PromptBase):
     """提示词更新模型"""
     pass
@@ -129,6 +140,18 @@ class ChatDataCreate(ChatDataBase):
     """聊天数据创建模型"""
     pass
 
+class ChatDataImport(BaseModel):
+    """导入的历史消息"""
+    content: str = Field(..., description="内容")
+    content_type: ContentType = Field(default=ContentType.MSG, description="内容类型")
+    role: Role = Field(..., description="角色")
+    extra: Optional[Dict[str, Any]] = Field(None, description="额外参数")
+    created_at: Optional[datetime] = Field(None, description="消息时间，为空时使用导入时间")
+
+class ChatDataBulkCreate(BaseModel):
+    """批量导入历史消息请求"""
+    messages: List[ChatDataImport] = Field(..., description="按时间顺序排列的消息")
+
 class ChatData(ChatDataBase):
     """聊天数据响应模型"""
     id: int
@@ -168,6 +191,10 @@ class EnableToolRequest(BaseModel):
     tool_id: int = Field(..., description="工具ID")
     parameters: Dict[str, Any] = Field(default_factory=dict, description="参数")
 
+class BulkEnableToolRequest(BaseModel):
+    """批量启用工具请求"""
+    items: List[EnableToolRequest] = Field(..., description="要添加的(聊天, 工具)列表")
+
 # API响应模型
 class MessageResponse(ResponseBase):
     """消息响应"""
@@ -186,6 +213,11 @@ class MessageListResponse(ResponseBase):
     """消息列表响应"""
     data: List[ChatData]
     total: int
+    has_more: Optional[bool] = Field(None, description="翻页方向上是否还有更多消息")
+
+class BulkCreateResponse(ResponseBase):
+    """批量写入响应"""
+    total: int = Field(..., description="写入的条数")
 
 class SourceResponse(ResponseBase):
     """源响应"""
@@ -199,4 +231,25 @@ class SourceListResponse(ResponseBase):
 class StreamResponse(BaseModel):
     """流式响应"""
     content: str
-    content_type: ContentType 
\ No newline at end of file
+    content_type: ContentType
+    delta: bool = Field(default=False, description="是否为增量内容，增量需由客户端拼接")
+    extra: Optional[Dict[str, Any]] = Field(None, description="额外参数") 
+
+class TurnJobInfo(BaseModel):
+    """对话任务"""
+    id: str = Field(..., description="任务ID，同时是对话轮ID")
+    chat_id: str = Field(..., description="聊天ID")
+    status: str = Field(..., description="状态: queued, running, succeeded, failed")
+    attempts: int = Field(default=0, description="已执行次数")
+    error: Optional[str] = Field(None, description="失败原因")
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    messages: Optional[List[ChatData]] = Field(None, description="任务结束后本轮产生的消息")
+    
+    class Config:
+        orm_mode = True
+
+class TurnJobResponse(ResponseBase):
+    """对话任务响应"""
+    data: TurnJobInfo
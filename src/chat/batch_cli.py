@@ -0,0 +1,105 @@
+"""
+批量推理命令行工具。
+
+在 src 目录下运行:
+    python -m chat.batch_cli --source-id 1 --input prompts.jsonl --output results.jsonl --concurrency 16
+
+输入每行包含 id、content，可选 extra 和 history；结果逐行追加到输出文件。
+输出文件同时是检查点，中断后用相同参数重新运行时跳过已成功的条目，失败的条目会重新执行。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import ujson
+
+from chat.api.router import chat_app_service, chat_config
+from chat.infrastructure.batch import ITEM_SUCCEEDED, load_checkpoint, read_jsonl
+from config.logger import setup_logging
+from infra.database import UnitOfWork, close_db
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="使用源的系统提示词和工具批量推理")
+    parser.add_argument("--source-id", type=int, required=True, help="源ID")
+    parser.add_argument("--input", required=True, help="输入 JSONL 文件")
+    parser.add_argument("--output", required=True, help="输出 JSONL 文件，同时作为检查点")
+    parser.add_argument("--concurrency", type=int, default=chat_config.batch_concurrency, help="同时执行的条目数")
+    parser.add_argument("--max-retries", type=int, default=chat_config.batch_max_retries, help="可重试错误的重试次数")
+    parser.add_argument("--retry-backoff", type=float, default=chat_config.batch_retry_backoff, help="首次重试的等待秒数")
+    return parser.parse_args()
+
+
+def ends_with_newline(path: str) -> bool:
+    """文件为空或以换行结尾"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+async def run(args: argparse.Namespace) -> int:
+    """
+    执行批量推理
+
+    Args:
+        args: 命令行参数
+
+    Returns:
+        失败的条目数
+    """
+    completed = load_checkpoint(args.output)
+    items = [item for item in read_jsonl(args.input) if item["id"] not in completed]
+    logger.info(f"共 {len(items) + len(completed)} 条，已完成 {len(completed)} 条，本次执行 {len(items)} 条")
+    if not items:
+        return 0
+
+    async with UnitOfWork() as uow:
+        template = await chat_app_service.open_batch(uow.session, args.source_id)
+    if not template:
+        raise SystemExit(f"源不存在: {args.source_id}")
+
+    failed = 0
+    started = time.monotonic()
+    with open(args.output, "a", encoding="utf-8") as output:
+        # 上次中断时可能留下半行，从新的一行开始追加
+        if not ends_with_newline(args.output):
+            output.write("\n")
+        results = chat_app_service.run_batch(
+            template,
+            items,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            retry_backoff=args.retry_backoff
+        )
+        done = 0
+        async for result in results:
+            # 每条结果立即落盘，中断后不会丢失已完成的条目
+            output.write(ujson.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            done += 1
+            if result["status"] != ITEM_SUCCEEDED:
+                failed += 1
+            if done % 100 == 0 or done == len(items):
+                elapsed = time.monotonic() - started
+                logger.info(f"进度 {done}/{len(items)}，失败 {failed}，{done / elapsed:.2f} 条/秒")
+    return failed
+
+
+async def main() -> int:
+    args = parse_args()
+    try:
+        return await run(args)
+    finally:
+        await chat_app_service.shutdown()
+        await close_db()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    raise SystemExit(1 if asyncio.run(main()) else 0)
@@ -2,7 +2,7 @@
 Chat模块的配置。
 """
 from typing import Optional, Dict, Any, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from ..config.settings import settings
 
@@ -13,17 +13,58 @@ class ChatModelConfig(BaseModel):
     api_key: str
     api_base: str = "https://api.openai.com/v1"
     parameters: Optional[Dict[str, Any]] = None
+    sync_client: bool = False  # 供应商仅支持同步客户端时，通过线程池调用
 
 
 class ChatServiceConfig(BaseModel):
     """聊天服务配置"""
     default_model: str = "gpt-3.5-turbo"
     available_models: List[ChatModelConfig] = []
-    max_history_length: int = 20
-    max_tokens: int = 4096
+    max_history_length: int = 20  # 上下文中保留的最近消息条数
+    max_tokens: int = 4096  # 上下文(系统提示词+摘要+历史)的token预算
+    summarize_history: bool = True  # 超出预算的早期消息折叠为滚动摘要
+    response_cache_sources: List[int] = Field(default_factory=list)  # 启用响应缓存的源ID
+    response_cache_ttl: float = 3600.0
+    response_cache_max_entries: int = 1000
+    response_cache_semantic_threshold: Optional[float] = 0.95  # 语义缓存的相似度阈值，None 表示只用精确缓存
+    coalesce_requests: bool = True  # 同时进行的相同LLM请求共享一次上游调用
+    idempotent_tools: List[str] = Field(default_factory=list)  # 远程MCP服务中可缓存结果的工具
     temperature: float = 0.7
     api_timeout: int = 60
+    model_ewma_alpha: float = 0.3  # 端点延迟和错误率的平滑系数
+    model_failure_threshold: int = 3  # 端点连续失败该次数后熔断
+    model_recovery_timeout: float = 30.0  # 熔断后经过该秒数放行一个探测请求
+    model_hedge_percentile: Optional[float] = None  # 首字节超过该分位延迟时向另一端点对冲，None 表示关闭
+    model_hedge_budget: float = 0.05  # 最多对冲的请求比例
+    stream: bool = True
+    max_concurrent_turns: int = 32  # 同时进行的对话轮数上限，0 表示不限制
+    max_queued_turns: int = 128  # 排队等待的对话轮数上限，超出时直接返回 429
+    turn_queue_timeout: float = 10.0  # 排队超过该秒数返回 429
+    source_weights: Dict[int, float] = Field(default_factory=dict)  # 排队调度时各源的权重，默认为 1
+    turn_stream_max_events: int = 1024  # 每轮对话在内存中保留的最近事件数，用于断线续传
+    turn_stream_retention: float = 300.0  # 对话结束后事件保留的秒数，之后从数据库回放
+    history_cache_max_chats: int = 1000  # 缓存历史消息的聊天数上限，0 表示不缓存
+    history_cache_max_bytes: int = 64 * 1024 * 1024  # 历史缓存估算内存上限
+    turn_job_workers: int = 0  # 任务模式的工作协程数，0 表示不启用任务模式
+    turn_job_queue_path: str = "./data/turn_jobs.db"  # 任务队列的 SQLite 文件
+    turn_job_max_queued: int = 1000  # 排队的任务数上限，超出时返回 429
+    turn_job_max_per_user: int = 20  # 每个用户排队和运行中的任务数上限，超出时返回 429，0 表示不限制
+    turn_job_max_attempts: int = 3  # 服务重启导致中断的任务最多执行的次数
+    turn_job_owner: str = ""  # 领取任务的进程名称，为空时使用主机名；多个进程共用队列文件时需各不相同
+    turn_job_lease_seconds: float = 60.0  # 运行中任务的租约，超时未续租的任务可被其他进程恢复
+    batch_concurrency: int = 8  # 批量推理默认同时执行的条目数
+    batch_max_concurrency: int = 64  # 批量推理允许的最大并发数
+    batch_max_retries: int = 3  # 批量推理中可重试错误的重试次数
+    batch_retry_backoff: float = 1.0  # 批量推理首次重试的等待秒数，之后指数增长
+    bulk_insert_batch_size: int = 1000  # 批量写入时每条INSERT语句的行数
+    bulk_max_items: int = 10000  # 批量写入接口单次请求的条数上限
     mcp_server_url: str = "http://localhost:8000"
+    mcp_pool_size: int = 4  # 单个MCP服务的最大并发会话数
+    mcp_health_check_interval: float = 30.0  # 空闲超过该秒数的会话使用前先 ping
+    tool_call_concurrency: int = 4  # 单轮对话中并发执行的工具调用数
+    tool_call_timeout: float = 30.0  # 单个工具调用的超时时间(秒)
+    tool_cache_ttl: float = 300.0  # 工具目录缓存时间(秒)，工具服务重建时立即失效
+    mcp_transport: str = "auto"  # auto: 指向本服务时走进程内传输; memory: 强制进程内; http: 强制HTTP
 
 
 # 聊天模块的默认配置
@@ -3,6 +3,7 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 
+from utils.time_util import utcnow
 from ...domain.models.enums import SourceType, PromptType, Role, ContentType
 
 @dataclass
@@ -77,6 +78,16 @@ class ChatDataEntity:
     extra: Optional[Dict[str, Any]] = None
     created_at: datetime = field(default_factory=datetime.utcnow)
 
+@dataclass
+class ChatSummaryEntity:
+    """聊天摘要实体 - 早期消息折叠后的滚动摘要"""
+    id: Optional[int] = None
+    chat_id: int = 0
+    content: str = ""
+    last_message_id: int = 0
+    created_at: datetime = field(default_factory=utcnow)
+    updated_at: datetime = field(default_factory=utcnow)
+
 @dataclass
 class ChatToolEntity:
     """聊天工具实体 - 代表聊天关联的一个工具"""
@@ -22,4 +22,5 @@ class ContentType(str, Enum):
     """内容类型枚举"""
     MSG = "message"        # 普通消息
     REASONING = "reasoning"  # 推理过程
-    TOOL = "tool"          # 工具调用 
\ No newline at end of file
+    TOOL = "tool"          # 工具调用
+    TOOL_CALL = "tool_call"  # 工具调用请求(仅流式增量) 
\ No newline at end of file
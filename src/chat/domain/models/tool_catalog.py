@@ -0,0 +1,33 @@
+import hashlib
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import ujson
+
+@dataclass
+class ToolCatalog:
+    """工具目录"""
+    tools: List[Dict[str, Any]]  # OpenAI function 格式，按名称排序，只读
+    payload: str                 # 预序列化的工具列表(键有序)
+    etag: str                    # payload 的哈希，工具变化时随之变化
+    idempotent_tools: FrozenSet[str] = frozenset()  # 标记为幂等的工具名称
+    version: Optional[int] = None
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def build(
+        cls,
+        tools: List[Dict[str, Any]],
+        idempotent_tools: Iterable[str] = ()
+    ) -> "ToolCatalog":
+        """按工具名排序并序列化，保证相同的工具集合得到相同的 payload"""
+        tools = sorted(tools, key=lambda tool: tool["function"]["name"])
+        payload = ujson.dumps(tools, sort_keys=True, ensure_ascii=False)
+        etag = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        return cls(
+            tools=tools,
+            payload=payload,
+            etag=etag,
+            idempotent_tools=frozenset(idempotent_tools)
+        )
@@ -5,6 +5,7 @@ from ..models.chat import (
     ChatEntity,
     ChatDataEntity, 
     ChatToolEntity,
+    ChatSummaryEntity,
     SourceEntity,
     PromptEntity,
     ChatToolConfig
@@ -28,20 +29,30 @@ class IChatRepository(ABC):
         """根据chat_id获取聊天"""
         pass
     
+    @abstractmethod
+    async def get_chats_by_chat_ids(self, chat_ids: List[str]) -> List[ChatEntity]:
+        """根据多个chat_id获取聊天"""
+        pass
+    
     @abstractmethod
     async def get_chats_by_user(self, user_id: int, skip: int = 0, limit: int = 100) -> List[ChatEntity]:
         """获取用户的所有聊天"""
         pass
     
     @abstractmethod
-    async def update_chat(self, chat: ChatEntity) -> ChatEntity:
-        """更新聊天"""
+    async def update_chat(self, chat: ChatEntity) -> Optional[ChatEntity]:
+        """更新聊天，不存在时返回空"""
         pass
     
     @abstractmethod
     async def delete_chat(self, chat_id: int) -> bool:
         """删除聊天(软删除)"""
         pass
+    
+    @abstractmethod
+    async def delete_chats_by_user(self, user_id: int) -> int:
+        """软删除用户的所有聊天，返回删除的聊天数"""
+        pass
 
 class IChatDataRepository(ABC):
     """聊天数据仓储接口"""
@@ -52,8 +63,46 @@ class IChatDataRepository(ABC):
         pass
     
     @abstractmethod
-    async def get_chat_data(self, chat_id: int, skip: int = 0, limit: int = 100) -> List[ChatDataEntity]:
-        """获取聊天数据"""
+    async def create_many(
+        self,
+        chat_data_list: List[ChatDataEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatDataEntity]:
+        """批量创建聊天数据(按批次多行INSERT，不回填ID)"""
+        pass
+    
+    @abstractmethod
+    async def get_chat_data(
+        self,
+        chat_id: int,
+        limit: int = 100,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> List[ChatDataEntity]:
+        """按消息ID游标分页获取聊天数据，结果按ID升序；未指定游标时返回最新的一页"""
+        pass
+    
+    @abstractmethod
+    async def get_turn_data(self, chat_id: int, turn_id: str) -> List[ChatDataEntity]:
+        """获取一轮对话产生的聊天数据"""
+        pass
+    
+    @abstractmethod
+    async def delete_turn_data(self, chat_id: int, turn_id: str, replies_only: bool = False) -> int:
+        """删除一轮对话产生的聊天数据，replies_only 时保留用户消息"""
+        pass
+
+class IChatSummaryRepository(ABC):
+    """聊天摘要仓储接口"""
+    
+    @abstractmethod
+    async def get_summary(self, chat_id: int) -> Optional[ChatSummaryEntity]:
+        """获取聊天摘要"""
+        pass
+    
+    @abstractmethod
+    async def save_summary(self, summary: ChatSummaryEntity) -> ChatSummaryEntity:
+        """保存聊天摘要(不存在则创建)"""
         pass
 
 class IChatToolRepository(ABC):
@@ -64,6 +113,15 @@ class IChatToolRepository(ABC):
         """创建聊天工具"""
         pass
     
+    @abstractmethod
+    async def create_many(
+        self,
+        chat_tools: List[ChatToolEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatToolEntity]:
+        """批量创建聊天工具(按批次多行INSERT，不回填ID)"""
+        pass
+    
     @abstractmethod
     async def get_chat_tools(self, chat_id: int) -> List[ChatToolEntity]:
         """获取聊天工具"""
@@ -88,8 +146,8 @@ class ISourceRepository(ABC):
         pass
     
     @abstractmethod
-    async def update_source(self, source: SourceEntity) -> SourceEntity:
-        """更新源"""
+    async def update_source(self, source: SourceEntity) -> Optional[SourceEntity]:
+        """更新源，不存在时返回空"""
         pass
     
     @abstractmethod
@@ -105,6 +163,15 @@ class IPromptRepository(ABC):
         """创建提示词"""
         pass
     
+    @abstractmethod
+    async def create_many(
+        self,
+        prompts: List[PromptEntity],
+        batch_size: Optional[int] = None
+    ) -> List[PromptEntity]:
+        """批量创建提示词(按批次多行INSERT，不回填ID)"""
+        pass
+    
     @abstractmethod
     async def get_prompt(self, prompt_id: int) -> Optional[PromptEntity]:
         """获取提示词"""
@@ -1,10 +1,11 @@
-from typing import List, Optional, Tuple, Dict, Any
+from typing import Callable, List, Optional, Tuple, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models.chat import (
     ChatEntity, 
     ChatDataEntity, 
     ChatToolEntity,
+    ChatSummaryEntity,
     SourceEntity,
     PromptEntity
 )
@@ -14,9 +15,11 @@ from ..repositories.chat_repository import (
     IChatRepository,
     IChatDataRepository,
     IChatToolRepository,
+    IChatSummaryRepository,
     ISourceRepository,
     IPromptRepository
 )
+from .interfaces import IChatHistoryCache
 
 class ChatDomainService:
     """聊天领域服务，实现核心业务逻辑"""
@@ -27,13 +30,21 @@ class ChatDomainService:
         chat_data_repo: IChatDataRepository,
         chat_tool_repo: IChatToolRepository,
         source_repo: ISourceRepository,
-        prompt_repo: IPromptRepository
+        prompt_repo: IPromptRepository,
+        chat_summary_repo: Optional[IChatSummaryRepository] = None,
+        history_cache: Optional[IChatHistoryCache] = None,
+        on_rollback: Optional[Callable[[Callable[[], None]], None]] = None
     ):
         self.chat_repo = chat_repo
         self.chat_data_repo = chat_data_repo
         self.chat_tool_repo = chat_tool_repo
         self.source_repo = source_repo
         self.prompt_repo = prompt_repo
+        self.chat_summary_repo = chat_summary_repo
+        # 活跃聊天的历史缓存，写入时追加，更新或删除时失效
+        self.history_cache = history_cache
+        # 在事务中写入时注册回滚回调，事务未提交时使追加到缓存的消息失效；每条语句自动提交时为空
+        self.on_rollback = on_rollback
     
     async def create_chat(
         self, 
@@ -54,6 +65,48 @@ class ChatDomainService:
         Returns:
             聊天实体和可能的欢迎消息
         """
+        chat, source = await self.prepare_chat(name, user_id, source_id, extra)
+        
+        # 创建聊天
+        chat = await self.chat_repo.create_chat(chat)
+        
+        # 如果有欢迎消息，创建它
+        welcome_message = None
+        if source and source.welcome_text:
+            welcome_message = ChatDataEntity(
+                chat_id=chat.id,
+                content=source.welcome_text,
+                role=Role.ASSISTANT
+            )
+            welcome_message = await self.chat_data_repo.create_chat_data(welcome_message)
+        
+        # 新聊天的历史是已知的，第一轮对话无需查询
+        if self.history_cache:
+            self.history_cache.put(chat, [welcome_message] if welcome_message else [])
+            if self.on_rollback:
+                self.on_rollback(lambda: self.history_cache.invalidate(chat.chat_id))
+        
+        return chat, welcome_message
+    
+    async def prepare_chat(
+        self,
+        name: str,
+        user_id: int,
+        source_id: int,
+        extra: Optional[Dict[str, Any]] = None
+    ) -> Tuple[ChatEntity, Optional[SourceEntity]]:
+        """
+        按源的系统提示词构建聊天实体，不保存
+        
+        Args:
+            name: 聊天名称
+            user_id: 用户ID
+            source_id: 源ID
+            extra: 额外参数，用于格式化系统提示词
+            
+        Returns:
+            未持久化的聊天实体和源，源不存在时为空
+        """
         # 获取系统提示词
         prompts = await self.prompt_repo.get_prompts_by_source(source_id)
         system_prompt = next((p for p in prompts if p.type == PromptType.SYSTEM), None)
@@ -62,7 +115,6 @@ class ChatDomainService:
         # 获取源
         source = await self.source_repo.get_source(source_id)
         
-        # 创建聊天
         chat = ChatEntity(
             name=name,
             user_id=user_id,
@@ -70,19 +122,19 @@ class ChatDomainService:
             system_prompt=system_prompt_content,
             extra=extra
         )
-        chat = await self.chat_repo.create_chat(chat)
-        
-        # 如果有欢迎消息，创建它
-        welcome_message = None
-        if source and source.welcome_text:
-            welcome_message = ChatDataEntity(
-                chat_id=chat.id,
-                content=source.welcome_text,
-                role=Role.ASSISTANT
-            )
-            welcome_message = await self.chat_data_repo.create_chat_data(welcome_message)
+        return chat, source
+    
+    async def get_chats_by_chat_ids(self, chat_ids: List[str]) -> List[ChatEntity]:
+        """
+        根据多个chat_id获取聊天
         
-        return chat, welcome_message
+        Args:
+            chat_ids: 聊天ID字符串列表
+            
+        Returns:
+            存在的聊天实体列表，顺序不保证
+        """
+        return await self.chat_repo.get_chats_by_chat_ids(chat_ids)
     
     async def create_message(
         self,
@@ -112,7 +164,45 @@ class ChatDomainService:
             content_type=content_type,
             extra=extra
         )
-        return await self.chat_data_repo.create_chat_data(chat_data)
+        chat_data = await self.chat_data_repo.create_chat_data(chat_data)
+        self._append_history(chat_id, [chat_data])
+        return chat_data
+    
+    async def create_messages(
+        self,
+        messages: List[ChatDataEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatDataEntity]:
+        """
+        批量创建聊天消息
+        
+        Args:
+            messages: 聊天数据实体列表，按产生顺序排列
+            batch_size: 每条INSERT语句写入的行数，为空时使用仓储的默认值
+            
+        Returns:
+            聊天数据实体列表
+        """
+        saved = await self.chat_data_repo.create_many(messages, batch_size=batch_size)
+        for chat_id in dict.fromkeys(m.chat_id for m in saved):
+            self._append_history(chat_id, [m for m in saved if m.chat_id == chat_id])
+        return saved
+    
+    def _append_history(self, chat_id: int, messages: List[ChatDataEntity]) -> None:
+        """
+        把新写入的消息追加到历史缓存
+        
+        事务回滚时缓存中不能留下未保存的消息，所以同时注册回滚回调使该聊天的缓存失效。
+        
+        Args:
+            chat_id: 聊天主键
+            messages: 新写入的消息
+        """
+        if not self.history_cache:
+            return
+        self.history_cache.append(chat_id, messages)
+        if self.on_rollback:
+            self.on_rollback(lambda: self.history_cache.invalidate(chat_pk=chat_id))
     
     async def create_tool(
         self,
@@ -138,6 +228,40 @@ class ChatDomainService:
         )
         return await self.chat_tool_repo.create_chat_tool(chat_tool)
     
+    async def create_tools(
+        self,
+        chat_tools: List[ChatToolEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatToolEntity]:
+        """
+        批量创建聊天工具
+        
+        Args:
+            chat_tools: 聊天工具实体列表
+            batch_size: 每条INSERT语句写入的行数，为空时使用仓储的默认值
+            
+        Returns:
+            聊天工具实体列表
+        """
+        return await self.chat_tool_repo.create_many(chat_tools, batch_size=batch_size)
+    
+    async def create_prompts(
+        self,
+        prompts: List[PromptEntity],
+        batch_size: Optional[int] = None
+    ) -> List[PromptEntity]:
+        """
+        批量创建提示词
+        
+        Args:
+            prompts: 提示词实体列表
+            batch_size: 每条INSERT语句写入的行数，为空时使用仓储的默认值
+            
+        Returns:
+            提示词实体列表
+        """
+        return await self.prompt_repo.create_many(prompts, batch_size=batch_size)
+    
     async def get_messages(self, chat_id_str: str) -> List[ChatDataEntity]:
         """
         获取聊天消息列表
@@ -148,11 +272,100 @@ class ChatDomainService:
         Returns:
             聊天消息列表
         """
-        chat = await self.chat_repo.get_chat_by_chat_id(chat_id_str)
+        chat = await self.get_chat_by_chat_id(chat_id_str)
         if not chat:
             return []
         
-        return await self.chat_data_repo.get_chat_data(chat.id)
+        return await self.get_chat_messages(chat)
+    
+    async def get_chat_messages(self, chat: ChatEntity) -> List[ChatDataEntity]:
+        """
+        获取已加载的聊天的消息列表，优先使用缓存
+        
+        Args:
+            chat: 聊天实体
+            
+        Returns:
+            聊天消息列表
+        """
+        if self.history_cache:
+            messages = self.history_cache.get_messages(chat.chat_id)
+            if messages is not None:
+                return messages
+        
+        messages = await self.chat_data_repo.get_chat_data(chat.id)
+        if self.history_cache:
+            self.history_cache.put(chat, messages)
+        return messages
+    
+    async def list_messages(
+        self,
+        chat_id_str: str,
+        limit: int = 100,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> Tuple[List[ChatDataEntity], bool]:
+        """
+        按消息ID游标分页获取聊天消息
+        
+        Args:
+            chat_id_str: 聊天ID字符串
+            limit: 每页条数
+            before: 只返回ID小于该值的消息
+            after: 只返回ID大于该值的消息
+            
+        Returns:
+            按时间顺序排列的一页消息，以及翻页方向上是否还有更多消息
+        """
+        chat = await self.get_chat_by_chat_id(chat_id_str)
+        if not chat:
+            return [], False
+        
+        # 多取一条判断是否还有下一页
+        messages = await self.chat_data_repo.get_chat_data(chat.id, limit + 1, before=before, after=after)
+        has_more = len(messages) > limit
+        if has_more:
+            messages = messages[:limit] if after is not None else messages[1:]
+        return messages, has_more
+    
+    async def get_turn_messages(self, chat_id_str: str, turn_id: str) -> List[ChatDataEntity]:
+        """
+        获取一轮对话产生的消息
+        
+        Args:
+            chat_id_str: 聊天ID字符串
+            turn_id: 对话轮ID
+            
+        Returns:
+            聊天数据实体列表
+        """
+        chat = await self.get_chat_by_chat_id(chat_id_str)
+        if not chat:
+            return []
+        
+        return await self.chat_data_repo.get_turn_data(chat.id, turn_id)
+    
+    async def delete_turn_messages(
+        self,
+        chat: ChatEntity,
+        turn_id: str,
+        replies_only: bool = False
+    ) -> int:
+        """
+        删除一轮对话产生的消息，并使聊天的缓存失效
+        
+        Args:
+            chat: 聊天实体
+            turn_id: 对话轮ID
+            replies_only: 只删除回复、保留用户消息，用于重新执行中断的对话轮
+            
+        Returns:
+            删除的消息数
+        """
+        deleted = await self.chat_data_repo.delete_turn_data(chat.id, turn_id, replies_only)
+        if deleted and self.history_cache:
+            self.history_cache.invalidate(chat.chat_id, chat.id)
+        return deleted
     
     async def get_chat_with_messages(self, chat_id: int) -> Tuple[Optional[ChatEntity], List[ChatDataEntity]]:
         """
@@ -171,6 +384,46 @@ class ChatDomainService:
         messages = await self.chat_data_repo.get_chat_data(chat_id)
         return chat, messages
     
+    async def get_summary(self, chat_id: int) -> Optional[ChatSummaryEntity]:
+        """
+        获取聊天的滚动摘要
+        
+        Args:
+            chat_id: 聊天ID
+            
+        Returns:
+            聊天摘要实体
+        """
+        if not self.chat_summary_repo:
+            return None
+        return await self.chat_summary_repo.get_summary(chat_id)
+    
+    async def save_summary(
+        self,
+        chat_id: int,
+        content: str,
+        last_message_id: int
+    ) -> Optional[ChatSummaryEntity]:
+        """
+        保存聊天的滚动摘要
+        
+        Args:
+            chat_id: 聊天ID
+            content: 摘要内容
+            last_message_id: 摘要已覆盖的最后一条消息ID
+            
+        Returns:
+            聊天摘要实体
+        """
+        if not self.chat_summary_repo:
+            return None
+        summary = ChatSummaryEntity(
+            chat_id=chat_id,
+            content=content,
+            last_message_id=last_message_id
+        )
+        return await self.chat_summary_repo.save_summary(summary)
+    
     async def get_chat_by_chat_id(self, chat_id: str) -> Optional[ChatEntity]:
         """
         通过chat_id获取聊天
@@ -181,4 +434,72 @@ class ChatDomainService:
         Returns:
             聊天实体
         """
-        return await self.chat_repo.get_chat_by_chat_id(chat_id) 
\ No newline at end of file
+        if self.history_cache:
+            chat = self.history_cache.get_chat(chat_id)
+            if chat:
+                return chat
+        
+        chat = await self.chat_repo.get_chat_by_chat_id(chat_id)
+        if chat and self.history_cache:
+            self.history_cache.put(chat)
+        return chat
+    
+    async def update_chat(self, chat: ChatEntity) -> Optional[ChatEntity]:
+        """
+        更新聊天，并使其缓存失效
+        
+        Args:
+            chat: 聊天实体
+            
+        Returns:
+            更新后的聊天实体，不存在时为空
+        """
+        updated = await self.chat_repo.update_chat(chat)
+        if self.history_cache:
+            self.history_cache.invalidate(chat.chat_id, chat.id)
+        return updated
+    
+    async def delete_chat(self, chat_id: int) -> bool:
+        """
+        删除聊天(软删除)，并使其缓存失效
+        
+        Args:
+            chat_id: 聊天主键
+            
+        Returns:
+            是否删除成功
+        """
+        deleted = await self.chat_repo.delete_chat(chat_id)
+        if self.history_cache:
+            self.history_cache.invalidate(chat_pk=chat_id)
+        return deleted 
+    
+    async def delete_user_chats(self, user_id: int) -> int:
+        """
+        软删除用户的所有聊天，并使其缓存失效
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            删除的聊天数
+        """
+        deleted = await self.chat_repo.delete_chats_by_user(user_id)
+        if self.history_cache:
+            self.history_cache.invalidate_user(user_id)
+        return deleted
+    
+    async def delete_source(self, source_id: int) -> bool:
+        """
+        删除源，其下的聊天由外键级联删除，并使这些聊天的缓存失效
+        
+        Args:
+            source_id: 源ID
+            
+        Returns:
+            是否删除成功
+        """
+        deleted = await self.source_repo.delete_source(source_id)
+        if deleted and self.history_cache:
+            self.history_cache.invalidate_source(source_id)
+        return deleted
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from litellm import token_counter
+
+from ..models.chat import ChatEntity, ChatDataEntity
+from ..models.enums import Role
+from .chat_service import ChatDomainService
+
+logger = logging.getLogger(__name__)
+
+# 摘要生成函数: (已有摘要, 需要折叠的消息, 摘要的token上限) -> 新摘要
+Summarizer = Callable[[str, List[Dict[str, Any]], int], Awaitable[str]]
+
+
+class ContextDomainService:
+    """对话上下文领域服务，按token预算组装发送给LLM的消息"""
+
+    def __init__(
+        self,
+        model: str,
+        chat_domain_service: ChatDomainService,
+        summarizer: Optional[Summarizer] = None,
+        max_tokens: int = 4096,
+        max_history_length: int = 20,
+        summary_max_tokens: int = 512,
+        summary_tasks: Optional[Dict[int, asyncio.Task]] = None
+    ):
+        self.model = model
+        self.chat_service = chat_domain_service
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.max_history_length = max_history_length
+        self.summary_max_tokens = summary_max_tokens
+        # 进行中的摘要刷新，按聊天单飞，同一聊天同时只有一个任务在生成和保存摘要；
+        # 由应用服务持有并在关闭时取消
+        self.summary_tasks = summary_tasks if summary_tasks is not None else {}
+        # 本轮组装上下文时发现的、移出窗口但尚未折叠进摘要的消息
+        self._unfolded: Optional[tuple] = None
+
+    def count_tokens(self, message: Dict[str, Any]) -> int:
+        """
+        统计单条消息的token数
+
+        Args:
+            message: 格式化后的消息
+
+        Returns:
+            token数
+        """
+        try:
+            return token_counter(model=self.model, messages=[message])
+        except Exception:
+            # 未知模型按字符数粗略估算
+            return len(message.get("content") or "") // 2 + 4
+
+    async def build(
+        self,
+        chat: ChatEntity,
+        messages: List[ChatDataEntity]
+    ) -> List[Dict[str, Any]]:
+        """
+        组装上下文：系统提示词 + 滚动摘要 + 预算内的最近消息
+
+        Args:
+            chat: 聊天实体
+            messages: 按时间排序的历史消息
+
+        Returns:
+            格式化后的消息列表
+        """
+        system_message = {"role": "system", "content": chat.get_formatted_system_prompt()}
+        budget = self.max_tokens - self.count_tokens(system_message)
+        if self.summarizer:
+            budget -= self.summary_max_tokens
+
+        # 从最新的消息往前取，直到超出条数或token预算(至少保留最后一条)
+        recent = []
+        for message in reversed(messages):
+            if len(recent) >= self.max_history_length:
+                break
+            formatted = self._format(message)
+            tokens = self.count_tokens(formatted)
+            if tokens > budget and recent:
+                break
+            budget -= tokens
+            recent.append(formatted)
+        recent.reverse()
+
+        # 工具结果不能脱离对应的助手消息单独出现
+        while len(recent) > 1 and recent[0]["role"] == Role.TOOL:
+            recent.pop(0)
+
+        formatted_messages = [system_message]
+        older = messages[:len(messages) - len(recent)]
+        summary = await self._get_summary(chat, older) if older else None
+        if summary:
+            formatted_messages.append(self._fit_summary(summary))
+        formatted_messages.extend(recent)
+        return formatted_messages
+
+    async def _get_summary(
+        self,
+        chat: ChatEntity,
+        older: List[ChatDataEntity]
+    ) -> Optional[str]:
+        """
+        读取已保存的滚动摘要，不在请求路径上调用LLM；
+        新移出窗口的消息记录下来，由 refresh_summary 在本轮结束后折叠进摘要
+
+        Args:
+            chat: 聊天实体
+            older: 移出窗口的消息
+
+        Returns:
+            摘要内容
+        """
+        if not self.summarizer:
+            return None
+
+        summary = await self.chat_service.get_summary(chat.id)
+        previous = summary.content if summary else ""
+        last_message_id = summary.last_message_id if summary else 0
+
+        pending = [m for m in older if m.id and m.id > last_message_id]
+        if pending:
+            self._unfolded = (chat.id, previous, pending)
+        return previous or None
+
+    def _fit_summary(self, summary: str) -> Dict[str, Any]:
+        """构建摘要消息，超出预留的token数时截断，保证上下文不超出预算"""
+        message = {"role": "system", "content": f"以下是更早对话内容的摘要：\n{summary}"}
+        tokens = self.count_tokens(message)
+        while tokens > self.summary_max_tokens and summary:
+            # 按超出比例截掉尾部，token数与字符数大致成正比
+            keep = int(len(summary) * self.summary_max_tokens / tokens) - 1
+            summary = summary[:max(keep, 0)]
+            message["content"] = f"以下是更早对话内容的摘要：\n{summary}"
+            tokens = self.count_tokens(message)
+        return message
+
+    def refresh_summary(self) -> Optional[asyncio.Task]:
+        """
+        在后台把本轮移出窗口的消息折叠进摘要，应在本轮消息保存后调用
+
+        同一聊天已有刷新任务在运行时跳过，未折叠的消息会在下一轮再次被发现。
+
+        Returns:
+            刷新任务，没有需要折叠的消息或已有任务在运行时为空
+        """
+        if not self._unfolded:
+            return None
+        chat_id, previous, pending = self._unfolded
+        self._unfolded = None
+        running = self.summary_tasks.get(chat_id)
+        if running and not running.done():
+            return None
+
+        task = asyncio.create_task(self._fold(chat_id, previous, pending))
+        self.summary_tasks[chat_id] = task
+        task.add_done_callback(lambda _: self.summary_tasks.pop(chat_id, None))
+        return task
+
+    async def _fold(
+        self,
+        chat_id: int,
+        previous: str,
+        pending: List[ChatDataEntity]
+    ) -> None:
+        """生成新摘要并保存，失败时保留旧摘要"""
+        try:
+            content = await self.summarizer(
+                previous,
+                [self._format(m) for m in pending],
+                self.summary_max_tokens
+            )
+            await self.chat_service.save_summary(chat_id, content, pending[-1].id)
+        except Exception as e:
+            logger.error(f"生成对话摘要失败: {str(e)}")
+
+    @staticmethod
+    def _format(message: ChatDataEntity) -> Dict[str, Any]:
+        """将聊天数据转换为LLM消息"""
+        return {
+            "role": message.role,
+            "content": message.content
+        }
@@ -0,0 +1,68 @@
+"""
+LLM请求的指纹。
+请求合并和响应缓存按指纹判断两个请求是否会得到相同的回复。
+"""
+import hashlib
+from typing import Any, Dict, Iterable, Optional
+
+import ujson
+
+
+def _normalize_message(message: Any) -> Dict[str, Any]:
+    """规范化单条消息，只保留影响回复的字段"""
+    if not isinstance(message, dict):
+        message = message.model_dump() if hasattr(message, "model_dump") else dict(message)
+
+    normalized = {
+        "role": str(getattr(message.get("role"), "value", message.get("role"))),
+        "content": (message.get("content") or "").strip(),
+    }
+    for key in ("name", "tool_call_id"):
+        if message.get(key):
+            normalized[key] = message[key]
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        normalized["tool_calls"] = [
+            {
+                "name": call["function"]["name"],
+                "arguments": call["function"]["arguments"],
+            }
+            for call in (
+                c if isinstance(c, dict) else c.model_dump() for c in tool_calls
+            )
+        ]
+    return normalized
+
+
+def request_fingerprint(
+    model: str,
+    messages: Iterable[Any],
+    tools_etag: Optional[str] = None,
+    stream: bool = False,
+    params: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    计算LLM请求的指纹
+
+    Args:
+        model: 模型名称
+        messages: 消息列表
+        tools_etag: 工具目录的 etag，未使用工具时为空
+        stream: 是否流式请求
+        params: 其余影响回复的请求参数(max_tokens 等采样参数)
+
+    Returns:
+        指纹字符串
+    """
+    payload = ujson.dumps(
+        {
+            "model": model,
+            "tools": tools_etag,
+            "stream": stream,
+            "params": params or {},
+            "messages": [_normalize_message(m) for m in messages],
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,129 @@
+"""
+领域服务依赖的外部组件接口。
+缓存、模型路由、MCP会话池等由基础设施层实现，应用服务创建后通过构造函数注入领域服务。
+"""
+from abc import ABC, abstractmethod
+from typing import Any, AsyncContextManager, AsyncGenerator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+from ..models.chat import ChatDataEntity, ChatEntity
+from ..models.tool_catalog import ToolCatalog
+
+class IChatHistoryCache(ABC):
+    """聊天历史缓存接口"""
+
+    @abstractmethod
+    def get_chat(self, chat_id: str) -> Optional[ChatEntity]:
+        """获取缓存的聊天实体，未缓存时为空"""
+        pass
+
+    @abstractmethod
+    def get_messages(self, chat_id: str) -> Optional[List[ChatDataEntity]]:
+        """获取缓存的历史消息，未缓存或需要重新加载时为空"""
+        pass
+
+    @abstractmethod
+    def put(self, chat: ChatEntity, messages: Optional[List[ChatDataEntity]] = None) -> None:
+        """缓存聊天实体和完整的历史消息"""
+        pass
+
+    @abstractmethod
+    def append(self, chat_pk: int, messages: List[ChatDataEntity]) -> None:
+        """追加新写入的消息，聊天未缓存历史时忽略"""
+        pass
+
+    @abstractmethod
+    def invalidate(self, chat_id: Optional[str] = None, chat_pk: Optional[int] = None) -> None:
+        """使聊天的缓存失效"""
+        pass
+
+    @abstractmethod
+    def invalidate_user(self, user_id: int) -> None:
+        """使用户所有聊天的缓存失效"""
+        pass
+
+    @abstractmethod
+    def invalidate_source(self, source_id: int) -> None:
+        """使源下所有聊天的缓存失效"""
+        pass
+
+class ISyncLLMExecutor(ABC):
+    """同步LLM客户端的执行器接口，在线程池中调用，不阻塞事件循环"""
+
+    @abstractmethod
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在线程池中执行同步函数"""
+        pass
+
+    @abstractmethod
+    def iterate(self, iterator: Iterator[Any]) -> AsyncGenerator[Any, None]:
+        """在线程池中逐个读取同步迭代器"""
+        pass
+
+class IMCPSessionPool(ABC):
+    """MCP会话池接口"""
+
+    @abstractmethod
+    def session(self) -> AsyncContextManager[Any]:
+        """借用一个已连接的MCP客户端"""
+        pass
+
+class IModelRouter(ABC):
+    """模型路由接口，选择端点发起请求并在失败时切换"""
+
+    @abstractmethod
+    async def call(
+        self,
+        request: Callable[[Any], Awaitable[Any]],
+        model: Optional[str] = None,
+        stream: bool = False
+    ) -> Any:
+        """用选中的端点(提供 name、api_key、api_base、sync_client)调用 request"""
+        pass
+
+class IResponseCache(ABC):
+    """LLM响应缓存接口"""
+
+    @abstractmethod
+    def enabled_for(self, source_id: Optional[int]) -> bool:
+        """源是否启用响应缓存"""
+        pass
+
+    @abstractmethod
+    async def fetch(
+        self,
+        model: str,
+        messages: List[Any],
+        loader: Callable[[], Awaitable[Any]],
+        tools_etag: Optional[str] = None,
+        stream: bool = False,
+        idempotent_tools: Iterable[str] = (),
+        params: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """读取缓存，未命中时调用 loader 并在回复可缓存时写入"""
+        pass
+
+class IRequestCoalescer(ABC):
+    """请求合并接口，相同指纹的并发请求共享一次上游调用"""
+
+    @abstractmethod
+    async def call(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        stream: bool = False
+    ) -> Any:
+        """执行请求，相同指纹的请求正在进行时直接订阅它的结果"""
+        pass
+
+class IToolCatalogCache(ABC):
+    """工具目录缓存接口"""
+
+    @abstractmethod
+    async def get(
+        self,
+        url: str,
+        loader: Callable[[], Awaitable[ToolCatalog]],
+        version: Optional[int] = None
+    ) -> ToolCatalog:
+        """获取工具目录，过期或版本变化时重新加载"""
+        pass
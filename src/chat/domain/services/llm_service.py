@@ -1,14 +1,26 @@
+import asyncio
 import logging
 import ujson
-from typing import List, Dict, Any, Optional, AsyncGenerator
-from fastmcp import Client
-from fastmcp.client.transports import StreamableHttpTransport
-from litellm import completion
+from contextlib import aclosing
+from typing import List, Dict, Any, Callable, Optional, AsyncGenerator
+from litellm import acompletion, completion, stream_chunk_builder
 
 from ..models.chat import ChatEntity, ChatDataEntity
 from ..models.enums import ContentType, Role
+from ..models.tool_catalog import ToolCatalog
 from ..repositories.chat_repository import IChatDataRepository
 from .chat_service import ChatDomainService
+from .context_service import ContextDomainService
+from .fingerprint import request_fingerprint
+from .interfaces import (
+    IMCPSessionPool,
+    IModelRouter,
+    IRequestCoalescer,
+    IResponseCache,
+    ISyncLLMExecutor,
+    IToolCatalogCache
+)
+from .message_buffer import MessageBuffer
 
 logger = logging.getLogger(__name__)
 
@@ -21,13 +33,54 @@ class LLMDomainService:
         model: str,
         api_key: str,
         api_base: str,
-        chat_domain_service: ChatDomainService
+        chat_domain_service: ChatDomainService,
+        model_router: IModelRouter,
+        mcp_pool: IMCPSessionPool,
+        stream: bool = True,
+        timeout: Optional[float] = None,
+        sync_executor: Optional[ISyncLLMExecutor] = None,
+        tool_cache: Optional[IToolCatalogCache] = None,
+        tool_version: Optional[Callable[[], Optional[int]]] = None,
+        tool_call_concurrency: int = 4,
+        tool_call_timeout: Optional[float] = 30.0,
+        max_tokens: int = 4096,
+        max_history_length: int = 20,
+        summarize_history: bool = True,
+        response_cache: Optional[IResponseCache] = None,
+        singleflight: Optional[IRequestCoalescer] = None,
+        summary_tasks: Optional[Dict[int, asyncio.Task]] = None
     ):
-        self.client = Client(transport=StreamableHttpTransport(url=mcp_server_url))
+        # 基础设施组件由应用服务创建并注入：MCP会话在进程内复用，避免每次工具调用都重新握手
+        self.mcp_server_url = mcp_server_url
+        self.mcp_pool = mcp_pool
+        self.tool_cache = tool_cache
+        # 工具注册版本，变化时工具目录缓存失效；为空时只按TTL过期
+        self.tool_version = tool_version
+        self.tool_call_concurrency = tool_call_concurrency
+        self.tool_call_timeout = tool_call_timeout
+        self.response_cache = response_cache
+        # 同时进行的相同请求共享一次上游调用
+        self.singleflight = singleflight
+        self.context_service = ContextDomainService(
+            model=model,
+            chat_domain_service=chat_domain_service,
+            summarizer=self._summarize_history if summarize_history else None,
+            max_tokens=max_tokens,
+            max_history_length=max_history_length,
+            summary_tasks=summary_tasks
+        )
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
         self.chat_service = chat_domain_service
+        # 本轮对话产生的消息先缓存，结束或中断时批量写入
+        self.message_buffer = MessageBuffer(chat_domain_service)
+        self.stream = stream
+        self.timeout = timeout
+        # 仅有同步客户端的端点通过线程池调用，避免阻塞事件循环
+        self.sync_executor = sync_executor
+        # 按延迟和错误率在端点之间分配请求；只有一个端点时也经过路由
+        self.model_router = model_router
     
     async def gen_chat_data(
         self,
@@ -38,7 +91,7 @@ class LLMDomainService:
         extra: dict = None
     ) -> Optional[Dict[str, Any]]:
         """
-        生成聊天数据
+        生成聊天数据，消息写入本轮的缓冲区，不阻塞输出
         
         Args:
             chat_id: 聊天ID
@@ -50,9 +103,9 @@ class LLMDomainService:
         Returns:
             内容和类型
         """
-        content = content.lstrip("\n")
+        content = (content or "").lstrip("\n")
         if content:
-            await self.chat_service.create_message(
+            self.message_buffer.add(
                 chat_id=chat_id,
                 content=content,
                 role=role,
@@ -63,12 +116,61 @@ class LLMDomainService:
         return None
     
     async def chat(
+        self, 
+        chat: ChatEntity, 
+        messages: List[ChatDataEntity],
+        turn_id: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        与LLM进行对话，本轮产生的消息在结束或中断时一次性保存
+        
+        Args:
+            chat: 聊天实体
+            messages: 历史消息列表
+            turn_id: 对话轮ID，记录在本轮消息的 extra 中，用于按轮回放
+            
+        Yields:
+            响应内容
+        """
+        if turn_id:
+            self.message_buffer.extra["turn_id"] = turn_id
+        try:
+            async with aclosing(self._chat_turn(chat, messages)) as turn:
+                async for data in turn:
+                    yield data
+        finally:
+            await self.message_buffer.flush()
+            # 本轮消息保存后再在后台刷新摘要，不阻塞本轮请求
+            self.context_service.refresh_summary()
+    
+    async def complete(
+        self,
+        chat: ChatEntity,
+        messages: List[ChatDataEntity]
+    ) -> List[ChatDataEntity]:
+        """
+        执行一轮无状态对话，不保存消息，用于批量推理
+        
+        Args:
+            chat: 聊天实体，可以是未持久化的临时实体
+            messages: 历史消息列表
+            
+        Returns:
+            本轮产生的消息(助手回复、推理内容和工具结果)
+        """
+        async with aclosing(self._chat_turn(chat, messages)) as turn:
+            async for _ in turn:
+                pass
+        produced, self.message_buffer.pending = self.message_buffer.pending, []
+        return produced
+    
+    async def _chat_turn(
         self, 
         chat: ChatEntity, 
         messages: List[ChatDataEntity]
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
-        与LLM进行对话
+        执行一轮对话：请求LLM，处理工具调用并再次请求
         
         Args:
             chat: 聊天实体
@@ -78,27 +180,15 @@ class LLMDomainService:
             响应内容
         """
         formatted_messages = await self._build_messages(chat, messages)
-        tools = await self._get_tools()
+        catalog = await self._get_tools()
         
         # 首次请求
-        response = await self._chat_llm(formatted_messages, tools)
-        message = response.choices[0].message
-        tool_calls = message.tool_calls
-        
-        # 生成主要回复内容
-        data = await self.gen_chat_data(chat.id, message.content)
-        if data:
-            yield data
-        
-        # 生成推理内容(如果有)
-        if hasattr(message, 'reasoning_content'):
-            data = await self.gen_chat_data(
-                chat.id, 
-                message.reasoning_content, 
-                content_type=ContentType.REASONING
-            )
-            if data:
+        reply = {}
+        async with aclosing(self._reply(chat, formatted_messages, reply, catalog)) as replies:
+            async for data in replies:
                 yield data
+        message = reply["message"]
+        tool_calls = message.tool_calls
         
         # 如果没有工具调用，结束
         if not tool_calls:
@@ -107,49 +197,226 @@ class LLMDomainService:
         # 将LLM回复添加到消息历史
         formatted_messages.append(message)
         
-        # 处理工具调用
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            try:
-                # 调用工具函数
-                function_response = await self._function_call(tool_call)
-                message = {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            except Exception as e:
-                logger.error(f"tool_call error: {str(e)}")
-                message = {
+        # 并发处理工具调用，结果按模型给出的顺序输出和保存
+        semaphore = asyncio.Semaphore(self.tool_call_concurrency)
+        tasks = [
+            asyncio.create_task(self._run_tool_call(tool_call, semaphore))
+            for tool_call in tool_calls
+        ]
+        try:
+            for tool_call, task in zip(tool_calls, tasks):
+                message = await task
+                
+                # 记录工具调用结果
+                extra = {
                     "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": f"调用工具时出错: {str(e)}",
+                    "name": tool_call.function.name,
                 }
+                data = await self.gen_chat_data(
+                    chat.id,
+                    message.get("content"),
+                    role=Role.TOOL,
+                    content_type=ContentType.TOOL,
+                    extra=extra
+                )
+                if data:
+                    yield data
+                
+                formatted_messages.append(message)
+        finally:
+            # 对话被中断时取消尚未完成的工具调用
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        # 二次调用LLM，处理工具结果
+        async with aclosing(self._reply(chat, formatted_messages, {}, catalog, use_tools=False)) as replies:
+            async for data in replies:
+                yield data
+    
+    async def _reply(
+        self,
+        chat: ChatEntity,
+        messages: List[Dict[str, Any]],
+        reply: Dict[str, Any],
+        catalog: Optional[ToolCatalog] = None,
+        use_tools: bool = True
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        请求LLM并输出回复
+        
+        流式模式下逐个转发增量(delta)，结束后一次性保存完整消息；
+        非流式模式下保存并输出完整消息。
+        
+        Args:
+            chat: 聊天实体
+            messages: 消息列表
+            reply: 用于回传完整消息，写入 reply["message"]
+            catalog: 工具目录
+            use_tools: 是否向LLM提供工具
             
-            # 记录工具调用结果
-            extra = {
-                "tool_call_id": tool_call.id,
-                "name": function_name,
-            }
-            data = await self.gen_chat_data(
-                chat.id,
-                message.get("content"),
-                role=Role.TOOL,
-                content_type=ContentType.TOOL,
-                extra=extra
+        Yields:
+            响应内容
+        """
+        chat_id = chat.id
+        tools = catalog.tools if catalog and use_tools else None
+        if not self.stream:
+            response = await self._chat_llm(
+                messages, tools, source_id=chat.source_id, catalog=catalog
             )
+            message = response.choices[0].message
+            reply["message"] = message
+            
+            # 生成主要回复内容
+            data = await self.gen_chat_data(chat_id, message.content)
             if data:
                 yield data
             
-            formatted_messages.append(message)
+            # 生成推理内容(如果有)
+            if hasattr(message, 'reasoning_content'):
+                data = await self.gen_chat_data(
+                    chat_id, 
+                    message.reasoning_content, 
+                    content_type=ContentType.REASONING
+                )
+                if data:
+                    yield data
+            return
         
-        # 二次调用LLM，处理工具结果
-        second_response = await self._chat_llm(formatted_messages)
-        data = await self.gen_chat_data(chat.id, second_response.choices[0].message.content)
-        if data:
-            yield data
+        chunks = []
+        started = set()
+        response = await self._chat_llm(
+            messages, tools, stream=True, source_id=chat.source_id, catalog=catalog
+        )
+        try:
+            # 取消或关闭时同时关闭响应流，中止上游的HTTP请求
+            async with aclosing(response):
+                async for chunk in response:
+                    chunks.append(chunk)
+                    for data in self._parse_delta(chunk, started):
+                        yield data
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端中途断开，保存已生成的部分并标记为截断
+            await self._save_truncated(chat_id, chunks, messages)
+            raise
+        
+        message = stream_chunk_builder(chunks, messages=messages).choices[0].message
+        reply["message"] = message
+        
+        # 增量已经输出，这里只保存完整消息
+        await self.gen_chat_data(chat_id, message.content)
+        if getattr(message, 'reasoning_content', None):
+            await self.gen_chat_data(
+                chat_id,
+                message.reasoning_content,
+                content_type=ContentType.REASONING
+            )
+    
+    async def _save_truncated(
+        self,
+        chat_id: int,
+        chunks: List[Any],
+        messages: List[Dict[str, Any]]
+    ) -> None:
+        """
+        保存被中断的流式回复中已生成的部分
+        
+        Args:
+            chat_id: 聊天ID
+            chunks: 已收到的响应块
+            messages: 消息列表
+        """
+        if not chunks:
+            return
+        message = stream_chunk_builder(chunks, messages=messages).choices[0].message
+        extra = {"truncated": True}
+        await self.gen_chat_data(chat_id, message.content, extra=extra)
+        if getattr(message, 'reasoning_content', None):
+            await self.gen_chat_data(
+                chat_id,
+                message.reasoning_content,
+                content_type=ContentType.REASONING,
+                extra=extra
+            )
+    
+    @staticmethod
+    def _parse_delta(chunk, started: set) -> List[Dict[str, Any]]:
+        """
+        解析流式响应中的增量
+        
+        Args:
+            chunk: 流式响应块
+            started: 已开始输出的内容类型，用于去掉开头的空行
+            
+        Returns:
+            增量内容列表
+        """
+        if not chunk.choices:
+            return []
+        delta = chunk.choices[0].delta
+        result = []
+        
+        for content_type, content in (
+            (ContentType.REASONING, getattr(delta, 'reasoning_content', None)),
+            (ContentType.MSG, delta.content),
+        ):
+            if not content:
+                continue
+            if content_type not in started:
+                content = content.lstrip("\n")
+                if not content:
+                    continue
+                started.add(content_type)
+            result.append({"content": content, "content_type": content_type, "delta": True})
+        
+        for tool_call in getattr(delta, 'tool_calls', None) or []:
+            function = tool_call.function
+            result.append({
+                "content": (function.arguments if function else None) or "",
+                "content_type": ContentType.TOOL_CALL,
+                "delta": True,
+                "extra": {
+                    "index": tool_call.index,
+                    "id": tool_call.id,
+                    "name": function.name if function else None,
+                },
+            })
+        return result
+    
+    async def _run_tool_call(self, tool_call, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """
+        执行单个工具调用，超时和异常都转换为工具消息，不影响其他工具
+        
+        Args:
+            tool_call: 工具调用对象
+            semaphore: 限制并发数的信号量
+            
+        Returns:
+            工具消息
+        """
+        function_name = tool_call.function.name
+        try:
+            async with semaphore:
+                # 调用工具函数
+                content = await asyncio.wait_for(
+                    self._function_call(tool_call),
+                    self.tool_call_timeout
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"tool_call timeout: {function_name}")
+            content = f"调用工具超时: 超过 {self.tool_call_timeout} 秒"
+        except Exception as e:
+            logger.error(f"tool_call error: {str(e)}")
+            content = f"调用工具时出错: {str(e)}"
+        
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": function_name,
+            "content": content,
+        }
     
     async def _function_call(self, tool_call) -> str:
         """
@@ -161,7 +428,7 @@ class LLMDomainService:
         Returns:
             工具调用结果
         """
-        async with self.client as client:
+        async with self.mcp_pool.session() as client:
             function_name = tool_call.function.name
             arguments = ujson.loads(tool_call.function.arguments)
             logger.info(f"tool_call function name: {function_name}")
@@ -172,26 +439,126 @@ class LLMDomainService:
     async def _chat_llm(
         self, 
         messages: List[Dict[str, Any]], 
-        tools: List[Dict[str, Any]] = None
+        tools: List[Dict[str, Any]] = None,
+        stream: bool = False,
+        source_id: Optional[int] = None,
+        catalog: Optional[ToolCatalog] = None,
+        max_tokens: Optional[int] = None
     ):
         """
-        调用LLM进行对话
+        调用LLM进行对话，源启用响应缓存时优先读取缓存，相同的并发请求合并为一次调用
         
         Args:
             messages: 消息列表
             tools: 工具列表
+            stream: 是否流式返回
+            source_id: 聊天所属的源ID
+            catalog: 工具目录，提供 etag 和幂等工具信息
+            max_tokens: 生成的最大token数，为空时使用供应商默认值
+            
+        Returns:
+            LLM响应，流式时为响应块异步迭代器
+        """
+        tools_etag = catalog.etag if catalog and tools else None
+        # 采样参数同时用于请求和指纹，参数不同的请求不会合并或共享缓存
+        params = self._sampling_params(max_tokens)
+        loader = lambda: self._call_llm(messages, tools, stream, params)
+        if self.singleflight:
+            key = request_fingerprint(self.model, messages, tools_etag, stream, params)
+            call_llm = loader
+            loader = lambda: self.singleflight.call(key, call_llm, stream)
+        
+        if self.response_cache and self.response_cache.enabled_for(source_id):
+            return await self.response_cache.fetch(
+                model=self.model,
+                messages=messages,
+                loader=loader,
+                tools_etag=tools_etag,
+                stream=stream,
+                idempotent_tools=catalog.idempotent_tools if catalog else (),
+                params=params
+            )
+        return await loader()
+    
+    @staticmethod
+    def _sampling_params(max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        除消息、工具和流式开关外影响回复的请求参数
+        
+        Args:
+            max_tokens: 生成的最大token数，为空时使用供应商默认值
             
         Returns:
-            LLM响应
+            请求参数
         """
-        response = completion(
+        return {"max_tokens": max_tokens} if max_tokens else {}
+    
+    async def _call_llm(
+        self, 
+        messages: List[Dict[str, Any]], 
+        tools: List[Dict[str, Any]] = None,
+        stream: bool = False,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        """
+        请求LLM供应商，由模型路由选择端点并在失败时切换
+        
+        Args:
+            messages: 消息列表
+            tools: 工具列表
+            stream: 是否流式返回
+            params: 采样参数
+            
+        Returns:
+            LLM响应，流式时为响应块异步迭代器
+        """
+        return await self.model_router.call(
+            lambda endpoint: self._request(endpoint, messages, tools, stream, params),
             model=self.model,
-            api_key=self.api_key,
-            api_base=self.api_base,
+            stream=stream
+        )
+    
+    async def _request(
+        self,
+        endpoint: Any,
+        messages: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]] = None,
+        stream: bool = False,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        """
+        向指定端点发起请求
+        
+        Args:
+            endpoint: 模型路由选中的端点(名称、API地址、密钥，是否只有同步客户端)
+            messages: 消息列表
+            tools: 工具列表
+            stream: 是否流式返回
+            params: 采样参数
+            
+        Returns:
+            LLM响应，流式时为响应块异步迭代器
+        """
+        kwargs = dict(
+            model=endpoint.name,
+            api_key=endpoint.api_key,
+            api_base=endpoint.api_base,
             messages=messages,
             tools=tools,
             tool_choice="auto",
+            stream=stream,
+            timeout=self.timeout,
+            **(params or {})
         )
+        if not endpoint.sync_client:
+            # litellm 的异步客户端按供应商复用 HTTP 连接池
+            return await acompletion(**kwargs)
+        if self.sync_executor is None:
+            raise ValueError(f"端点 {endpoint.name} 只有同步客户端，需要注入同步执行器")
+        
+        response = await self.sync_executor.run(completion, **kwargs)
+        if stream:
+            return self.sync_executor.iterate(response)
         return response
     
     async def _build_messages(
@@ -200,7 +567,7 @@ class LLMDomainService:
         messages: List[ChatDataEntity]
     ) -> List[Dict[str, Any]]:
         """
-        构建消息列表
+        构建消息列表，历史消息按token预算裁剪，更早的消息折叠为摘要
         
         Args:
             chat: 聊天实体
@@ -209,35 +576,72 @@ class LLMDomainService:
         Returns:
             格式化后的消息列表
         """
-        formatted_messages = [
-            {"role": "system", "content": chat.get_formatted_system_prompt()},
-        ]
+        return await self.context_service.build(chat, messages)
+    
+    async def _summarize_history(
+        self,
+        previous: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: int
+    ) -> str:
+        """
+        把移出上下文窗口的消息折叠进已有摘要
         
-        for message in messages:
-            formatted_messages.append({
-                "role": message.role,
-                "content": message.content
-            })
+        Args:
+            previous: 已有摘要
+            messages: 需要折叠的消息
+            max_tokens: 摘要的token上限，与上下文中为摘要预留的token数一致
+            
+        Returns:
+            新的摘要
+        """
+        history = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = (
+            "请将已有摘要与新增对话合并为一份简洁的摘要，保留关键事实、用户意图和未完成的事项。\n\n"
+            f"已有摘要：\n{previous or '无'}\n\n新增对话：\n{history}"
+        )
+        response = await self._chat_llm([{"role": "user", "content": prompt}], max_tokens=max_tokens)
+        return response.choices[0].message.content or previous
+    
+    async def _get_tools(self) -> ToolCatalog:
+        """
+        获取工具目录，优先使用缓存
         
-        return formatted_messages
+        Returns:
+            工具目录，其中的工具列表只读
+        """
+        if not self.tool_cache:
+            return await self._list_tools()
+        version = self.tool_version() if self.tool_version else None
+        return await self.tool_cache.get(
+            self.mcp_server_url,
+            self._list_tools,
+            version=version
+        )
     
-    async def _get_tools(self) -> List[Dict[str, Any]]:
+    async def _list_tools(self) -> ToolCatalog:
         """
-        获取工具列表
+        从MCP服务获取工具列表
         
         Returns:
-            格式化后的工具列表
+            工具目录
         """
-        async with self.client as client:
+        async with self.mcp_pool.session() as client:
             tools = await client.list_tools()
-            return [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema,
-                    },
-                }
-                for tool in tools
-            ] 
\ No newline at end of file
+            return ToolCatalog.build(
+                [
+                    {
+                        "type": "function",
+                        "function": {
+                            "name": tool.name,
+                            "description": tool.description,
+                            "parameters": tool.inputSchema,
+                        },
+                    }
+                    for tool in tools
+                ],
+                idempotent_tools=[
+                    tool.name for tool in tools
+                    if tool.annotations and tool.annotations.idempotentHint
+                ]
+            )
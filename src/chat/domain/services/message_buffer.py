@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from utils.time_util import utcnow
+
+from ..models.chat import ChatDataEntity
+from ..models.enums import ContentType, Role
+from .chat_service import ChatDomainService
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """单轮对话的消息缓冲区，回复先输出给客户端，结束时一次性写入数据库"""
+
+    def __init__(
+        self,
+        chat_domain_service: ChatDomainService,
+        extra: Optional[Dict[str, Any]] = None
+    ):
+        self.chat_service = chat_domain_service
+        self.extra = extra or {}  # 合并到每条消息 extra 中的公共字段，例如对话轮ID
+        self.pending: List[ChatDataEntity] = []
+        self.saved: List[ChatDataEntity] = []  # 已写入数据库的消息
+        self._last_created_at: Optional[datetime] = None
+
+    def add(
+        self,
+        chat_id: int,
+        content: str,
+        role: str = Role.ASSISTANT,
+        content_type: str = ContentType.MSG,
+        extra: Optional[Dict[str, Any]] = None
+    ) -> ChatDataEntity:
+        """
+        缓存一条消息
+
+        Args:
+            chat_id: 聊天ID
+            content: 消息内容
+            role: 角色
+            content_type: 内容类型
+            extra: 额外参数
+
+        Returns:
+            尚未持久化的聊天数据实体
+        """
+        # 创建时间在加入缓冲区时确定，并保证严格递增，批量写入后仍按产生顺序排序
+        created_at = utcnow()
+        if self._last_created_at and created_at <= self._last_created_at:
+            created_at = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = created_at
+        if self.extra:
+            extra = {**self.extra, **(extra or {})}
+
+        chat_data = ChatDataEntity(
+            chat_id=chat_id,
+            content=content,
+            role=role,
+            content_type=content_type,
+            extra=extra,
+            created_at=created_at
+        )
+        self.pending.append(chat_data)
+        return chat_data
+
+    async def flush(self) -> List[ChatDataEntity]:
+        """
+        将缓存的消息一次性写入数据库
+
+        Returns:
+            已写入的聊天数据实体
+        """
+        if not self.pending:
+            return []
+        pending, self.pending = self.pending, []
+        try:
+            saved = await self.chat_service.create_messages(pending)
+        except Exception as e:
+            logger.error(f"批量保存聊天消息失败, 共 {len(pending)} 条: {str(e)}")
+            raise
+        self.saved.extend(saved)
+        return saved
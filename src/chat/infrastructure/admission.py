@@ -0,0 +1,224 @@
+"""
+对话准入控制。
+限制同时进行的对话轮数，超出时排队；队列按源和用户做加权公平调度，
+避免单个集成方占满模型配额和数据库连接。队列已满或等待超时时快速拒绝。
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, source_id: Hashable, user_id: Hashable):
+        self.source_id = source_id
+        self.user_id = user_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Flow:
+    """一个调度单元(源或用户)，tag 为下一次被服务时的虚拟开始时间"""
+
+    def __init__(self, weight: float = 1.0):
+        self.weight = weight
+        self.tag = 0.0
+        self.waiters: Deque[_Waiter] = deque()  # 仅用户层使用
+        self.children: Dict[Hashable, "_Flow"] = {}  # 仅源层使用
+        self.vtime = 0.0  # 源内用户调度的虚拟时间
+
+    def backlogged(self) -> bool:
+        return bool(self.waiters) or any(child.waiters for child in self.children.values())
+
+
+class AdmissionTicket:
+    """准入凭证，对话结束时释放，可重复释放"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(time.monotonic() - self._started_at)
+
+
+class AdmissionController:
+    """对话准入控制器：全局并发上限 + 按源、用户加权公平排队"""
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queue: int = 128,
+        queue_timeout: float = 10.0,
+        source_weights: Optional[Dict[int, float]] = None,
+        ewma_alpha: float = 0.2
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.source_weights = source_weights or {}
+        self.ewma_alpha = ewma_alpha
+        self._active = 0
+        self._queued = 0
+        self._sources: Dict[Hashable, _Flow] = {}
+        self._vtime = 0.0  # 源之间调度的虚拟时间
+        self._turn_seconds: Optional[float] = None  # 单轮对话耗时的指数加权平均
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    async def acquire(self, user_id: Hashable, source_id: Hashable) -> AdmissionTicket:
+        """
+        申请开始一轮对话
+
+        Args:
+            user_id: 用户ID
+            source_id: 源ID
+
+        Returns:
+            准入凭证
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        if self._active < self.max_concurrent and not self._queued:
+            return self._admit(0.0)
+
+        if self._queued >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise AdmissionRejected("请求过多，请稍后重试", self.retry_after())
+
+        waiter = self._enqueue(user_id, source_id)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 超时的同时恰好被准入
+                return waiter.future.result()
+            self._remove(waiter)
+            self._stats["timeouts"] += 1
+            raise AdmissionRejected("排队超时，请稍后重试", self.retry_after())
+        except asyncio.CancelledError:
+            # 排队期间客户端断开，已经准入的名额要还回去
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def retry_after(self) -> int:
+        """
+        估算客户端应等待的秒数
+
+        Returns:
+            按当前排队数和平均对话耗时估算的秒数，至少为 1
+        """
+        turn_seconds = self._turn_seconds or 1.0
+        return max(1, math.ceil(turn_seconds * (self._queued + 1) / self.max_concurrent))
+
+    def _admit(self, waited: float) -> AdmissionTicket:
+        self._active += 1
+        self._stats["admitted"] += 1
+        self._waits.append(waited)
+        return AdmissionTicket(self)
+
+    def _enqueue(self, user_id: Hashable, source_id: Hashable) -> _Waiter:
+        source = self._sources.get(source_id)
+        if source is None:
+            source = self._sources[source_id] = _Flow(self.source_weights.get(source_id, 1.0))
+        user = source.children.get(user_id)
+        if user is None:
+            user = source.children[user_id] = _Flow()
+
+        # 重新变为积压状态的流从当前虚拟时间开始，空闲期间不积累额度
+        if not source.backlogged():
+            source.tag = max(source.tag, self._vtime)
+        if not user.waiters:
+            user.tag = max(user.tag, source.vtime)
+
+        waiter = _Waiter(source_id, user_id)
+        user.waiters.append(waiter)
+        self._queued += 1
+        self._stats["queued"] += 1
+        return waiter
+
+    def _remove(self, waiter: _Waiter) -> None:
+        source = self._sources.get(waiter.source_id)
+        user = source.children.get(waiter.user_id) if source else None
+        if user and waiter in user.waiters:
+            user.waiters.remove(waiter)
+            self._queued -= 1
+            self._prune(source, user, waiter)
+
+    def _prune(self, source: _Flow, user: _Flow, waiter: _Waiter) -> None:
+        """清理流；队列清空后调度历史不再有意义，全部重置，避免长期运行后积累大量用户"""
+        if not self._queued:
+            self._sources.clear()
+            self._vtime = 0.0
+            return
+        # 刚被服务过的流 tag 领先于虚拟时间，保留它以免重新入队时插队
+        if not user.waiters and user.tag <= source.vtime:
+            source.children.pop(waiter.user_id, None)
+        if not source.children and source.tag <= self._vtime:
+            self._sources.pop(waiter.source_id, None)
+
+    def _release(self, turn_seconds: float) -> None:
+        self._active -= 1
+        alpha = self.ewma_alpha
+        if self._turn_seconds is None:
+            self._turn_seconds = turn_seconds
+        else:
+            self._turn_seconds = alpha * turn_seconds + (1 - alpha) * self._turn_seconds
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按虚拟开始时间最小的源、源内最小的用户依次准入"""
+        while self._active < self.max_concurrent and self._queued:
+            source_id, source = min(
+                ((k, s) for k, s in self._sources.items() if s.backlogged()),
+                key=lambda item: item[1].tag
+            )
+            user_id, user = min(
+                ((k, u) for k, u in source.children.items() if u.waiters),
+                key=lambda item: item[1].tag
+            )
+            self._vtime = source.tag
+            source.tag += 1.0 / source.weight
+            source.vtime = user.tag
+            user.tag += 1.0
+
+            waiter = user.waiters.popleft()
+            self._queued -= 1
+            self._prune(source, user, waiter)
+            if waiter.future.done():
+                continue
+            waiter.future.set_result(self._admit(time.monotonic() - waiter.enqueued_at))
+
+    def stats(self) -> Dict[str, Any]:
+        """并发数、队列长度和排队耗时等指标"""
+        waits = sorted(self._waits)
+        return {
+            **self._stats,
+            "active": self._active,
+            "queue_depth": self._queued,
+            "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+            "wait_ms_p99": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 1) if waits else 0.0,
+            "turn_seconds": self._turn_seconds,
+            "retry_after": self.retry_after(),
+        }
@@ -0,0 +1,153 @@
+"""
+批量推理的执行器和 JSONL 读写。
+条目按给定并发数执行，可重试的错误按指数退避重试，结果完成一条输出一条；
+输出文件同时作为检查点，重新运行时跳过已成功的条目。
+"""
+import asyncio
+import logging
+import os
+import random
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Iterable, List, Set
+
+import ujson
+
+from .model_router import is_retryable_error
+
+logger = logging.getLogger(__name__)
+
+# 条目状态
+ITEM_SUCCEEDED = "succeeded"
+ITEM_FAILED = "failed"
+
+
+def parse_jsonl(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    解析 JSONL 输入，缺少 id 的条目以行号作为 id
+
+    Args:
+        lines: 文本行
+
+    Returns:
+        条目列表
+
+    Raises:
+        ValueError: 某一行不是 JSON 对象或缺少 content
+    """
+    items = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = ujson.loads(line)
+        except ValueError:
+            raise ValueError(f"第 {number} 行不是有效的 JSON")
+        if not isinstance(item, dict) or not item.get("content"):
+            raise ValueError(f"第 {number} 行缺少 content")
+        item.setdefault("id", str(number))
+        item["id"] = str(item["id"])
+        items.append(item)
+    return items
+
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    """读取 JSONL 输入文件"""
+    with open(path, encoding="utf-8") as f:
+        return parse_jsonl(f)
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """
+    从已有的输出文件中读取已成功的条目，文件不存在时为空
+
+    Args:
+        path: 输出文件路径
+
+    Returns:
+        已成功的条目ID
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = ujson.loads(line)
+            except ValueError:
+                # 上次中断时可能写了半行
+                continue
+            if result.get("status") == ITEM_SUCCEEDED:
+                completed.add(str(result.get("id")))
+    return completed
+
+
+class BatchRunner:
+    """按固定并发数执行批量条目"""
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        concurrency: int = 8,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0
+    ):
+        self.handler = handler  # 处理一个条目，返回结果字段
+        self.concurrency = max(concurrency, 1)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    async def run(self, items: List[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        执行条目，按完成顺序输出结果
+
+        固定数量的工作协程从共享队列取条目，内存占用与并发数有关而与条目总数无关。
+
+        Args:
+            items: 条目列表，每个条目包含 id
+
+        Yields:
+            结果，包含 id、status、attempts，以及 handler 返回的字段或 error
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def work():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await results.put(await self._run_item(item))
+
+        workers = [asyncio.create_task(work()) for _ in range(min(self.concurrency, len(items)))]
+        try:
+            for _ in range(len(items)):
+                yield await results.get()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _run_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                result = await self.handler(item)
+                return {"id": item["id"], "status": ITEM_SUCCEEDED, "attempts": attempts, **result}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempts > self.max_retries or not is_retryable_error(e):
+                    logger.error(f"批量条目执行失败: {item['id']}, {str(e)}")
+                    return {
+                        "id": item["id"],
+                        "status": ITEM_FAILED,
+                        "attempts": attempts,
+                        "error": str(e) or type(e).__name__
+                    }
+                # 指数退避并加入抖动，避免所有条目同时重试
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
@@ -0,0 +1,196 @@
+"""
+进程内的聊天历史缓存。
+缓存活跃聊天的聊天实体和消息列表，写入消息时直接追加，聊天更新或删除时失效，
+进行中的对话每轮不再需要查询和映射整个历史。按 LRU 淘汰，总条数和估算内存都有上限。
+"""
+import logging
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ..domain.models.chat import ChatDataEntity, ChatEntity
+from ..domain.services.interfaces import IChatHistoryCache
+
+logger = logging.getLogger(__name__)
+
+# 每条消息除内容外的估算开销(实体、字典和列表引用)
+MESSAGE_OVERHEAD = 400
+CHAT_OVERHEAD = 1024
+
+
+@dataclass
+class _Entry:
+    chat: ChatEntity
+    messages: Optional[List[ChatDataEntity]]  # 为空表示只缓存了聊天实体
+    size: int
+    first_unsaved: Optional[int] = None  # 第一条没有ID(批量写入)的消息下标
+
+
+def _message_size(message: ChatDataEntity) -> int:
+    return sys.getsizeof(message.content or "") + MESSAGE_OVERHEAD
+
+
+class ChatHistoryCache(IChatHistoryCache):
+    """按 chat_id 缓存聊天实体和历史消息的 LRU 缓存"""
+
+    def __init__(
+        self,
+        max_chats: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        window: int = 20
+    ):
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        # 没有ID的消息移出上下文窗口前需要重新加载，否则无法折叠进摘要
+        self.window = window
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._keys: Dict[int, str] = {}  # 聊天主键 -> chat_id
+        self.bytes = 0
+        # 命中率只统计历史消息的查询，每轮对话一次；同一轮中查询聊天实体不重复计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_chat(self, chat_id: str) -> Optional[ChatEntity]:
+        """
+        获取缓存的聊天实体
+
+        Args:
+            chat_id: 聊天ID字符串
+
+        Returns:
+            聊天实体，未缓存时为空
+        """
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry.chat
+
+    def get_messages(self, chat_id: str) -> Optional[List[ChatDataEntity]]:
+        """
+        获取缓存的历史消息
+
+        Args:
+            chat_id: 聊天ID字符串
+
+        Returns:
+            消息列表的副本，未缓存或需要重新加载时为空
+        """
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.messages is None or self._stale(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(chat_id)
+        return list(entry.messages)
+
+    def _stale(self, entry: _Entry) -> bool:
+        return entry.first_unsaved is not None and entry.first_unsaved < len(entry.messages) - self.window
+
+    def put(self, chat: ChatEntity, messages: Optional[List[ChatDataEntity]] = None) -> None:
+        """
+        缓存聊天实体和完整的历史消息
+
+        Args:
+            chat: 聊天实体
+            messages: 从数据库加载的历史消息，为空时只缓存聊天实体(已缓存的消息保留)
+        """
+        if chat.id is None or chat.is_deleted:
+            return
+        old = self._entries.get(chat.chat_id)
+        if messages is None and old is not None:
+            messages = old.messages
+        elif messages is not None:
+            messages = list(messages)
+        self._remove(chat.chat_id)
+
+        size = CHAT_OVERHEAD + sum(_message_size(m) for m in messages or [])
+        if size > self.max_bytes:
+            return
+        first_unsaved = next((i for i, m in enumerate(messages or []) if m.id is None), None)
+        self._entries[chat.chat_id] = _Entry(chat, messages, size, first_unsaved)
+        self._keys[chat.id] = chat.chat_id
+        self.bytes += size
+        self._evict()
+
+    def append(self, chat_pk: int, messages: List[ChatDataEntity]) -> None:
+        """
+        追加新写入的消息，聊天未缓存历史时忽略
+
+        Args:
+            chat_pk: 聊天主键
+            messages: 按产生顺序排列的消息
+        """
+        chat_id = self._keys.get(chat_pk)
+        entry = self._entries.get(chat_id) if chat_id else None
+        if entry is None or entry.messages is None or not messages:
+            return
+        if entry.first_unsaved is None:
+            entry.first_unsaved = next(
+                (len(entry.messages) + i for i, m in enumerate(messages) if m.id is None),
+                None
+            )
+        entry.messages.extend(messages)
+        added = sum(_message_size(m) for m in messages)
+        entry.size += added
+        self.bytes += added
+        self._evict()
+
+    def invalidate(self, chat_id: Optional[str] = None, chat_pk: Optional[int] = None) -> None:
+        """
+        使聊天的缓存失效
+
+        Args:
+            chat_id: 聊天ID字符串
+            chat_pk: 聊天主键，未提供 chat_id 时使用
+        """
+        if chat_id is None and chat_pk is not None:
+            chat_id = self._keys.get(chat_pk)
+        if chat_id is not None:
+            self._remove(chat_id)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        使用户所有聊天的缓存失效
+
+        Args:
+            user_id: 用户ID
+        """
+        for chat_id in [k for k, entry in self._entries.items() if entry.chat.user_id == user_id]:
+            self._remove(chat_id)
+
+    def invalidate_source(self, source_id: int) -> None:
+        """
+        使源下所有聊天的缓存失效
+
+        Args:
+            source_id: 源ID
+        """
+        for chat_id in [k for k, entry in self._entries.items() if entry.chat.source_id == source_id]:
+            self._remove(chat_id)
+
+    def _remove(self, chat_id: str) -> None:
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+            self._keys.pop(entry.chat.id, None)
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_chats or self.bytes > self.max_bytes):
+            chat_id = next(iter(self._entries))
+            self._remove(chat_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存条数、估算内存和命中率"""
+        lookups = self.hits + self.misses
+        return {
+            "chats": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,387 @@
+"""
+对话任务队列。
+任务模式下请求只负责入队并立即返回任务ID，进程内固定数量的工作协程执行对话，
+客户端轮询任务状态或订阅对话流获取结果。队列保存在本地 SQLite 文件中，
+进程重启后未完成的任务重新入队，前端的承载能力不再受LLM延迟限制。
+
+多个进程可以共用一个队列文件: 领取任务在 BEGIN IMMEDIATE 事务中用一条 UPDATE ... RETURNING 完成，
+同一任务只会被一个进程领取；运行中的任务记录领取者并定期续租，
+恢复时只重新入队本进程(同一领取者)中断的任务和租约已过期的任务。
+此时每个进程需要配置不同的领取者名称。
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class TurnJob:
+    """一轮对话任务，任务ID同时作为对话轮ID"""
+    id: str
+    chat_id: str
+    content: str
+    status: str = JOB_QUEUED
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    owner: Optional[str] = None
+    lease_until: Optional[float] = None
+    user_id: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class TurnJobQueue:
+    """基于 SQLite 的持久化任务队列，所有操作在线程池中执行，不阻塞事件循环"""
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 3,
+        owner: Optional[str] = None,
+        lease_seconds: float = 60.0
+    ):
+        self.path = path
+        self.max_attempts = max_attempts  # 重启后重新执行的次数上限，避免反复失败的任务无限重试
+        self.owner = owner or socket.gethostname()  # 领取者名称，重启后保持不变才能立即恢复自己中断的任务
+        self.lease_seconds = lease_seconds  # 运行中任务的租约，领取者停止续租超过该时间后其他进程可以恢复
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turn_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " chat_id TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " owner TEXT,"
+                " lease_until REAL,"
+                " user_id INTEGER)"
+            )
+            # 旧版本创建的队列文件没有后来新增的列
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(turn_jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL"), ("user_id", "INTEGER")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE turn_jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_turn_jobs_status ON turn_jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_turn_jobs_user ON turn_jobs (user_id, status)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        def call():
+            with self._lock:
+                return func(self._connect(), *args)
+        return await asyncio.to_thread(call)
+
+    async def _run_immediate(self, func: Callable[..., Any], *args: Any) -> Any:
+        """在 BEGIN IMMEDIATE 事务中执行，开始时即获取写锁，与其他进程的读改写互斥"""
+        def transaction(conn: sqlite3.Connection, *args: Any) -> Any:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        return await self._run(transaction, *args)
+
+    @staticmethod
+    def _to_job(row: Optional[sqlite3.Row]) -> Optional[TurnJob]:
+        return TurnJob(**dict(row)) if row else None
+
+    async def recover(self) -> int:
+        """
+        启动时将中断的任务重新入队，超过重试次数的标记为失败
+
+        只处理本领取者的运行中任务和租约已过期的任务，其他进程正在执行的任务不受影响。
+
+        Returns:
+            重新入队的任务数
+        """
+        def recover(conn: sqlite3.Connection) -> int:
+            now = time.time()
+            stale = "status = ? AND (owner = ? OR owner IS NULL OR lease_until < ?)"
+            conn.execute(
+                f"UPDATE turn_jobs SET status = ?, error = ?, finished_at = ? WHERE {stale} AND attempts >= ?",
+                (JOB_FAILED, "服务重启次数过多", now, JOB_RUNNING, self.owner, now, self.max_attempts)
+            )
+            return conn.execute(
+                f"UPDATE turn_jobs SET status = ?, started_at = NULL, owner = NULL, lease_until = NULL WHERE {stale}",
+                (JOB_QUEUED, JOB_RUNNING, self.owner, now)
+            ).rowcount
+        return await self._run_immediate(recover)
+
+    async def enqueue(
+        self,
+        chat_id: str,
+        content: str,
+        job_id: Optional[str] = None,
+        user_id: Optional[int] = None,
+        max_pending: int = 0
+    ) -> Optional[TurnJob]:
+        """
+        任务入队
+
+        Args:
+            chat_id: 聊天ID
+            content: 消息内容
+            job_id: 任务ID，为空时生成
+            user_id: 提交任务的用户ID
+            max_pending: 每个用户未结束(排队和运行中)的任务数上限，0 表示不限制
+
+        Returns:
+            新建的任务，用户未结束的任务已达上限时为空
+        """
+        job = TurnJob(
+            id=job_id or uuid.uuid4().hex,
+            chat_id=chat_id,
+            content=content,
+            created_at=time.time(),
+            user_id=user_id
+        )
+
+        def insert(conn: sqlite3.Connection) -> bool:
+            if max_pending and user_id is not None:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM turn_jobs WHERE user_id = ? AND status IN (?, ?)",
+                    (user_id, JOB_QUEUED, JOB_RUNNING)
+                ).fetchone()[0]
+                if pending >= max_pending:
+                    return False
+            conn.execute(
+                "INSERT INTO turn_jobs (id, chat_id, content, status, attempts, created_at, user_id)"
+                " VALUES (?, ?, ?, ?, 0, ?, ?)",
+                (job.id, job.chat_id, job.content, job.status, job.created_at, job.user_id)
+            )
+            return True
+        # 计数和写入在同一个写事务中，多个进程同时提交也不会超出上限
+        return job if await self._run_immediate(insert) else None
+
+    async def claim(self) -> Optional[TurnJob]:
+        """
+        领取最早入队的任务并标记为运行中
+
+        Returns:
+            任务，队列为空时为空
+        """
+        def claim(conn: sqlite3.Connection) -> Optional[TurnJob]:
+            now = time.time()
+            rows = conn.execute(
+                "UPDATE turn_jobs SET status = ?, attempts = attempts + 1, started_at = ?, owner = ?, lease_until = ?"
+                " WHERE id = (SELECT id FROM turn_jobs WHERE status = ? ORDER BY created_at LIMIT 1) AND status = ?"
+                " RETURNING *",
+                (JOB_RUNNING, now, self.owner, now + self.lease_seconds, JOB_QUEUED, JOB_QUEUED)
+            ).fetchall()
+            return self._to_job(rows[0]) if rows else None
+        return await self._run_immediate(claim)
+
+    async def renew(self, job_id: str) -> bool:
+        """
+        续租运行中的任务
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            任务是否仍由本领取者执行
+        """
+        def renew(conn: sqlite3.Connection) -> bool:
+            return conn.execute(
+                "UPDATE turn_jobs SET lease_until = ? WHERE id = ? AND status = ? AND owner = ?",
+                (time.time() + self.lease_seconds, job_id, JOB_RUNNING, self.owner)
+            ).rowcount > 0
+        return await self._run(renew)
+
+    async def finish(self, job_id: str, error: Optional[str] = None) -> None:
+        """
+        标记任务结束，租约过期后已被其他进程恢复的任务不再更新
+
+        Args:
+            job_id: 任务ID
+            error: 错误信息，为空表示成功
+        """
+        def finish(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "UPDATE turn_jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL"
+                " WHERE id = ? AND status = ? AND owner = ?",
+                (JOB_FAILED if error else JOB_SUCCEEDED, error, time.time(), job_id, JOB_RUNNING, self.owner)
+            )
+        await self._run(finish)
+
+    async def get(self, job_id: str) -> Optional[TurnJob]:
+        """获取任务"""
+        def get(conn: sqlite3.Connection) -> Optional[TurnJob]:
+            return self._to_job(conn.execute("SELECT * FROM turn_jobs WHERE id = ?", (job_id,)).fetchone())
+        return await self._run(get)
+
+    async def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        def counts(conn: sqlite3.Connection) -> Dict[str, int]:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM turn_jobs GROUP BY status").fetchall()
+            return {row["status"]: row["n"] for row in rows}
+        return await self._run(counts)
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class TurnWorkerPool:
+    """固定数量的工作协程，从队列领取任务并执行"""
+
+    def __init__(
+        self,
+        queue: TurnJobQueue,
+        handler: Callable[[TurnJob], Awaitable[None]],
+        workers: int = 4,
+        max_queued: int = 1000,
+        max_pending_per_user: int = 0,
+        poll_interval: float = 1.0
+    ):
+        self.queue = queue
+        self.handler = handler  # 执行任务，抛出异常表示任务失败
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_pending_per_user = max_pending_per_user  # 每个用户未结束的任务数上限，0 表示不限制
+        self.poll_interval = poll_interval  # 没有入队通知时的兜底轮询间隔
+        self.queued = 0
+        self.busy = 0
+        self.succeeded = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """恢复中断的任务并启动工作协程"""
+        if self._tasks:
+            return
+        recovered = await self.queue.recover()
+        if recovered:
+            logger.info(f"重新入队 {recovered} 个中断的对话任务")
+        self.queued = (await self.queue.counts()).get(JOB_QUEUED, 0)
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+
+    async def submit(
+        self,
+        chat_id: str,
+        content: str,
+        job_id: Optional[str] = None,
+        user_id: Optional[int] = None
+    ) -> Optional[TurnJob]:
+        """
+        提交任务
+
+        Args:
+            chat_id: 聊天ID
+            content: 消息内容
+            job_id: 任务ID，为空时生成
+            user_id: 提交任务的用户ID，用于限制单个用户未结束的任务数
+
+        Returns:
+            任务，排队任务过多或该用户未结束的任务过多时为空
+        """
+        if self.queued >= self.max_queued:
+            return None
+        job = await self.queue.enqueue(chat_id, content, job_id, user_id, self.max_pending_per_user)
+        if not job:
+            return None
+        self.queued += 1
+        self._wakeup.set()
+        return job
+
+    async def _work(self, index: int) -> None:
+        while True:
+            job = await self.queue.claim()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.queued = max(self.queued - 1, 0)
+            self.busy += 1
+            heartbeat = asyncio.create_task(self._heartbeat(job.id))
+            error = None
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                # 停止服务时任务保持运行中状态，下次启动时重新入队
+                raise
+            except Exception as e:
+                logger.error(f"对话任务执行失败: {job.id}, {str(e)}")
+                error = str(e) or type(e).__name__
+            finally:
+                heartbeat.cancel()
+                self.busy -= 1
+            await self.queue.finish(job.id, error)
+            if error:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """任务执行期间定期续租，避免被其他进程当作中断的任务恢复"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await self.queue.renew(job_id)
+            except Exception as e:
+                logger.warning(f"对话任务续租失败: {job_id}, {str(e)}")
+
+    async def stop(self) -> None:
+        """停止工作协程，进行中的任务在下次启动时重新执行"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.queue.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """工作协程和队列的运行指标"""
+        return {
+            "workers": len(self._tasks),
+            "busy": self.busy,
+            "queued": self.queued,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
@@ -0,0 +1,79 @@
+"""
+同步LLM客户端执行器。
+部分供应商只有同步客户端，直接在事件循环中调用会阻塞整个 worker，
+这里统一放到受限的线程池中执行。
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncGenerator, Callable, Iterator, Optional
+
+from ..domain.services.interfaces import ISyncLLMExecutor
+
+_SENTINEL = object()
+
+
+class SyncLLMExecutor(ISyncLLMExecutor):
+    """同步LLM调用的线程池执行器，并发数受信号量保护"""
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="llm-sync"
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @asynccontextmanager
+    async def _guard(self):
+        """占用一个线程名额，排队发生在事件循环中，便于取消"""
+        # 执行器是进程内共享的，信号量绑定在事件循环上，循环变化时重新创建
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        async with self._semaphore:
+            yield
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在线程池中执行同步函数
+
+        Args:
+            func: 同步函数
+
+        Returns:
+            函数返回值
+        """
+        async with self._guard():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def iterate(self, iterator: Iterator[Any]) -> AsyncGenerator[Any, None]:
+        """
+        在线程池中逐个读取同步迭代器(例如同步客户端的流式响应)
+
+        Args:
+            iterator: 同步迭代器
+
+        Yields:
+            迭代器中的元素
+        """
+        iterator = iter(iterator)
+        async with self._guard():
+            loop = asyncio.get_running_loop()
+            while True:
+                item = await loop.run_in_executor(self._executor, next, iterator, _SENTINEL)
+                if item is _SENTINEL:
+                    break
+                yield item
+
+    def shutdown(self) -> None:
+        """关闭线程池"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 进程内共享的执行器
+sync_llm_executor = SyncLLMExecutor()
@@ -0,0 +1,101 @@
+"""
+ORM模型与领域实体之间的转换。
+每一对(ORM模型, 实体)在导入时生成专用的转换函数，函数体是逐字段的赋值，
+转换时不再遍历注解或调用 hasattr/getattr；列表查询可以直接选择列，由行元组构建实体，
+跳过ORM对象的创建和身份映射。
+"""
+import dataclasses
+from typing import Any, Callable, Dict, Generic, List, Sequence, Tuple, Type, TypeVar
+
+from sqlalchemy import Select, inspect, select
+
+from ..domain.models.chat import (
+    ChatEntity,
+    ChatDataEntity,
+    ChatToolEntity,
+    ChatSummaryEntity,
+    SourceEntity,
+    PromptEntity,
+    ChatToolConfig
+)
+from .models import Chat, ChatData, ChatSummary, ChatTool, Source, Prompt, Tool
+
+T = TypeVar('T')
+M = TypeVar('M')
+
+
+def _compile(name: str, arg: str, target: str, values: Sequence[Tuple[str, str]], namespace: Dict[str, Any]) -> Callable:
+    """生成形如 def name(arg): return target(field=value, ...) 的函数"""
+    body = ", ".join(f"{field}={value}" for field, value in values)
+    source = f"def {name}({arg}):\n    return {target}({body})\n"
+    exec(compile(source, f"<mapper {name}>", "exec"), namespace)
+    return namespace[name]
+
+
+class EntityMapper(Generic[T, M]):
+    """一对ORM模型和实体的转换函数"""
+
+    def __init__(self, model_class: Type[M], entity_class: Type[T]):
+        self.model_class = model_class
+        self.entity_class = entity_class
+        # 实体字段中在ORM模型上有对应列的部分，顺序与实体定义一致
+        columns = inspect(model_class).columns
+        self.fields: List[str] = [
+            field.name for field in dataclasses.fields(entity_class)
+            if field.name in columns
+        ]
+        self.columns = [getattr(model_class, field) for field in self.fields]
+
+        namespace = {"Entity": entity_class, "Model": model_class}
+        self.to_entity: Callable[[M], T] = _compile(
+            "to_entity", "model", "Entity",
+            [(field, f"model.{field}") for field in self.fields], namespace
+        )
+        self.to_model: Callable[[T], M] = _compile(
+            "to_model", "entity", "Model",
+            [(field, f"entity.{field}") for field in self.fields], namespace
+        )
+        self.from_row: Callable[[Sequence[Any]], T] = _compile(
+            "from_row", "row", "Entity",
+            [(field, f"row[{i}]") for i, field in enumerate(self.fields)], namespace
+        )
+        # INSERT 的参数，默认值已由实体在 Python 端填充
+        self.to_values: Callable[[T], Dict[str, Any]] = _compile(
+            "to_values", "entity", "dict",
+            [(field, f"entity.{field}") for field in self.fields], namespace
+        )
+
+    def select(self) -> Select:
+        """只选择实体需要的列，结果行可直接交给 from_row"""
+        return select(*self.columns)
+
+
+_mappers: Dict[Tuple[type, type], EntityMapper] = {}
+
+
+def register_mapper(model_class: Type[M], entity_class: Type[T]) -> EntityMapper[T, M]:
+    """生成并登记一对模型和实体的转换函数"""
+    mapper = EntityMapper(model_class, entity_class)
+    _mappers[(model_class, entity_class)] = mapper
+    return mapper
+
+
+def get_mapper(model_class: Type[M], entity_class: Type[T]) -> EntityMapper[T, M]:
+    """获取转换函数，未预先登记的组合在首次使用时生成"""
+    mapper = _mappers.get((model_class, entity_class))
+    if mapper is None:
+        mapper = register_mapper(model_class, entity_class)
+    return mapper
+
+
+# 仓储使用的组合在导入时生成
+for _model, _entity in (
+    (Chat, ChatEntity),
+    (ChatData, ChatDataEntity),
+    (ChatSummary, ChatSummaryEntity),
+    (ChatTool, ChatToolEntity),
+    (Source, SourceEntity),
+    (Prompt, PromptEntity),
+    (Tool, ChatToolConfig),
+):
+    register_mapper(_model, _entity)
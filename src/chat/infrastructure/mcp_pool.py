@@ -0,0 +1,244 @@
+"""
+MCP客户端会话池。
+保持已初始化的MCP会话，在请求和工具调用之间复用，避免每次调用都重新握手。
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+from fastmcp import Client
+from fastmcp.client.transports import FastMCPTransport, StreamableHttpTransport
+
+from ..domain.services.interfaces import IMCPSessionPool
+
+logger = logging.getLogger(__name__)
+
+# MCP传输方式
+TRANSPORT_AUTO = "auto"      # 地址指向本进程时使用进程内传输，否则使用HTTP
+TRANSPORT_MEMORY = "memory"  # 强制使用进程内传输
+TRANSPORT_HTTP = "http"      # 强制使用HTTP
+
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "0.0.0.0", "::1"}
+
+
+def is_local_url(url: str) -> bool:
+    """判断MCP地址是否指向当前服务自身"""
+    from config.settings import settings
+
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    hosts = _LOCAL_HOSTS | {settings.SERVER.HOST}
+    return parsed.hostname in hosts and port == settings.SERVER.PORT
+
+
+def create_mcp_client(url: str, transport: str = TRANSPORT_AUTO) -> Client:
+    """
+    创建MCP客户端
+
+    工具服务挂载在同一个应用中时，直接调用进程内的 FastMCP 实例，
+    省去HTTP封包、JSON编解码和认证中间件；远程服务仍走HTTP。
+
+    Args:
+        url: MCP服务地址
+        transport: 传输方式，auto/memory/http
+
+    Returns:
+        MCP客户端
+    """
+    if transport != TRANSPORT_HTTP:
+        # 延迟导入，只有真正建立会话时才依赖 mcp_server 模块
+        from mcp_server import get_fastmcp_server
+
+        server = get_fastmcp_server()
+        if server is not None and (transport == TRANSPORT_MEMORY or is_local_url(url)):
+            return Client(transport=FastMCPTransport(server))
+        if transport == TRANSPORT_MEMORY:
+            logger.warning("当前进程中没有 FastMCP 实例，回退为HTTP传输")
+    return Client(transport=StreamableHttpTransport(url=url))
+
+
+class _PooledSession:
+    """池中的一个MCP会话
+
+    MCP传输层依赖 anyio 任务组，进入和退出必须在同一个任务中完成，
+    因此每个会话由一个后台任务持有，直到被关闭。
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    async def open(self, timeout: float) -> None:
+        """建立连接并完成初始化握手"""
+        self._task = asyncio.create_task(self._hold())
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except BaseException:
+            await self.close()
+            raise
+        if self._error:
+            raise self._error
+
+    async def _hold(self) -> None:
+        try:
+            async with self.client:
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self._error = e
+            logger.warning(f"MCP会话异常结束: {str(e)}")
+        finally:
+            self._ready.set()
+
+    @property
+    def alive(self) -> bool:
+        """会话是否仍然可用"""
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self.client.is_connected()
+        )
+
+    async def close(self) -> None:
+        """关闭会话"""
+        self._closing.set()
+        if self._task and not self._task.done():
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except (asyncio.TimeoutError, Exception):
+                self._task.cancel()
+
+
+class MCPSessionPool(IMCPSessionPool):
+    """MCP会话池，限制单个服务的并发会话数，并对空闲会话做健康检查"""
+
+    def __init__(
+        self,
+        url: str,
+        client_factory: Optional[Callable[[], Client]] = None,
+        transport: str = TRANSPORT_AUTO,
+        max_size: int = 4,
+        health_check_interval: float = 30.0,
+        connect_timeout: float = 10.0
+    ):
+        self.url = url
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        # 每次新建会话时再解析传输方式，FastMCP 实例可能晚于会话池创建
+        self._client_factory = client_factory or (
+            lambda: create_mcp_client(url, transport)
+        )
+        self._idle: List[_PooledSession] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 后台关闭失效会话的任务，保留引用避免执行完成前被回收
+        self._close_tasks: Set[asyncio.Task] = set()
+
+    def _bind_loop(self) -> None:
+        """会话绑定在事件循环上，循环变化时丢弃旧会话"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._idle = []
+            self._semaphore = asyncio.Semaphore(self.max_size)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[Client]:
+        """
+        借用一个已初始化的MCP会话
+
+        Yields:
+            已连接的MCP客户端
+        """
+        self._bind_loop()
+        async with self._semaphore:
+            pooled = await self._acquire()
+            try:
+                yield pooled.client
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # 请求中途被取消，会话上可能还有未完成的响应，直接丢弃
+                await pooled.close()
+                raise
+            except BaseException:
+                self._release(pooled)
+                raise
+            else:
+                self._release(pooled)
+
+    async def _acquire(self) -> _PooledSession:
+        """取出一个可用的空闲会话，没有则新建"""
+        while self._idle:
+            pooled = self._idle.pop()
+            if await self._check(pooled):
+                return pooled
+            await pooled.close()
+
+        logger.info(f"创建MCP会话: {self.url}")
+        pooled = _PooledSession(self._client_factory())
+        await pooled.open(self.connect_timeout)
+        return pooled
+
+    async def _check(self, pooled: _PooledSession) -> bool:
+        """健康检查，长时间空闲的会话需要 ping 一次"""
+        if not pooled.alive:
+            return False
+        if time.monotonic() - pooled.last_used < self.health_check_interval:
+            return True
+        try:
+            return await asyncio.wait_for(pooled.client.ping(), self.connect_timeout)
+        except Exception as e:
+            logger.warning(f"MCP会话健康检查失败，将重新连接: {str(e)}")
+            return False
+
+    def _release(self, pooled: _PooledSession) -> None:
+        """归还会话"""
+        if not pooled.alive:
+            task = asyncio.create_task(pooled.close())
+            self._close_tasks.add(task)
+            task.add_done_callback(self._close_tasks.discard)
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.append(pooled)
+
+    async def close(self) -> None:
+        """关闭所有空闲会话"""
+        idle, self._idle = self._idle, []
+        for pooled in idle:
+            await pooled.close()
+
+
+# 进程内的会话池，按MCP服务地址区分
+_pools: Dict[str, MCPSessionPool] = {}
+
+
+def get_mcp_session_pool(url: str, **kwargs) -> MCPSessionPool:
+    """
+    获取MCP服务对应的会话池
+
+    Args:
+        url: MCP服务地址
+        kwargs: 首次创建时使用的会话池参数
+
+    Returns:
+        会话池
+    """
+    pool = _pools.get(url)
+    if pool is None:
+        pool = _pools[url] = MCPSessionPool(url, **kwargs)
+    return pool
+
+
+async def close_mcp_session_pools() -> None:
+    """关闭所有会话池"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.close()
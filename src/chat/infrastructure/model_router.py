@@ -0,0 +1,449 @@
+"""
+LLM模型路由。
+同一个模型可以配置多个端点(不同的 API 地址或部署)，这里按实时的延迟和错误率
+在端点之间分配请求，端点连续失败时熔断，超时或 5xx 时切换到下一个端点。
+开启对冲后，首字节迟迟未到的请求会向第二个端点再发一份，先返回的胜出。
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from ..domain.services.interfaces import IModelRouter
+from .streams import aclose_stream
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CIRCUIT_CLOSED = "closed"        # 正常
+CIRCUIT_OPEN = "open"            # 熔断中，不分配请求
+CIRCUIT_HALF_OPEN = "half_open"  # 熔断到期，允许一个探测请求
+
+# 可重试的供应商异常类型名(litellm / openai 客户端)
+_RETRYABLE_ERROR_NAMES = {"Timeout", "APITimeoutError", "APIConnectionError"}
+
+
+@dataclass
+class ModelEndpoint:
+    """模型端点及其实时统计"""
+    name: str                     # 模型名称
+    api_key: str
+    api_base: str
+    sync_client: bool = False
+    latency_ewma: Optional[float] = None  # 延迟(秒)的指数加权平均，流式为首块延迟
+    error_ewma: float = 0.0               # 错误率的指数加权平均
+    in_flight: int = 0
+    consecutive_failures: int = 0
+    opened_at: Optional[float] = None
+    probing: bool = False
+    requests: int = 0
+    failures: int = 0
+    key: str = field(init=False)
+
+    def __post_init__(self):
+        self.key = f"{self.name}@{self.api_base}"
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    判断错误是否应切换端点重试
+
+    超时、连接错误、限流和 5xx 属于端点问题，换一个端点可能成功；
+    其余 4xx(参数错误、鉴权失败等)换端点也不会成功，直接抛出。
+
+    Args:
+        error: 异常
+
+    Returns:
+        是否可重试
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # litellm 的超时和连接错误按类型(含父类)名判断，需在状态码之前: Timeout 的状态码是 408
+    if any(cls.__name__ in _RETRYABLE_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in (408, 429) or status_code >= 500
+    return False
+
+
+class ModelRouter(IModelRouter):
+    """模型路由，按延迟和错误率选择端点，支持熔断、故障切换和对冲请求"""
+
+    def __init__(
+        self,
+        endpoints: List[ModelEndpoint],
+        ewma_alpha: float = 0.3,
+        failure_threshold: int = 3,
+        recovery_timeout: float = 30.0,
+        max_attempts: Optional[int] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_budget: float = 0.05,
+        hedge_min_samples: int = 20,
+        latency_window: int = 500
+    ):
+        if not endpoints:
+            raise ValueError("至少需要配置一个模型端点")
+        self.endpoints = endpoints
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_attempts = max_attempts
+        # 对冲: 等待超过该分位的首字节延迟后，向第二个端点再发一份请求
+        self.hedge_percentile = hedge_percentile
+        # 对冲预算: 每个请求积累 hedge_budget 个令牌，对冲一次消耗一个
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self._hedge_tokens = 0.0
+        # 流式请求记录首块延迟，非流式请求记录完整响应的延迟，两者分布不同，分开统计
+        self._latencies: Dict[bool, Deque[float]] = {
+            stream: deque(maxlen=latency_window) for stream in (False, True)
+        }
+        self._failovers = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._hedge_saved = 0.0
+
+    def state(self, endpoint: ModelEndpoint) -> str:
+        """端点的熔断器状态"""
+        if endpoint.opened_at is None:
+            return CIRCUIT_CLOSED
+        if time.monotonic() - endpoint.opened_at >= self.recovery_timeout:
+            return CIRCUIT_HALF_OPEN
+        return CIRCUIT_OPEN
+
+    def _available(self, endpoint: ModelEndpoint) -> bool:
+        state = self.state(endpoint)
+        if state == CIRCUIT_CLOSED:
+            return True
+        # 半开状态只放行一个探测请求
+        return state == CIRCUIT_HALF_OPEN and not endpoint.probing
+
+    def _score(self, endpoint: ModelEndpoint) -> float:
+        """分数越低越优先；尚无延迟数据的端点优先，以便尽快获得统计"""
+        latency = endpoint.latency_ewma or 0.0
+        return latency * (1 + endpoint.in_flight) / max(1.0 - endpoint.error_ewma, 0.05)
+
+    def candidates(self, model: Optional[str] = None) -> List[ModelEndpoint]:
+        """
+        按优先级排列的候选端点
+
+        Args:
+            model: 模型名称，为空时使用全部端点
+
+        Returns:
+            候选端点列表
+
+        Raises:
+            ValueError: 没有该模型的端点，且配置了多个模型
+        """
+        endpoints = self._endpoints_for(model)
+        available = [e for e in endpoints if self._available(e)]
+        if not available:
+            # 全部熔断时仍然尝试最早熔断的端点，避免整体不可用
+            logger.warning(f"模型 {model} 的所有端点均已熔断，尝试最早熔断的端点")
+            return sorted(endpoints, key=lambda e: e.opened_at or 0.0)[:1]
+
+        random.shuffle(available)  # 分数相同时随机分配
+        available.sort(key=self._score)
+        if self.max_attempts:
+            available = available[:self.max_attempts]
+        return available
+
+    def _endpoints_for(self, model: Optional[str]) -> List[ModelEndpoint]:
+        if model is None:
+            return list(self.endpoints)
+        endpoints = [e for e in self.endpoints if e.name == model]
+        if endpoints:
+            return endpoints
+        # 只配置了一个模型时，请求的名称视为它的别名；否则不能把请求发给其他模型
+        if len({e.name for e in self.endpoints}) == 1:
+            return list(self.endpoints)
+        raise ValueError(f"没有配置模型 {model} 的端点")
+
+    def record_success(self, endpoint: ModelEndpoint, latency: float) -> None:
+        """记录成功请求，关闭熔断器"""
+        alpha = self.ewma_alpha
+        if endpoint.latency_ewma is None:
+            endpoint.latency_ewma = latency
+        else:
+            endpoint.latency_ewma = alpha * latency + (1 - alpha) * endpoint.latency_ewma
+        endpoint.error_ewma = (1 - alpha) * endpoint.error_ewma
+        endpoint.consecutive_failures = 0
+        if endpoint.opened_at is not None:
+            logger.info(f"模型端点恢复: {endpoint.key}")
+        endpoint.opened_at = None
+
+    def record_failure(self, endpoint: ModelEndpoint, error: BaseException) -> None:
+        """记录失败请求，连续失败达到阈值或探测失败时熔断"""
+        alpha = self.ewma_alpha
+        endpoint.error_ewma = alpha + (1 - alpha) * endpoint.error_ewma
+        endpoint.consecutive_failures += 1
+        endpoint.failures += 1
+        half_open = self.state(endpoint) == CIRCUIT_HALF_OPEN
+        if half_open or endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.opened_at = time.monotonic()
+            logger.warning(
+                f"模型端点熔断: {endpoint.key}, 连续失败 {endpoint.consecutive_failures} 次, "
+                f"最近错误: {str(error)}"
+            )
+
+    def hedge_deadline(self, stream: bool = False) -> Optional[float]:
+        """
+        对冲等待时间，取同一类请求最近延迟的分位数
+
+        Args:
+            stream: 是否流式请求，流式取首块延迟，非流式取完整响应的延迟
+
+        Returns:
+            等待秒数，未开启或样本不足时为 None
+        """
+        if self.hedge_percentile is None or len(self._latencies[stream]) < self.hedge_min_samples:
+            return None
+        return self._percentile(self.hedge_percentile, stream)
+
+    def _percentile(self, q: float, stream: bool) -> Optional[float]:
+        if not self._latencies[stream]:
+            return None
+        samples = sorted(self._latencies[stream])
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    async def call(
+        self,
+        request: Callable[[ModelEndpoint], Awaitable[Any]],
+        model: Optional[str] = None,
+        stream: bool = False
+    ) -> Any:
+        """
+        选择端点发起请求，失败时切换到下一个端点
+
+        流式请求在收到首个响应块之前失败都可以切换端点；
+        一旦开始输出，后续错误直接抛出。
+
+        Args:
+            request: 以端点为参数发起请求的协程函数
+            model: 模型名称
+            stream: 是否流式请求
+
+        Returns:
+            响应，流式时为响应块异步迭代器
+        """
+        candidates = self.candidates(model)
+        if self.hedge_percentile is not None:
+            self._hedge_tokens = min(self._hedge_tokens + self.hedge_budget, 1.0 + self.hedge_budget)
+
+        tried: Set[str] = set()
+        last_error: Optional[BaseException] = None
+        for index, endpoint in enumerate(candidates):
+            if endpoint.key in tried:
+                continue
+            if tried:
+                self._failovers += 1
+                logger.warning(f"切换模型端点: {endpoint.key}, 上一次错误: {str(last_error)}")
+
+            backup = next((e for e in candidates[index + 1:] if e.key not in tried), None)
+            try:
+                endpoint, response, first = await self._hedged(
+                    request, endpoint, backup, stream, tried
+                )
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                continue
+
+            if not stream:
+                endpoint.in_flight -= 1
+                return response
+            return self._relay(endpoint, first, response)
+
+        raise last_error
+
+    async def _attempt(
+        self,
+        endpoint: ModelEndpoint,
+        request: Callable[[ModelEndpoint], Awaitable[Any]],
+        stream: bool
+    ) -> Tuple[Any, Any]:
+        """向单个端点发起请求，流式请求等到首个响应块"""
+        half_open = self.state(endpoint) == CIRCUIT_HALF_OPEN
+        endpoint.probing = endpoint.probing or half_open
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await request(endpoint)
+            first = await self._first_chunk(response) if stream else None
+        except Exception as e:
+            endpoint.in_flight -= 1
+            self.record_failure(endpoint, e)
+            if stream:
+                await aclose_stream(response)
+            raise
+        except BaseException:
+            # 对冲落败或调用方取消时，已建立的流也要关闭
+            endpoint.in_flight -= 1
+            if stream:
+                await aclose_stream(response)
+            raise
+        finally:
+            if half_open:
+                endpoint.probing = False
+
+        latency = time.perf_counter() - start
+        self.record_success(endpoint, latency)
+        self._latencies[stream].append(latency)
+        return response, first
+
+    async def _hedged(
+        self,
+        request: Callable[[ModelEndpoint], Awaitable[Any]],
+        primary: ModelEndpoint,
+        backup: Optional[ModelEndpoint],
+        stream: bool,
+        tried: Set[str]
+    ) -> Tuple[ModelEndpoint, Any, Any]:
+        """
+        发起请求，超过对冲等待时间仍无响应时向备用端点再发一份
+
+        Args:
+            request: 以端点为参数发起请求的协程函数
+            primary: 首选端点
+            backup: 备用端点
+            stream: 是否流式请求
+            tried: 已发起请求的端点，用于故障切换时跳过
+
+        Returns:
+            胜出的端点、响应和首个响应块
+        """
+        tried.add(primary.key)
+        deadline = self.hedge_deadline(stream) if backup else None
+        if deadline is None:
+            response, first = await self._attempt(primary, request, stream)
+            return primary, response, first
+
+        start = time.perf_counter()
+        tasks = {asyncio.create_task(self._attempt(primary, request, stream)): primary}
+        winner: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deadline)
+            if not done and self._hedge_tokens >= 1.0:
+                self._hedge_tokens -= 1.0
+                self._hedges += 1
+                tried.add(backup.key)
+                logger.info(f"首字节超过 {deadline:.3f} 秒，对冲请求: {backup.key}")
+                tasks[asyncio.create_task(self._attempt(backup, request, stream))] = backup
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成时优先使用首选端点
+                for task in sorted(done, key=lambda t: tasks[t] is not primary):
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+                if winner:
+                    break
+            if winner is None:
+                raise error
+        finally:
+            # 取消落后的请求，已经返回的响应也要释放
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            for task, endpoint in tasks.items():
+                if task is winner:
+                    continue
+                try:
+                    response, _ = await task
+                except BaseException:
+                    continue
+                await self._discard(endpoint, response, stream)
+
+        if tasks[winner] is not primary:
+            self._record_hedge_win(time.perf_counter() - start, stream)
+        response, first = winner.result()
+        return tasks[winner], response, first
+
+    @staticmethod
+    async def _discard(endpoint: ModelEndpoint, response: Any, stream: bool) -> None:
+        """释放对冲中落败但已返回的响应"""
+        endpoint.in_flight -= 1
+        if stream:
+            await aclose_stream(response)
+
+    def _record_hedge_win(self, elapsed: float, stream: bool) -> None:
+        """
+        记录对冲胜出，并估算节省的时间
+
+        被取消的请求原本会落在延迟分布的尾部，这里用历史样本中
+        超过当前耗时的部分的均值估算它的延迟。
+        """
+        self._hedge_wins += 1
+        tail = [latency for latency in self._latencies[stream] if latency > elapsed]
+        if tail:
+            self._hedge_saved += sum(tail) / len(tail) - elapsed
+
+    @staticmethod
+    async def _first_chunk(response: Any) -> Any:
+        """读取首个响应块，空响应返回 None"""
+        try:
+            return await response.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _relay(self, endpoint: ModelEndpoint, first: Any, response: Any) -> AsyncGenerator[Any, None]:
+        """转发首块和剩余的响应块，结束时释放端点"""
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in response:
+                yield chunk
+        except Exception as e:
+            self.record_failure(endpoint, e)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+            await aclose_stream(response)
+
+    def stats(self) -> Dict[str, Any]:
+        """各端点的实时统计"""
+        return {
+            "failovers": self._failovers,
+            "endpoints": [
+                {
+                    "model": e.name,
+                    "api_base": e.api_base,
+                    "state": self.state(e),
+                    "latency_ewma": e.latency_ewma,
+                    "error_ewma": e.error_ewma,
+                    "in_flight": e.in_flight,
+                    "requests": e.requests,
+                    "failures": e.failures,
+                }
+                for e in self.endpoints
+            ],
+            "hedge": {
+                "requests": self._hedges,
+                "wins": self._hedge_wins,
+                "saved_ms": round(self._hedge_saved * 1000, 1),
+                "stream": {
+                    "deadline": self.hedge_deadline(True),
+                    "ttfb_p50": self._percentile(0.5, True),
+                    "ttfb_p99": self._percentile(0.99, True),
+                },
+                "complete": {
+                    "deadline": self.hedge_deadline(False),
+                    "latency_p50": self._percentile(0.5, False),
+                    "latency_p99": self._percentile(0.99, False),
+                },
+            },
+        }
@@ -1,9 +1,11 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, JSON, Enum, Boolean
+from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, JSON, Enum, Boolean, Index
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from infra.database import Base
+from utils.time_util import utcnow
 from ...domain.models.enums import SourceType, PromptType, Role, ContentType
 
 class Source(Base):
@@ -71,6 +73,7 @@ class Chat(Base):
 
     source: Mapped["Source"] = relationship("Source", back_populates="chats")
     chat_data: Mapped[list["ChatData"]] = relationship("ChatData", back_populates="chat", cascade="all, delete-orphan")
+    summary: Mapped["ChatSummary | None"] = relationship("ChatSummary", back_populates="chat", cascade="all, delete-orphan", uselist=False)
     chat_tools: Mapped[list["ChatTool"]] = relationship("ChatTool", back_populates="chat", cascade="all, delete-orphan")
 
     def get_formatted_system_prompt(self) -> str:
@@ -80,6 +83,10 @@ class Chat(Base):
 class ChatData(Base):
     """聊天数据ORM模型"""
     __tablename__ = "mpc_chat_data"
+    # 按 (chat_id, id) 游标分页读取历史消息
+    __table_args__ = (
+        Index("ix_mpc_chat_data_chat_id_id", "chat_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(Integer, ForeignKey("mpc_chat.id", ondelete="CASCADE"), nullable=False)
@@ -87,10 +94,28 @@ class ChatData(Base):
     content_type: Mapped[ContentType] = mapped_column(Enum(ContentType), default=ContentType.MSG, nullable=False)
     role: Mapped[Role] = mapped_column(Enum(Role), nullable=False)
     extra: Mapped[dict | None] = mapped_column(JSON, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # 一轮对话的消息批量写入，创建时间按微秒递增排序；MySQL 的 DATETIME 默认不保存小数秒
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"),
+        default=utcnow,
+        nullable=False
+    )
 
     chat: Mapped["Chat"] = relationship("Chat", back_populates="chat_data")
 
+class ChatSummary(Base):
+    """聊天摘要ORM模型"""
+    __tablename__ = "mpc_chat_summary"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(Integer, ForeignKey("mpc_chat.id", ondelete="CASCADE"), unique=True, nullable=False)
+    content: Mapped[str] = mapped_column(Text, default='', nullable=False)
+    last_message_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)
+
+    chat: Mapped["Chat"] = relationship("Chat", back_populates="summary")
+
 class ChatTool(Base):
     """聊天工具ORM模型"""
     __tablename__ = "chat_tool"
@@ -1,11 +1,15 @@
 from typing import List, Optional, Dict, Any, TypeVar, Generic, Type
-from sqlalchemy import select, and_
+from sqlalchemy import Select, and_, insert, update, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from utils.time_util import utcnow
+
 from ...domain.repositories.chat_repository import (
     IChatRepository, 
     IChatDataRepository, 
     IChatToolRepository,
+    IChatSummaryRepository,
     ISourceRepository,
     IPromptRepository,
     IToolRepository
@@ -14,16 +18,22 @@ from ...domain.models.chat import (
     ChatEntity, 
     ChatDataEntity, 
     ChatToolEntity,
+    ChatSummaryEntity,
     SourceEntity,
     PromptEntity,
     ChatToolConfig
 )
-from .models import Chat, ChatData, ChatTool, Source, Prompt, Tool
+from ...domain.models.enums import Role
+from .models import Chat, ChatData, ChatSummary, ChatTool, Source, Prompt, Tool
+from .mappers import get_mapper
 
 # 类型变量，用于泛型
 T = TypeVar('T')
 M = TypeVar('M')
 
+# 批量写入时每条INSERT语句包含的行数
+DEFAULT_BATCH_SIZE = 1000
+
 class BaseRepository(Generic[T, M]):
     """基础仓储，提供基础的CRUD操作"""
     
@@ -31,40 +41,88 @@ class BaseRepository(Generic[T, M]):
         self.session = session
         self.entity_class = entity_class
         self.model_class = model_class
+        # 导入时生成的专用转换函数
+        self.mapper = get_mapper(model_class, entity_class)
     
     def _to_entity(self, model: M) -> T:
         """将ORM模型转换为领域实体"""
         if not model:
             return None
-        
-        # 获取模型的所有属性
-        attrs = {}
-        for key in self.entity_class.__annotations__.keys():
-            if hasattr(model, key):
-                attrs[key] = getattr(model, key)
-        
-        return self.entity_class(**attrs)
+        return self.mapper.to_entity(model)
     
     def _to_model(self, entity: T) -> M:
         """将领域实体转换为ORM模型"""
         if not entity:
             return None
+        return self.mapper.to_model(entity)
+    
+    def _select(self) -> Select:
+        """只选择实体需要的列，查询结果不创建ORM对象"""
+        return self.mapper.select()
+    
+    async def _fetch_one(self, stmt: Select) -> Optional[T]:
+        """执行列查询，返回第一行构建的实体"""
+        result = await self.session.execute(stmt)
+        row = result.first()
+        return self.mapper.from_row(row) if row else None
+    
+    async def _fetch_all(self, stmt: Select) -> List[T]:
+        """执行列查询，由结果行直接构建实体"""
+        result = await self.session.execute(stmt)
+        from_row = self.mapper.from_row
+        return [from_row(row) for row in result]
+    
+    async def _insert(self, entity: T) -> T:
+        """
+        单条INSERT写入实体，主键取自INSERT结果
         
-        # 如果已有ID，则查询现有模型
-        if getattr(entity, 'id', None):
-            model = self.model_class()
-            for key, value in entity.__dict__.items():
-                if hasattr(model, key):
-                    setattr(model, key, value)
-            return model
+        实体在 Python 端已填充 chat_id、created_at 等默认值，写入后无需再查询一次。
+        """
+        values = self.mapper.to_values(entity)
+        if values.get("id") is None:
+            values.pop("id", None)
+        result = await self.session.execute(insert(self.model_class).values(**values))
+        entity.id = result.inserted_primary_key[0]
+        return entity
+    
+    async def _insert_many(self, entities: List[T], batch_size: Optional[int] = None) -> List[T]:
+        """
+        按批次写入多个实体，每批一条多行INSERT(驱动不支持时为 executemany)
         
-        # 创建新模型
-        attrs = {}
-        for key, value in entity.__dict__.items():
-            if hasattr(self.model_class, key):
-                attrs[key] = value
+        不回填主键: MySQL 不支持 INSERT ... RETURNING，多行INSERT无法可靠取得每行的ID。
+        """
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        to_values = self.mapper.to_values
+        stmt = insert(self.model_class)
+        for start in range(0, len(entities), batch_size):
+            rows = [to_values(entity) for entity in entities[start:start + batch_size]]
+            for row in rows:
+                del row["id"]
+            await self.session.execute(stmt, rows)
+        return entities
+    
+    async def _update(self, *where, **values) -> int:
+        """
+        单条UPDATE，返回匹配的行数
         
-        return self.model_class(**attrs)
+        不同步会话中的ORM对象: 读取都直接构建实体，会话中没有需要同步的对象。
+        """
+        stmt = update(self.model_class).where(*where).values(**values)
+        result = await self.session.execute(stmt, execution_options={"synchronize_session": False})
+        return result.rowcount
+    
+    async def _update_entity(self, entity: T) -> Optional[T]:
+        """按主键把实体的字段写回数据库(创建时间除外)，记录不存在时返回空"""
+        values = self.mapper.to_values(entity)
+        del values["id"]
+        values.pop("created_at", None)
+        if "updated_at" in values:
+            values["updated_at"] = utcnow()
+        if not await self._update(self.model_class.id == entity.id, **values):
+            return None
+        if "updated_at" in values:
+            entity.updated_at = values["updated_at"]
+        return entity
 
 class ChatRepository(BaseRepository[ChatEntity, Chat], IChatRepository):
     """聊天仓储实现"""
@@ -74,64 +132,46 @@ class ChatRepository(BaseRepository[ChatEntity, Chat], IChatRepository):
     
     async def create_chat(self, chat: ChatEntity) -> ChatEntity:
         """创建聊天"""
-        model = self._to_model(chat)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
+        return await self._insert(chat)
     
     async def get_chat(self, chat_id: int) -> Optional[ChatEntity]:
         """根据ID获取聊天"""
-        stmt = select(Chat).where(Chat.id == chat_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        return self._to_entity(model)
+        stmt = self._select().where(Chat.id == chat_id)
+        return await self._fetch_one(stmt)
     
     async def get_chat_by_chat_id(self, chat_id: str) -> Optional[ChatEntity]:
         """根据chat_id获取聊天"""
-        stmt = select(Chat).where(Chat.chat_id == chat_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        return self._to_entity(model)
+        stmt = self._select().where(Chat.chat_id == chat_id)
+        return await self._fetch_one(stmt)
+    
+    async def get_chats_by_chat_ids(self, chat_ids: List[str]) -> List[ChatEntity]:
+        """根据多个chat_id获取聊天(单条IN查询)"""
+        if not chat_ids:
+            return []
+        stmt = self._select().where(Chat.chat_id.in_(chat_ids))
+        return await self._fetch_all(stmt)
     
     async def get_chats_by_user(self, user_id: int, skip: int = 0, limit: int = 100) -> List[ChatEntity]:
         """获取用户的所有聊天"""
-        stmt = select(Chat).where(
+        stmt = self._select().where(
             and_(Chat.user_id == user_id, Chat.is_deleted == False)
         ).offset(skip).limit(limit)
-        result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models]
+        return await self._fetch_all(stmt)
     
-    async def update_chat(self, chat: ChatEntity) -> ChatEntity:
-        """更新聊天"""
-        stmt = select(Chat).where(Chat.id == chat.id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        
-        if model:
-            for key, value in chat.__dict__.items():
-                if hasattr(model, key) and key != 'id':
-                    setattr(model, key, value)
-            
-            await self.session.flush()
-            await self.session.refresh(model)
-            return self._to_entity(model)
-        
-        return None
+    async def update_chat(self, chat: ChatEntity) -> Optional[ChatEntity]:
+        """更新聊天(单条UPDATE)"""
+        return await self._update_entity(chat)
     
     async def delete_chat(self, chat_id: int) -> bool:
-        """删除聊天(软删除)"""
-        stmt = select(Chat).where(Chat.id == chat_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        
-        if model:
-            model.is_deleted = True
-            await self.session.flush()
-            return True
-        
-        return False
+        """删除聊天(软删除，单条UPDATE)"""
+        return await self._update(Chat.id == chat_id, is_deleted=True) > 0
+    
+    async def delete_chats_by_user(self, user_id: int) -> int:
+        """软删除用户的所有聊天，返回删除的聊天数"""
+        return await self._update(
+            Chat.user_id == user_id, Chat.is_deleted == False,
+            is_deleted=True
+        )
 
 class ChatDataRepository(BaseRepository[ChatDataEntity, ChatData], IChatDataRepository):
     """聊天数据仓储实现"""
@@ -141,20 +181,100 @@ class ChatDataRepository(BaseRepository[ChatDataEntity, ChatData], IChatDataRepo
     
     async def create_chat_data(self, chat_data: ChatDataEntity) -> ChatDataEntity:
         """创建聊天数据"""
-        model = self._to_model(chat_data)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
-    
-    async def get_chat_data(self, chat_id: int, skip: int = 0, limit: int = 100) -> List[ChatDataEntity]:
-        """获取聊天数据"""
-        stmt = select(ChatData).where(
-            ChatData.chat_id == chat_id
-        ).order_by(ChatData.created_at).offset(skip).limit(limit)
+        return await self._insert(chat_data)
+    
+    async def create_many(
+        self,
+        chat_data_list: List[ChatDataEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatDataEntity]:
+        """批量创建聊天数据(按批次多行INSERT，不回填ID)"""
+        return await self._insert_many(chat_data_list, batch_size)
+    
+    async def get_chat_data(
+        self,
+        chat_id: int,
+        limit: int = 100,
+        before: Optional[int] = None,
+        after: Optional[int] = None
+    ) -> List[ChatDataEntity]:
+        """
+        按消息ID游标分页获取聊天数据，走 (chat_id, id) 索引，任意深度的页耗时相同
+        
+        Args:
+            chat_id: 聊天ID
+            limit: 每页条数
+            before: 只返回ID小于该值的消息(向前翻页)
+            after: 只返回ID大于该值的消息(向后翻页)
+            
+        Returns:
+            按ID升序排列的聊天数据；未指定游标时为最新的一页
+        """
+        stmt = self._select().where(ChatData.chat_id == chat_id)
+        if after is not None:
+            stmt = stmt.where(ChatData.id > after)
+        if before is not None:
+            stmt = stmt.where(ChatData.id < before)
+        
+        if after is not None:
+            return await self._fetch_all(stmt.order_by(ChatData.id).limit(limit))
+        # 从新到旧取一页再翻转，保证返回结果按时间顺序排列
+        page = await self._fetch_all(stmt.order_by(ChatData.id.desc()).limit(limit))
+        page.reverse()
+        return page
+    
+    async def get_turn_data(self, chat_id: int, turn_id: str) -> List[ChatDataEntity]:
+        """获取一轮对话产生的聊天数据"""
+        stmt = self._select().where(
+            and_(
+                ChatData.chat_id == chat_id,
+                ChatData.extra["turn_id"].as_string() == turn_id
+            )
+        ).order_by(ChatData.created_at, ChatData.id)
+        return await self._fetch_all(stmt)
+    
+    async def delete_turn_data(self, chat_id: int, turn_id: str, replies_only: bool = False) -> int:
+        """删除一轮对话产生的聊天数据(单条DELETE)，replies_only 时保留用户消息，返回删除的行数"""
+        stmt = delete(ChatData).where(
+            ChatData.chat_id == chat_id,
+            ChatData.extra["turn_id"].as_string() == turn_id
+        )
+        if replies_only:
+            stmt = stmt.where(ChatData.role != Role.USER)
         result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models]
+        return result.rowcount
+
+class ChatSummaryRepository(BaseRepository[ChatSummaryEntity, ChatSummary], IChatSummaryRepository):
+    """聊天摘要仓储实现"""
+    
+    def __init__(self, session: AsyncSession):
+        super().__init__(session, ChatSummaryEntity, ChatSummary)
+    
+    async def get_summary(self, chat_id: int) -> Optional[ChatSummaryEntity]:
+        """获取聊天摘要"""
+        stmt = self._select().where(ChatSummary.chat_id == chat_id)
+        return await self._fetch_one(stmt)
+    
+    async def save_summary(self, summary: ChatSummaryEntity) -> ChatSummaryEntity:
+        """
+        保存聊天摘要(不存在则创建)，先按聊天UPDATE，没有匹配的行时INSERT；更新时不回填ID
+        
+        另一个进程在两条语句之间抢先INSERT时唯一约束冲突，改为再UPDATE一次。
+        冲突后的重试要求语句在独立事务中执行(AutocommitSession)。
+        """
+        summary.updated_at = utcnow()
+        values = dict(
+            content=summary.content,
+            last_message_id=summary.last_message_id,
+            updated_at=summary.updated_at
+        )
+        if await self._update(ChatSummary.chat_id == summary.chat_id, **values):
+            return summary
+        try:
+            return await self._insert(summary)
+        except IntegrityError:
+            await self._update(ChatSummary.chat_id == summary.chat_id, **values)
+            return summary
 
 class ChatToolRepository(BaseRepository[ChatToolEntity, ChatTool], IChatToolRepository):
     """聊天工具仓储实现"""
@@ -164,18 +284,20 @@ class ChatToolRepository(BaseRepository[ChatToolEntity, ChatTool], IChatToolRepo
     
     async def create_chat_tool(self, chat_tool: ChatToolEntity) -> ChatToolEntity:
         """创建聊天工具"""
-        model = self._to_model(chat_tool)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
+        return await self._insert(chat_tool)
+    
+    async def create_many(
+        self,
+        chat_tools: List[ChatToolEntity],
+        batch_size: Optional[int] = None
+    ) -> List[ChatToolEntity]:
+        """批量创建聊天工具(按批次多行INSERT，不回填ID)"""
+        return await self._insert_many(chat_tools, batch_size)
     
     async def get_chat_tools(self, chat_id: int) -> List[ChatToolEntity]:
         """获取聊天工具"""
-        stmt = select(ChatTool).where(ChatTool.chat_id == chat_id)
-        result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models]
+        stmt = self._select().where(ChatTool.chat_id == chat_id)
+        return await self._fetch_all(stmt)
 
 class SourceRepository(BaseRepository[SourceEntity, Source], ISourceRepository):
     """源仓储实现"""
@@ -185,55 +307,27 @@ class SourceRepository(BaseRepository[SourceEntity, Source], ISourceRepository):
     
     async def create_source(self, source: SourceEntity) -> SourceEntity:
         """创建源"""
-        model = self._to_model(source)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
+        return await self._insert(source)
     
     async def get_source(self, source_id: int) -> Optional[SourceEntity]:
         """获取源"""
-        stmt = select(Source).where(Source.id == source_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        return self._to_entity(model)
+        stmt = self._select().where(Source.id == source_id)
+        return await self._fetch_one(stmt)
     
     async def get_sources(self, skip: int = 0, limit: int = 100) -> List[SourceEntity]:
         """获取所有源"""
-        stmt = select(Source).offset(skip).limit(limit)
-        result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models]
+        stmt = self._select().offset(skip).limit(limit)
+        return await self._fetch_all(stmt)
     
-    async def update_source(self, source: SourceEntity) -> SourceEntity:
-        """更新源"""
-        stmt = select(Source).where(Source.id == source.id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        
-        if model:
-            for key, value in source.__dict__.items():
-                if hasattr(model, key) and key != 'id':
-                    setattr(model, key, value)
-            
-            await self.session.flush()
-            await self.session.refresh(model)
-            return self._to_entity(model)
-        
-        return None
+    async def update_source(self, source: SourceEntity) -> Optional[SourceEntity]:
+        """更新源(单条UPDATE)"""
+        return await self._update_entity(source)
     
     async def delete_source(self, source_id: int) -> bool:
-        """删除源"""
-        stmt = select(Source).where(Source.id == source_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        
-        if model:
-            await self.session.delete(model)
-            await self.session.flush()
-            return True
-        
-        return False
+        """删除源(单条DELETE，提示词、工具和聊天由外键 ON DELETE CASCADE 级联删除)"""
+        stmt = delete(Source).where(Source.id == source_id)
+        result = await self.session.execute(stmt, execution_options={"synchronize_session": False})
+        return result.rowcount > 0
 
 class PromptRepository(BaseRepository[PromptEntity, Prompt], IPromptRepository):
     """提示词仓储实现"""
@@ -243,27 +337,27 @@ class PromptRepository(BaseRepository[PromptEntity, Prompt], IPromptRepository):
     
     async def create_prompt(self, prompt: PromptEntity) -> PromptEntity:
         """创建提示词"""
-        model = self._to_model(prompt)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
+        return await self._insert(prompt)
+    
+    async def create_many(
+        self,
+        prompts: List[PromptEntity],
+        batch_size: Optional[int] = None
+    ) -> List[PromptEntity]:
+        """批量创建提示词(按批次多行INSERT，不回填ID)"""
+        return await self._insert_many(prompts, batch_size)
     
     async def get_prompt(self, prompt_id: int) -> Optional[PromptEntity]:
         """获取提示词"""
-        stmt = select(Prompt).where(Prompt.id == prompt_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        return self._to_entity(model)
+        stmt = self._select().where(Prompt.id == prompt_id)
+        return await self._fetch_one(stmt)
     
     async def get_prompts_by_source(self, source_id: int, skip: int = 0, limit: int = 100) -> List[PromptEntity]:
         """获取源的所有提示词"""
-        stmt = select(Prompt).where(
+        stmt = self._select().where(
             Prompt.source_id == source_id
         ).offset(skip).limit(limit)
-        result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models]
+        return await self._fetch_all(stmt)
 
 class ToolRepository(BaseRepository[ChatToolConfig, Tool], IToolRepository):
     """工具仓储实现"""
@@ -273,24 +367,16 @@ class ToolRepository(BaseRepository[ChatToolConfig, Tool], IToolRepository):
     
     async def create_tool(self, tool: ChatToolConfig) -> ChatToolConfig:
         """创建工具"""
-        model = self._to_model(tool)
-        self.session.add(model)
-        await self.session.flush()
-        await self.session.refresh(model)
-        return self._to_entity(model)
+        return await self._insert(tool)
     
     async def get_tool(self, tool_id: int) -> Optional[ChatToolConfig]:
         """获取工具"""
-        stmt = select(Tool).where(Tool.id == tool_id)
-        result = await self.session.execute(stmt)
-        model = result.scalar_one_or_none()
-        return self._to_entity(model)
+        stmt = self._select().where(Tool.id == tool_id)
+        return await self._fetch_one(stmt)
     
     async def get_tools_by_source(self, source_id: int, skip: int = 0, limit: int = 100) -> List[ChatToolConfig]:
         """获取源的所有工具"""
-        stmt = select(Tool).where(
+        stmt = self._select().where(
             Tool.source_id == source_id
         ).offset(skip).limit(limit)
-        result = await self.session.execute(stmt)
-        models = result.scalars().all()
-        return [self._to_entity(model) for model in models] 
\ No newline at end of file
+        return await self._fetch_all(stmt) 
\ No newline at end of file
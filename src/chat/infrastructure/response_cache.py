@@ -0,0 +1,269 @@
+"""
+LLM响应缓存。
+同一个源下的很多对话使用相同的系统提示词和工具，提出几乎相同的问题，
+这里在LLM调用前增加两级缓存：
+- 精确缓存：按规范化后的消息、工具和模型计算指纹
+- 语义缓存：上下文相同时，按最后一条用户消息的向量相似度复用回复
+
+上下文还没有带向量的条目时不在请求前计算向量，回复写入缓存后再在后台计算，
+首次出现的上下文不增加向量服务的延迟。
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from rag.infra.embedding import EmbeddingService
+from ..domain.services.fingerprint import request_fingerprint
+from ..domain.services.interfaces import IResponseCache
+from .streams import aclose_stream
+
+logger = logging.getLogger(__name__)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class _CacheEntry:
+    value: Any                   # 非流式为完整响应，流式为响应块列表
+    stream: bool
+    context_key: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ResponseCache(IResponseCache):
+    """LLM响应缓存，按源启用，带 TTL 和 LRU 淘汰"""
+
+    def __init__(
+        self,
+        sources: Iterable[int] = (),
+        ttl: float = 3600.0,
+        max_entries: int = 1000,
+        semantic_threshold: Optional[float] = 0.95,
+        idempotent_tools: Iterable[str] = (),
+        embedding_service: Optional[EmbeddingService] = None
+    ):
+        self.sources: Set[int] = set(sources)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self.idempotent_tools: FrozenSet[str] = frozenset(idempotent_tools)
+        self._embedding_service = embedding_service
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        # 语义缓存按上下文分桶，只在上下文相同的条目中比较相似度
+        self._buckets: Dict[str, Set[str]] = {}
+        self._embed_tasks: Set[asyncio.Task] = set()
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "skipped": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def embedding_service(self) -> EmbeddingService:
+        if self._embedding_service is None:
+            self._embedding_service = EmbeddingService()
+        return self._embedding_service
+
+    def enabled_for(self, source_id: Optional[int]) -> bool:
+        """源是否启用了响应缓存"""
+        return source_id is not None and source_id in self.sources
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等指标"""
+        lookups = self._stats["exact_hits"] + self._stats["semantic_hits"] + self._stats["misses"]
+        hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+        return {
+            **self._stats,
+            "size": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    async def fetch(
+        self,
+        model: str,
+        messages: List[Any],
+        loader: Callable[[], Awaitable[Any]],
+        tools_etag: Optional[str] = None,
+        stream: bool = False,
+        idempotent_tools: Iterable[str] = (),
+        params: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """
+        读取缓存，未命中时调用 loader 并在回复可缓存时写入
+
+        Args:
+            model: 模型名称
+            messages: 消息列表
+            loader: 实际调用LLM的协程函数
+            tools_etag: 工具目录的 etag
+            stream: 是否流式请求
+            idempotent_tools: 标记为幂等的工具名称
+            params: 其余影响回复的请求参数(max_tokens 等采样参数)，参数不同的请求不共享缓存
+
+        Returns:
+            LLM响应，流式时为响应块异步迭代器
+        """
+        idempotent = self.idempotent_tools | frozenset(idempotent_tools)
+        if not self._is_cacheable_request(messages, idempotent):
+            self._stats["skipped"] += 1
+            return await loader()
+
+        key = request_fingerprint(model, messages, tools_etag, stream, params)
+        entry = self._get(key)
+        if entry:
+            self._stats["exact_hits"] += 1
+            return self._replay(entry)
+
+        # 语义缓存只比较最后一条用户消息，上下文(其余消息)必须完全相同
+        context_key = embedding = None
+        question = self._last_user_message(messages)
+        if self.semantic_threshold is not None and question:
+            context_key = request_fingerprint(model, messages[:-1], tools_etag, stream, params)
+        if context_key and self._buckets.get(context_key):
+            try:
+                embedding = await self.embedding_service.get_embedding(question)
+            except Exception as e:
+                logger.warning(f"响应缓存获取向量失败: {str(e)}")
+            if embedding:
+                entry = self._search(context_key, embedding)
+                if entry:
+                    self._stats["semantic_hits"] += 1
+                    return self._replay(entry)
+
+        self._stats["misses"] += 1
+        response = await loader()
+
+        def store(value: Any, tool_names: Set[str]) -> None:
+            if not tool_names <= idempotent:
+                # 调用了非幂等工具的回复不能复用
+                self._stats["skipped"] += 1
+                return
+            entry = _CacheEntry(value, stream, context_key, embedding)
+            self._put(key, entry)
+            if context_key and not embedding:
+                self._embed_later(key, entry, question)
+
+        if stream:
+            return self._record(response, store)
+        store(response, self._tool_names(response.choices[0].message.tool_calls))
+        return response
+
+    @staticmethod
+    def _is_cacheable_request(messages: List[Any], idempotent: FrozenSet[str]) -> bool:
+        """请求中包含非幂等工具的结果时不使用缓存"""
+        for message in messages:
+            role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+            if role == "tool":
+                name = message.get("name") if isinstance(message, dict) else getattr(message, "name", None)
+                if name not in idempotent:
+                    return False
+        return True
+
+    @staticmethod
+    def _last_user_message(messages: List[Any]) -> Optional[str]:
+        if not messages or not isinstance(messages[-1], dict):
+            return None
+        if messages[-1].get("role") != "user":
+            return None
+        return (messages[-1].get("content") or "").strip() or None
+
+    @staticmethod
+    def _tool_names(tool_calls: Optional[List[Any]]) -> Set[str]:
+        return {call.function.name for call in tool_calls or []}
+
+    async def _record(self, response: Any, store: Callable[[Any, Set[str]], None]) -> AsyncGenerator[Any, None]:
+        """转发流式响应，完整读完后写入缓存"""
+        chunks = []
+        tool_names = set()
+        try:
+            async for chunk in response:
+                chunks.append(chunk)
+                if chunk.choices:
+                    for call in getattr(chunk.choices[0].delta, "tool_calls", None) or []:
+                        if call.function and call.function.name:
+                            tool_names.add(call.function.name)
+                yield chunk
+        finally:
+            # 读者中途离开时关闭上游，不完整的回复不写入缓存
+            await aclose_stream(response)
+        store(chunks, tool_names)
+
+    def _embed_later(self, key: str, entry: _CacheEntry, question: str) -> None:
+        """在后台计算已缓存条目的向量，完成后加入语义缓存"""
+        async def embed() -> None:
+            try:
+                embedding = await self.embedding_service.get_embedding(question)
+            except Exception as e:
+                logger.warning(f"响应缓存获取向量失败: {str(e)}")
+                return
+            # 计算期间条目可能已过期或被淘汰
+            if embedding and self._entries.get(key) is entry:
+                entry.embedding = embedding
+                self._buckets.setdefault(entry.context_key, set()).add(key)
+
+        task = asyncio.create_task(embed())
+        self._embed_tasks.add(task)
+        task.add_done_callback(self._embed_tasks.discard)
+
+    def _replay(self, entry: _CacheEntry) -> Any:
+        if not entry.stream:
+            return entry.value
+
+        async def replay():
+            for chunk in entry.value:
+                yield chunk
+
+        return replay()
+
+    def _get(self, key: str) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _search(self, context_key: str, embedding: List[float]) -> Optional[_CacheEntry]:
+        best_key, best_score = None, self.semantic_threshold
+        for key in list(self._buckets.get(context_key, ())):
+            entry = self._get(key)
+            if entry is None or entry.embedding is None:
+                continue
+            score = _cosine(embedding, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return self._entries.get(best_key) if best_key else None
+
+    def _put(self, key: str, entry: _CacheEntry) -> None:
+        self._remove(key)
+        self._entries[key] = entry
+        if entry.context_key and entry.embedding:
+            self._buckets.setdefault(entry.context_key, set()).add(key)
+        self._stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry and entry.context_key:
+            bucket = self._buckets.get(entry.context_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[entry.context_key]
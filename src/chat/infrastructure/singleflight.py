@@ -0,0 +1,136 @@
+"""
+相同LLM请求的合并。
+热门源发布提示词后，会在短时间内收到大量完全相同的首轮请求，
+这里让指纹相同且同时进行的请求共享一次上游调用，流式响应分发给每个订阅者。
+"""
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+from ..domain.services.interfaces import IRequestCoalescer
+from .streams import aclose_stream
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次进行中的上游调用"""
+
+    def __init__(self, key: str, stream: bool):
+        self.key = key
+        self.stream = stream
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self.chunks: List[Any] = []  # 已收到的响应块，后加入的订阅者从头回放
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+    def notify(self) -> None:
+        """唤醒等待新响应块的订阅者"""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight(IRequestCoalescer):
+    """合并同时进行的相同请求，最后一个订阅者离开时取消上游调用"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "cancelled": 0}
+
+    async def call(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        stream: bool = False
+    ) -> Any:
+        """
+        执行请求，相同指纹的请求正在进行时直接订阅它的结果
+
+        Args:
+            key: 请求指纹
+            loader: 实际发起请求的协程函数
+            stream: 是否流式请求，流式时 loader 返回响应块异步迭代器
+
+        Returns:
+            响应，流式时为响应块异步迭代器
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.stream != stream:
+            flight = self._start(key, loader, stream)
+        else:
+            self._stats["coalesced"] += 1
+        flight.subscribers += 1
+
+        if stream:
+            return self._subscribe(flight)
+
+        try:
+            # 单个订阅者被取消不影响共享的上游调用
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    def _start(self, key: str, loader: Callable[[], Awaitable[Any]], stream: bool) -> _Flight:
+        self._stats["calls"] += 1
+        flight = self._flights[key] = _Flight(key, stream)
+        if stream:
+            flight.task = asyncio.create_task(self._pump(flight, loader))
+        else:
+            flight.task = asyncio.create_task(loader())
+            flight.task.add_done_callback(lambda _: self._finish(flight))
+        return flight
+
+    async def _pump(self, flight: _Flight, loader: Callable[[], Awaitable[Any]]) -> None:
+        """读取上游的流式响应并分发给订阅者"""
+        response = None
+        try:
+            response = await loader()
+            async for chunk in response:
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(flight)
+            flight.notify()
+            await aclose_stream(response)
+
+    async def _subscribe(self, flight: _Flight) -> AsyncGenerator[Any, None]:
+        """订阅流式响应，先回放已收到的响应块"""
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                    continue
+                if flight.done:
+                    if flight.error:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            self._leave(flight)
+
+    def _leave(self, flight: _Flight) -> None:
+        """订阅者离开，没有订阅者时取消上游调用"""
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.done and not flight.task.done():
+            logger.info(f"请求的所有订阅者已离开，取消上游调用: {flight.key[:12]}")
+            self._stats["cancelled"] += 1
+            self._finish(flight)
+            flight.task.cancel()
+
+    def _finish(self, flight: _Flight) -> None:
+        flight.done = True
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self) -> Dict[str, Any]:
+        """合并请求的指标"""
+        return {**self._stats, "in_flight": len(self._flights)}
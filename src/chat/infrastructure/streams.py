@@ -0,0 +1,34 @@
+"""
+LLM流式响应的辅助函数。
+"""
+import inspect
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+async def aclose_stream(response: Any) -> None:
+    """
+    关闭流式响应，释放上游的HTTP连接
+
+    异步生成器直接调用 aclose；litellm 的 CustomStreamWrapper 没有 aclose，
+    关闭它包装的底层流(completion_stream，例如 openai 的 AsyncStream)。
+
+    Args:
+        response: 流式响应，为空时忽略
+    """
+    if response is None:
+        return
+    close = getattr(response, "aclose", None)
+    if close is None:
+        inner = getattr(response, "completion_stream", None)
+        close = getattr(inner, "aclose", None) or getattr(inner, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.warning(f"关闭流式响应失败: {str(e)}")
@@ -0,0 +1,85 @@
+"""
+MCP工具目录缓存。
+工具集合只会在 init_mcp 重建服务时变化，按MCP服务地址缓存转换好的工具列表，
+避免每轮对话都请求 list_tools 并重新构造函数描述。
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from ..domain.models.tool_catalog import ToolCatalog
+from ..domain.services.interfaces import IToolCatalogCache
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCatalogCache(IToolCatalogCache):
+    """工具目录缓存，按MCP服务地址区分，支持 TTL 和版本失效"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._catalogs: Dict[str, ToolCatalog] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _is_fresh(self, catalog: ToolCatalog, version: Optional[int]) -> bool:
+        if version is not None and catalog.version != version:
+            return False
+        return time.monotonic() - catalog.loaded_at < self.ttl
+
+    async def get(
+        self,
+        url: str,
+        loader: Callable[[], Awaitable[ToolCatalog]],
+        version: Optional[int] = None
+    ) -> ToolCatalog:
+        """
+        获取工具目录，过期或版本变化时重新加载
+
+        Args:
+            url: MCP服务地址
+            loader: 加载工具目录的协程函数
+            version: 工具注册表的当前版本，与缓存不一致时失效
+
+        Returns:
+            工具目录
+        """
+        catalog = self._catalogs.get(url)
+        if catalog and self._is_fresh(catalog, version):
+            return catalog
+
+        # 同一服务只有一个协程去加载，其余等待结果
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            catalog = self._catalogs.get(url)
+            if catalog and self._is_fresh(catalog, version):
+                return catalog
+
+            catalog = await loader()
+            catalog.version = version
+            self._catalogs[url] = catalog
+            logger.info(f"工具目录已更新: {url}, etag={catalog.etag}, 共 {len(catalog.tools)} 个工具")
+            return catalog
+
+    def invalidate(self, url: Optional[str] = None) -> None:
+        """
+        使缓存失效
+
+        Args:
+            url: MCP服务地址，为空时清空全部
+        """
+        if url is None:
+            self._catalogs.clear()
+        else:
+            self._catalogs.pop(url, None)
+
+
+def current_server_version() -> Optional[int]:
+    """进程内 FastMCP 服务的版本，每次 init_fastmcp_app 重建时递增"""
+    from mcp_server import get_fastmcp_server_version
+
+    return get_fastmcp_server_version()
+
+
+# 进程内共享的工具目录缓存
+tool_catalog_cache = ToolCatalogCache()
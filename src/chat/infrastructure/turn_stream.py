@@ -0,0 +1,200 @@
+"""
+可续传的对话流。
+每轮对话的输出事件带有递增序号，并在内存中保留最近的事件(环形缓冲区)，
+客户端断线重连时按 Last-Event-ID 从断点继续接收，生成过程不受连接影响。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 事件类型
+EVENT_MESSAGE = "message"  # 对话输出
+EVENT_RESET = "reset"      # 断点已移出缓冲区，data 为截至当前的完整内容快照
+EVENT_REPLAY = "replay"    # 对话已结束且不在内存中，data 为数据库中保存的完整消息
+EVENT_ERROR = "error"
+EVENT_DONE = "done"
+
+
+class TurnStream:
+    """一轮对话的事件流"""
+
+    def __init__(self, chat_id: str, max_events: int = 1024, turn_id: Optional[str] = None):
+        self.turn_id = turn_id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.seq = 0
+        self.done = False
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self._events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=max_events)
+        # 已输出内容的合并结果，断点过旧时作为快照发送
+        self._merged: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+
+    def event_id(self, seq: int) -> str:
+        """SSE 事件ID，包含对话轮ID，重连时仅凭 Last-Event-ID 即可定位"""
+        return f"{self.turn_id}:{seq}"
+
+    def publish(self, event: Dict[str, Any]) -> int:
+        """
+        发布一个事件
+
+        Args:
+            event: 对话输出
+
+        Returns:
+            事件序号
+        """
+        self.seq += 1
+        self._events.append((self.seq, event))
+        self._merge(event)
+        self._notify()
+        return self.seq
+
+    def close(self, error: Optional[str] = None) -> None:
+        """结束事件流"""
+        self.done = True
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _merge(self, event: Dict[str, Any]) -> None:
+        """把增量合并到快照中，同一类型的连续增量拼接为一条"""
+        last = self._merged[-1] if self._merged else None
+        if (
+            event.get("delta")
+            and last is not None
+            and last["content_type"] == event["content_type"]
+            and (last.get("extra") or {}).get("index") == (event.get("extra") or {}).get("index")
+        ):
+            last["content"] += event["content"]
+            return
+        self._merged.append({**event, "delta": False})
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[Tuple[str, int, Any], None]:
+        """
+        从指定序号之后开始订阅
+
+        Args:
+            after: 客户端已收到的最后一个事件序号
+
+        Yields:
+            (事件类型, 序号, 数据)
+        """
+        self.subscribers += 1
+        try:
+            while True:
+                oldest = self._events[0][0] if self._events else self.seq + 1
+                if after + 1 < oldest and after < self.seq:
+                    # 断点之后的部分事件已被覆盖，先发送截至当前的完整快照
+                    after = self.seq
+                    yield EVENT_RESET, after, [dict(item) for item in self._merged]
+                    continue
+
+                for seq, event in list(self._events):
+                    if seq > after:
+                        after = seq
+                        yield EVENT_MESSAGE, seq, event
+
+                if self.done and after >= self.seq:
+                    if self.error:
+                        yield EVENT_ERROR, self.seq, {"err_msg": self.error}
+                    yield EVENT_DONE, self.seq, None
+                    return
+                if after >= self.seq:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+
+    @property
+    def started(self) -> bool:
+        """是否已开始输出或已结束"""
+        return self.done or self.seq > 0
+
+
+class TurnStreamRegistry:
+    """
+    进程内的对话流注册表，结束的对话流保留一段时间供重连
+
+    为排队中的任务提前创建的对话流可能迟迟不开始(任务在其他进程执行或一直未被领取)，
+    没有订阅者且超过保留时间仍未开始的对话流同样移除，工作协程开始执行时会重新创建。
+    """
+
+    def __init__(self, max_events: int = 1024, retention: float = 300.0):
+        self.max_events = max_events
+        self.retention = retention
+        self._streams: Dict[str, TurnStream] = {}
+
+    def create(self, chat_id: str, turn_id: Optional[str] = None) -> TurnStream:
+        """
+        创建对话流
+
+        Args:
+            chat_id: 聊天ID
+            turn_id: 对话轮ID，为空时自动生成；已存在同ID的对话流时直接返回
+
+        Returns:
+            对话流
+        """
+        self._expire()
+        if turn_id and turn_id in self._streams:
+            return self._streams[turn_id]
+        stream = TurnStream(chat_id, self.max_events, turn_id)
+        self._streams[stream.turn_id] = stream
+        return stream
+
+    def get(self, turn_id: str) -> Optional[TurnStream]:
+        """获取仍在内存中的对话流"""
+        self._expire()
+        return self._streams.get(turn_id)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [
+            turn_id for turn_id, stream in self._streams.items()
+            if self._expired(stream, now)
+        ]
+        for turn_id in expired:
+            stream = self._streams.pop(turn_id)
+            if not stream.done:
+                # 刚取得该对话流、还未开始订阅的客户端收到错误后重新订阅
+                stream.close("对话尚未开始，请重新订阅")
+
+    def _expired(self, stream: TurnStream, now: float) -> bool:
+        if stream.finished_at is not None:
+            return now - stream.finished_at > self.retention
+        return not stream.started and not stream.subscribers and now - stream.created_at > self.retention
+
+    def stats(self) -> Dict[str, Any]:
+        """对话流数量"""
+        running = sum(1 for stream in self._streams.values() if not stream.done)
+        return {"running": running, "retained": len(self._streams) - running}
+
+
+def parse_event_id(event_id: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+    解析 Last-Event-ID
+
+    Args:
+        event_id: 形如 "<turn_id>:<seq>" 的事件ID
+
+    Returns:
+        (对话轮ID, 序号)，无法解析时为 (None, 0)
+    """
+    if not event_id or ":" not in event_id:
+        return None, 0
+    turn_id, _, seq = event_id.rpartition(":")
+    try:
+        return turn_id, int(seq)
+    except ValueError:
+        return turn_id, 0
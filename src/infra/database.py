@@ -3,7 +3,7 @@
 提供统一的数据库连接和会话管理功能。
 """
 import logging
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable, List
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
     async_sessionmaker,
@@ -11,7 +11,7 @@ from sqlalchemy.ext.asyncio import (
     AsyncEngine
 )
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, inspect, text
 from contextlib import asynccontextmanager
 
 from config.settings import settings
@@ -73,6 +73,7 @@ class UnitOfWork:
     
     def __init__(self):
         self.session = None
+        self._rollback_callbacks: List[Callable[[], None]] = []
     
     async def __aenter__(self):
         """进入异步上下文，创建会话"""
@@ -81,25 +82,105 @@ class UnitOfWork:
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """离开异步上下文，提交或回滚事务，关闭会话"""
-        if exc_type is not None:
-            await self.rollback()
-        await self.session.close()
+        try:
+            if exc_type is not None:
+                await self.rollback()
+        finally:
+            # 未提交的修改在关闭会话时丢弃，与回滚相同
+            self._run_rollback_callbacks()
+            await self.session.close()
     
     async def commit(self):
         """提交事务"""
         await self.session.commit()
+        self._rollback_callbacks.clear()
     
     async def rollback(self):
         """回滚事务"""
-        await self.session.rollback()
+        try:
+            await self.session.rollback()
+        finally:
+            self._run_rollback_callbacks()
+    
+    def on_rollback(self, callback: Callable[[], None]) -> None:
+        """
+        注册事务未提交时执行的回调，用于撤销已写入进程内缓存的修改
+
+        Args:
+            callback: 事务回滚或未提交就结束时调用，提交成功后丢弃
+        """
+        self._rollback_callbacks.append(callback)
+    
+    def _run_rollback_callbacks(self) -> None:
+        callbacks, self._rollback_callbacks = self._rollback_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"回滚回调执行失败: {str(e)}")
+
+class AutocommitSession:
+    """
+    每条语句在独立的短事务中执行并立即提交的会话
+
+    用于需要长时间等待上游(LLM、工具调用)的流程: 连接只在语句执行期间从连接池借出，
+    等待期间不占用连接。只提供 execute，需要在一个事务中执行多条语句时使用 UnitOfWork。
+    """
+
+    def __init__(self, session_factory: async_sessionmaker = None):
+        self.session_factory = session_factory or async_session_factory
+
+    async def execute(self, statement, params=None, **kwargs):
+        """执行一条语句并提交，结果行已缓冲，连接归还后仍可读取"""
+        async with self.session_factory() as session:
+            result = await session.execute(statement, params, **kwargs)
+            await session.commit()
+            return result
 
 async def init_db() -> None:
     """初始化数据库"""
     logger.info("创建数据库表...")
     async with engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
+        # create_all 不会为已存在的表补建索引，这里逐个检查
+        await conn.run_sync(create_missing_indexes)
+        # create_all 也不会修改已存在的列
+        await conn.run_sync(upgrade_datetime_precision)
     logger.info("数据库表创建完成!")
 
+def create_missing_indexes(conn) -> None:
+    """为已存在的表创建模型中新增的索引"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def upgrade_datetime_precision(conn) -> None:
+    """
+    把已存在表中小数秒精度低于模型定义的 MySQL DATETIME 列改为模型中的精度
+
+    例如 chat_data.created_at 改为 DATETIME(6) 之前建的表，修改前保存的时间没有小数秒，
+    修改后写入的时间才保留微秒。其他数据库不区分精度，直接跳过。
+    """
+    if conn.dialect.name != "mysql":
+        return
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            expected = column.type.dialect_impl(conn.dialect)
+            fsp = getattr(expected, "fsp", None)
+            if not fsp or column.name not in existing or (getattr(existing[column.name], "fsp", None) or 0) >= fsp:
+                continue
+            type_sql = conn.dialect.type_compiler_instance.process(expected)
+            logger.info(f"修改列精度: {table.name}.{column.name} -> {type_sql}")
+            conn.execute(text(
+                f"ALTER TABLE {preparer.quote(table.name)} MODIFY {preparer.quote(column.name)} "
+                f"{type_sql} {'NULL' if column.nullable else 'NOT NULL'}"
+            ))
+
 async def close_db() -> None:
     """关闭数据库连接"""
     logger.info("关闭服务...")
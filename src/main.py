@@ -19,7 +19,7 @@ from mcp_server import init_fastmcp_app
 from rag.infra.vector_store_service import VectorStoreService
 
 # from chat.api.router import router as chat_router
-from chat.api.router import router as chat_router
+from chat.api.router import router as chat_router, chat_app_service
 from user.api.router import router as user_router
 from rag.api.routes import router as rag_router
 
@@ -42,8 +42,14 @@ async def lifespan(app: FastAPI):
         # 初始化向量存储服务
         await vector_store_service.initialize()
         
+        # 启动聊天任务的工作协程，并恢复上次中断的任务
+        await chat_app_service.start()
+        
         yield
         
+        # 关闭聊天服务共享资源(MCP会话池等)
+        await chat_app_service.shutdown()
+        
         # 关闭向量存储服务
         await vector_store_service.close()
         
@@ -3,6 +3,7 @@
 基于FastAPI和领域驱动设计的MCP服务器模块
 """
 import logging
+from typing import Optional
 
 from fastmcp import FastMCP
 from config.settings import settings
@@ -16,6 +17,22 @@ from mcp_server.domain.services.tool_factory import ToolRegistry
 
 logger = logging.getLogger(__name__)
 
+# 当前进程中挂载的 FastMCP 实例，供进程内传输直接调用
+_fastmcp_server: Optional[FastMCP] = None
+# 每次重建 FastMCP 实例时递增，工具目录缓存据此失效
+_fastmcp_server_version: int = 0
+
+
+def get_fastmcp_server() -> Optional[FastMCP]:
+    """获取当前进程中由 init_fastmcp_app 创建的 FastMCP 实例"""
+    return _fastmcp_server
+
+
+def get_fastmcp_server_version() -> int:
+    """获取当前 FastMCP 实例的版本"""
+    return _fastmcp_server_version
+
+
 async def init_mcp(mcp_svc: MCPDomainService) -> MCPEntity:
     main_mcp = await mcp_svc.create_mcp(name="Main", description="Main MCP Server")
     
@@ -38,10 +55,13 @@ async def init_mcp(mcp_svc: MCPDomainService) -> MCPEntity:
 
 
 async def init_fastmcp_app():
+    global _fastmcp_server, _fastmcp_server_version
     logger.info("初始化MCP APP")
     
     main_mcp_entity = await init_mcp(MCPDomainService(InMemoryMCPRepository()))
     main_mcp: FastMCP = await FastMCPAdapter.create_from_entity(main_mcp_entity)
+    _fastmcp_server = main_mcp
+    _fastmcp_server_version += 1
     mcp_app = main_mcp.http_app(path="/mcp")
     
     logger.info("MCP APP 初始化完成")
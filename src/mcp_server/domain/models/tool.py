@@ -20,7 +20,7 @@ class ToolEntity:
     description: str = ""
     function: AnyFunction = None
     tags: List[str] = field(default_factory=list)
-    annotations: ToolAnnotations | dict[str, Any] | None = None,
+    annotations: ToolAnnotations | dict[str, Any] | None = None
     metadata: Dict[str, Any] = field(default_factory=dict)
     created_at: datetime = field(default_factory=datetime.utcnow)
     
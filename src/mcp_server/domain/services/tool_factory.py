@@ -14,8 +14,11 @@ class ToolRegistry:
     _tools: Dict[str, Type[ToolEntity]] = {}
     
     @classmethod
-    def register(cls, name: str, description: str = "", tags: List[str] = None):
-        """工具注册装饰器"""
+    def register(cls, name: str, description: str = "", tags: List[str] = None, idempotent: bool = False):
+        """工具注册装饰器
+
+        idempotent 标记相同参数多次调用结果一致且无副作用，调用方可以缓存其结果
+        """
         logger.info(f"注册工具: {name}")
         def decorator(func: Callable):
             @wraps(func)
@@ -26,7 +29,8 @@ class ToolRegistry:
                 name=name,
                 description=description,
                 function=wrapper,
-                tags=tags or []
+                tags=tags or [],
+                annotations={"idempotentHint": True} if idempotent else None
             )
             cls._tools[name] = tool
             return wrapper
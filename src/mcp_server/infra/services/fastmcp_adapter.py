@@ -27,7 +27,8 @@ class FastMCPAdapter:
                 fn=tool_entity.function,
                 name=tool_name,
                 description=tool_entity.description,
-                tags=set(tool_entity.tags) if tool_entity.tags else set()
+                tags=set(tool_entity.tags) if tool_entity.tags else set(),
+                annotations=tool_entity.annotations
             )
         
         # 挂载子MCP
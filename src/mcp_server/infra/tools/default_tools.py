@@ -9,7 +9,8 @@ logger = logging.getLogger(__name__)
 @ToolRegistry.register(
     name="get_data_asset",
     description="读取数据资产抽样数据",
-    tags=["data_asset", "read_data"]
+    tags=["data_asset", "read_data"],
+    idempotent=True
 )
 def get_data_asset(
     asset_id: Annotated[str, Field(description="数据资产Id")],
@@ -38,7 +39,8 @@ def get_data_asset(
 @ToolRegistry.register(
     name="add",
     description="加法演示工具",
-    tags=["demo", "math"]
+    tags=["demo", "math"],
+    idempotent=True
 )
 def add(a: int, b: int) -> int:
     """加法演示工具"""
@@ -0,0 +1,6 @@
+from datetime import datetime, timezone
+
+
+def utcnow() -> datetime:
+    """当前UTC时间(不带时区)，与数据库中保存的时间一致，代替已弃用的 datetime.utcnow"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
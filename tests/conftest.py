@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 服务代码以 src 为根目录导入(与 main.py 一致)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,73 @@
+"""
+对话准入控制的测试
+
+验证排队请求在用户和源之间公平调度，以及队列已满、排队超时时快速拒绝。
+"""
+import asyncio
+
+import pytest
+
+from chat.infrastructure.admission import AdmissionController, AdmissionRejected
+
+
+async def run_turns(controller, requests):
+    """按顺序提交请求，返回被准入的顺序"""
+    order = []
+
+    async def turn(name, user_id, source_id):
+        ticket = await controller.acquire(user_id, source_id)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        ticket.release()
+
+    blocker = await controller.acquire("blocker", 0)
+    tasks = []
+    for request in requests:
+        tasks.append(asyncio.create_task(turn(*request)))
+        await asyncio.sleep(0)
+    blocker.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_noisy_user_does_not_starve_others():
+    controller = AdmissionController(max_concurrent=1)
+    requests = [(f"noisy{i}", "noisy", 1) for i in range(5)] + [("quiet", "quiet", 1)]
+
+    order = asyncio.run(run_turns(controller, requests))
+
+    assert order.index("quiet") <= 1
+
+
+def test_source_weights():
+    controller = AdmissionController(max_concurrent=1, source_weights={1: 2.0})
+    requests = [(f"a{i}", f"a{i}", 1) for i in range(4)] + [(f"b{i}", f"b{i}", 2) for i in range(4)]
+
+    order = asyncio.run(run_turns(controller, requests))
+
+    # 源 1 的权重是源 2 的两倍，前 6 个名额中约占 4 个
+    assert sum(name.startswith("a") for name in order[:6]) == 4
+
+
+def test_rejects_when_queue_is_full_or_wait_times_out():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+
+    async def run():
+        ticket = await controller.acquire(1, 1)
+        waiting = asyncio.create_task(controller.acquire(2, 1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.acquire(3, 1)
+        with pytest.raises(AdmissionRejected):
+            await waiting
+        ticket.release()
+        return full.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.retry_after >= 1
+    stats = controller.stats()
+    assert stats["rejected"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,97 @@
+"""
+批量推理执行器的测试
+
+验证并发数限制、可重试错误的重试，以及从输出文件恢复时跳过已成功的条目。
+"""
+import asyncio
+
+import ujson
+from litellm import exceptions as llm_errors
+
+from chat.infrastructure.batch import (
+    ITEM_FAILED,
+    ITEM_SUCCEEDED,
+    BatchRunner,
+    load_checkpoint,
+    parse_jsonl,
+)
+
+
+class ServiceUnavailable(Exception):
+    status_code = 503
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def test_runs_with_bounded_concurrency_and_retries():
+    running = 0
+    peak = 0
+    calls = {}
+
+    async def handler(item):
+        nonlocal running, peak
+        calls[item["id"]] = calls.get(item["id"], 0) + 1
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.01)
+            if item["content"] == "flaky" and calls[item["id"]] < 3:
+                raise ServiceUnavailable("上游不可用")
+            if item["content"] == "bad":
+                raise BadRequest("参数错误")
+            return {"content": item["content"].upper()}
+        finally:
+            running -= 1
+
+    items = parse_jsonl(
+        ['{"content": "a"}', '{"id": "f", "content": "flaky"}', '{"content": "bad"}']
+        + [ujson.dumps({"content": f"x{i}"}) for i in range(10)]
+    )
+    runner = BatchRunner(handler, concurrency=3, max_retries=3, retry_backoff=0.001)
+
+    async def run():
+        return {result["id"]: result async for result in runner.run(items)}
+
+    results = asyncio.run(run())
+
+    assert len(results) == len(items)
+    assert peak == 3
+    assert results["1"] == {"id": "1", "status": ITEM_SUCCEEDED, "attempts": 1, "content": "A"}
+    assert results["f"]["status"] == ITEM_SUCCEEDED and results["f"]["attempts"] == 3
+    # 参数错误重试也不会成功，不重试
+    assert results["3"]["status"] == ITEM_FAILED and results["3"]["attempts"] == 1
+
+
+def test_checkpoint_skips_succeeded_items(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text(
+        '{"id": "1", "status": "succeeded"}\n'
+        '{"id": "2", "status": "failed"}\n'
+        '{"id": "3", "stat',
+        encoding="utf-8"
+    )
+
+    assert load_checkpoint(str(output)) == {"1"}
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_timed_out_item_is_retried():
+    calls = 0
+
+    async def handler(item):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise llm_errors.Timeout(message="timeout", model="m", llm_provider="openai")
+        return {"content": "ok"}
+
+    runner = BatchRunner(handler, concurrency=1, max_retries=2, retry_backoff=0.001)
+
+    async def run():
+        return [result async for result in runner.run(parse_jsonl(['{"content": "a"}']))]
+
+    results = asyncio.run(run())
+
+    assert results[0]["status"] == ITEM_SUCCEEDED and results[0]["attempts"] == 2
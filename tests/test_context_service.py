@@ -0,0 +1,134 @@
+"""
+上下文组装与滚动摘要的测试
+
+验证组装上下文时只读取已保存的摘要、不调用摘要模型；
+移出窗口的消息在本轮结束后由后台任务折叠，同一聊天同时只有一个刷新任务，
+进行中的任务登记在调用方提供的字典中以便关闭时取消；
+摘要超出预留的token数时被截断。
+"""
+import asyncio
+
+from chat.domain.models.chat import ChatDataEntity, ChatEntity, ChatSummaryEntity
+from chat.domain.models.enums import Role
+from chat.domain.services.context_service import ContextDomainService
+
+
+class FakeChatService:
+    def __init__(self, summary=None):
+        self.summary = summary
+        self.saved = []
+
+    async def get_summary(self, chat_id):
+        return self.summary
+
+    async def save_summary(self, chat_id, content, last_message_id):
+        self.saved.append((chat_id, content, last_message_id))
+        self.summary = ChatSummaryEntity(chat_id=chat_id, content=content, last_message_id=last_message_id)
+        return self.summary
+
+
+def build_messages(count):
+    return [
+        ChatDataEntity(id=i + 1, chat_id=1, content=f"message {i}", role=Role.USER)
+        for i in range(count)
+    ]
+
+
+def build_service(chat_service, summarizer, **kwargs):
+    return ContextDomainService(
+        model="test-model",
+        chat_domain_service=chat_service,
+        summarizer=summarizer,
+        max_history_length=2,
+        **kwargs
+    )
+
+
+def test_build_uses_stored_summary_and_refreshes_in_background():
+    calls = []
+
+    async def summarizer(previous, messages, max_tokens):
+        calls.append((previous, [m["content"] for m in messages], max_tokens))
+        return "new summary"
+
+    chat_service = FakeChatService(ChatSummaryEntity(chat_id=1, content="old summary", last_message_id=1))
+    service = build_service(chat_service, summarizer)
+    chat = ChatEntity(id=1, system_prompt="system")
+
+    async def run():
+        context = await service.build(chat, build_messages(5))
+        assert calls == []
+        await service.refresh_summary()
+        return context
+
+    context = asyncio.run(run())
+
+    assert "old summary" in context[1]["content"]
+    assert [m["content"] for m in context[2:]] == ["message 3", "message 4"]
+    assert calls == [("old summary", ["message 1", "message 2"], 512)]
+    assert chat_service.saved == [(1, "new summary", 3)]
+
+
+def test_concurrent_refreshes_fold_once_per_chat():
+    calls = []
+
+    async def summarizer(previous, messages, max_tokens):
+        calls.append(messages)
+        await asyncio.sleep(0.05)
+        return "summary"
+
+    chat_service = FakeChatService()
+    chat = ChatEntity(id=1, system_prompt="system")
+    summary_tasks = {}
+    services = [build_service(chat_service, summarizer, summary_tasks=summary_tasks) for _ in range(3)]
+
+    async def run():
+        for service in services:
+            await service.build(chat, build_messages(5))
+        tasks = [service.refresh_summary() for service in services]
+        await asyncio.gather(*(task for task in tasks if task))
+        return tasks
+
+    tasks = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sum(task is not None for task in tasks) == 1
+    assert len(chat_service.saved) == 1
+
+
+def test_running_refresh_is_visible_to_owner_for_cancellation():
+    async def summarizer(previous, messages, max_tokens):
+        await asyncio.sleep(10)
+        return "summary"
+
+    chat_service = FakeChatService()
+    summary_tasks = {}
+    service = build_service(chat_service, summarizer, summary_tasks=summary_tasks)
+
+    async def run():
+        await service.build(ChatEntity(id=1, system_prompt="system"), build_messages(5))
+        task = service.refresh_summary()
+        assert summary_tasks == {1: task}
+        # 应用服务关闭时取消进行中的刷新
+        for running in list(summary_tasks.values()):
+            running.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert summary_tasks == {}
+    assert chat_service.saved == []
+
+
+def test_summary_is_truncated_to_reserved_tokens():
+    async def summarizer(previous, messages, max_tokens):
+        return previous
+
+    chat_service = FakeChatService(ChatSummaryEntity(chat_id=1, content="x " * 5000, last_message_id=3))
+    service = build_service(chat_service, summarizer, summary_max_tokens=64)
+    chat = ChatEntity(id=1, system_prompt="system")
+
+    context = asyncio.run(service.build(chat, build_messages(5)))
+
+    assert service.count_tokens(context[1]) <= 64
+    assert service.refresh_summary() is None
@@ -0,0 +1,70 @@
+"""
+批量软删除用户聊天的测试
+
+通过应用服务删除后，在新的会话中读取，验证删除已提交且只影响该用户的聊天。
+"""
+import asyncio
+
+import pytest
+
+chat_app = pytest.importorskip("chat.application.chat_service", exc_type=ImportError)
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import infra.database as database
+from chat.infrastructure.models import Chat, Source
+from infra.database import UnitOfWork, metadata
+from user.infra.models import UserModel
+
+
+async def prepare() -> tuple:
+    """创建两个用户，各有两个聊天，返回两个用户的ID"""
+    async with UnitOfWork() as uow:
+        session = uow.session
+        users = [
+            UserModel(username=f"user-{i}", email=f"user-{i}@example.com", hashed_password="-")
+            for i in range(2)
+        ]
+        source = Source(name="source")
+        session.add_all([*users, source])
+        await session.flush()
+        session.add_all([
+            Chat(name=f"chat {i}", user_id=user.id, source_id=source.id)
+            for user in users for i in range(2)
+        ])
+        await uow.commit()
+        return users[0].id, users[1].id
+
+
+async def deleted_flags(user_id: int) -> list:
+    async with UnitOfWork() as uow:
+        result = await uow.session.execute(select(Chat.is_deleted).where(Chat.user_id == user_id))
+        return list(result.scalars())
+
+
+def test_delete_user_chats_is_committed():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        database.async_session_factory.configure(bind=engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+
+        user_id, other_user_id = await prepare()
+        service = chat_app.ChatApplicationService(
+            mcp_server_url="http://localhost:8000",
+            model="test-model",
+            api_key="key",
+            api_base="http://localhost"
+        )
+        deleted = await service.delete_user_chats(user_id)
+        result = deleted, await deleted_flags(user_id), await deleted_flags(other_user_id)
+        await service.shutdown()
+        await engine.dispose()
+        return result
+
+    deleted, flags, other_flags = asyncio.run(run())
+
+    assert deleted == 2
+    assert flags == [True, True]
+    assert other_flags == [False, False]
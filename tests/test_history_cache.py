@@ -0,0 +1,172 @@
+"""
+聊天历史缓存的测试
+
+验证活跃聊天每轮不再查询历史、写入时追加、更新时失效，以及内存上限和命中率。
+"""
+import asyncio
+
+from chat.domain.models.chat import ChatDataEntity, ChatEntity
+from chat.domain.services.chat_service import ChatDomainService
+from chat.infrastructure.history_cache import ChatHistoryCache
+
+
+class FakeChatRepo:
+    def __init__(self, chat):
+        self.chat = chat
+        self.queries = 0
+
+    async def get_chat_by_chat_id(self, chat_id):
+        self.queries += 1
+        return self.chat if chat_id == self.chat.chat_id else None
+
+    async def update_chat(self, chat):
+        self.chat = chat
+        return chat
+
+    async def delete_chats_by_user(self, user_id):
+        return 1 if self.chat.user_id == user_id else 0
+
+
+class FakeChatDataRepo:
+    def __init__(self):
+        self.rows = []
+        self.queries = 0
+
+    async def create_chat_data(self, chat_data):
+        chat_data.id = len(self.rows) + 1
+        self.rows.append(chat_data)
+        return chat_data
+
+    async def create_many(self, chat_data_list, batch_size=None):
+        self.rows.extend(chat_data_list)
+        return chat_data_list
+
+    async def get_chat_data(self, chat_id, limit=100, before=None, after=None):
+        self.queries += 1
+        return [row for row in self.rows if row.chat_id == chat_id]
+
+
+class FakeSourceRepo:
+    async def delete_source(self, source_id):
+        return True
+
+
+def build_service(cache, on_rollback=None):
+    chat = ChatEntity(id=1, chat_id="c1", user_id=7, system_prompt="system")
+    return ChatDomainService(
+        chat_repo=FakeChatRepo(chat),
+        chat_data_repo=FakeChatDataRepo(),
+        chat_tool_repo=None,
+        source_repo=FakeSourceRepo(),
+        prompt_repo=None,
+        history_cache=cache,
+        on_rollback=on_rollback
+    )
+
+
+def test_active_chat_costs_no_history_query_per_turn():
+    cache = ChatHistoryCache(window=20)
+    service = build_service(cache)
+
+    async def turn(content):
+        chat = await service.get_chat_by_chat_id("c1")
+        await service.create_message(chat_id=chat.id, content=content)
+        history = await service.get_chat_messages(chat)
+        await service.create_messages([ChatDataEntity(chat_id=chat.id, content=f"re: {content}", role="assistant")])
+        return history
+
+    async def run():
+        for i in range(5):
+            history = await turn(f"q{i}")
+        return history, await service.get_messages("c1")
+
+    history, messages = asyncio.run(run())
+
+    assert service.chat_repo.queries == 1
+    assert service.chat_data_repo.queries == 1
+    assert [m.content for m in history][-2:] == ["re: q3", "q4"]
+    assert [m.content for m in messages][-2:] == ["q4", "re: q4"]
+    # 每次读取历史只统计一次：第一轮加载，之后四轮和最后的读取命中
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (5, 1)
+
+
+def test_update_invalidates_and_unsaved_messages_reload_before_leaving_window():
+    cache = ChatHistoryCache(window=2)
+    service = build_service(cache)
+
+    async def run():
+        chat = await service.get_chat_by_chat_id("c1")
+        await service.get_chat_messages(chat)
+        # 批量写入的消息没有ID，移出窗口前需要重新加载
+        await service.create_messages([ChatDataEntity(chat_id=1, content="no id")])
+        await service.create_message(chat_id=1, content="a")
+        assert cache.get_messages("c1") is not None
+        await service.create_message(chat_id=1, content="b")
+        assert cache.get_messages("c1") is None
+
+        await service.update_chat(ChatEntity(id=1, chat_id="c1", name="renamed"))
+        return cache.get_chat("c1")
+
+    assert asyncio.run(run()) is None
+
+
+def test_rolled_back_messages_do_not_stay_in_cache():
+    cache = ChatHistoryCache()
+    callbacks = []
+    service = build_service(cache, on_rollback=callbacks.append)
+
+    async def run():
+        chat = await service.get_chat_by_chat_id("c1")
+        await service.get_chat_messages(chat)
+        await service.create_message(chat_id=chat.id, content="never committed")
+        await service.create_messages([ChatDataEntity(chat_id=chat.id, content="reply")])
+
+    asyncio.run(run())
+    assert [m.content for m in cache.get_messages("c1")] == ["never committed", "reply"]
+
+    # 事务回滚，工作单元执行注册的回调
+    for callback in callbacks:
+        callback()
+    assert cache.get_messages("c1") is None
+
+
+def test_bulk_delete_invalidates_only_that_users_chats():
+    cache = ChatHistoryCache()
+    service = build_service(cache)
+    cache.put(ChatEntity(id=2, chat_id="other", user_id=8), [])
+
+    async def run():
+        await service.get_chat_by_chat_id("c1")
+        return await service.delete_user_chats(7)
+
+    assert asyncio.run(run()) == 1
+    assert cache.get_chat("c1") is None
+    assert cache.get_chat("other") is not None
+
+
+def test_source_delete_invalidates_cascaded_chats():
+    cache = ChatHistoryCache()
+    service = build_service(cache)
+    cache.put(ChatEntity(id=1, chat_id="c1", source_id=3), [])
+    cache.put(ChatEntity(id=2, chat_id="other", source_id=4), [])
+
+    assert asyncio.run(service.delete_source(3))
+    assert cache.get_chat("c1") is None
+    assert cache.get_chat("other") is not None
+
+
+def test_lru_eviction_respects_memory_cap():
+    cache = ChatHistoryCache(max_chats=10, max_bytes=20_000)
+    for i in range(5):
+        chat = ChatEntity(id=i + 1, chat_id=f"c{i}")
+        cache.put(chat, [ChatDataEntity(id=1, chat_id=i + 1, content="x" * 4000)])
+    cache.get_messages("c2")
+    cache.put(ChatEntity(id=99, chat_id="big"), [ChatDataEntity(id=1, content="x" * 50_000)])
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 20_000
+    assert stats["evictions"] > 0
+    assert cache.get_messages("big") is None
+    assert cache.get_messages("c2") is not None
+    assert cache.get_messages("c0") is None
@@ -0,0 +1,154 @@
+"""
+对话任务队列的测试
+
+验证工作协程执行并记录任务结果，进程重启后中断的任务重新入队，
+以及多个进程共用队列文件时任务只被领取一次、只恢复自己中断或租约过期的任务。
+"""
+import asyncio
+
+from chat.infrastructure.job_queue import (
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_SUCCEEDED,
+    TurnJobQueue,
+    TurnWorkerPool,
+)
+
+
+def test_workers_run_jobs_and_record_results(tmp_path):
+    handled = []
+
+    async def handler(job):
+        await asyncio.sleep(0.01)
+        if job.content == "boom":
+            raise RuntimeError("对话执行失败")
+        handled.append(job.content)
+
+    async def run():
+        pool = TurnWorkerPool(TurnJobQueue(str(tmp_path / "jobs.db")), handler, workers=2, poll_interval=0.01)
+        await pool.start()
+        jobs = [await pool.submit("chat", content) for content in ("a", "boom", "b")]
+        while pool.succeeded + pool.failed < len(jobs):
+            await asyncio.sleep(0.01)
+        results = [await pool.queue.get(job.id) for job in jobs]
+        stats = pool.stats()
+        await pool.stop()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+
+    assert sorted(handled) == ["a", "b"]
+    assert [job.status for job in results] == [JOB_SUCCEEDED, JOB_FAILED, JOB_SUCCEEDED]
+    assert results[1].error == "对话执行失败"
+    assert stats["succeeded"] == 2 and stats["failed"] == 1 and stats["queued"] == 0
+
+
+def test_interrupted_jobs_are_requeued_after_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def before_restart():
+        queue = TurnJobQueue(path, max_attempts=2)
+        first = await queue.enqueue("chat", "first")
+        second = await queue.enqueue("chat", "second")
+        # 两个任务都已开始执行，此时进程退出
+        assert (await queue.claim()).id == first.id
+        assert (await queue.claim()).id == second.id
+        queue.close()
+        return first, second
+
+    async def after_restart(first, second):
+        queue = TurnJobQueue(path, max_attempts=2)
+        recovered = await queue.recover()
+        requeued = await queue.get(first.id)
+        # 再次中断后超过执行次数上限，不再重试
+        await queue.claim()
+        await queue.claim()
+        await queue.recover()
+        exhausted = await queue.get(second.id)
+        queue.close()
+        return recovered, requeued, exhausted
+
+    async def run():
+        first, second = await before_restart()
+        return await after_restart(first, second)
+
+    recovered, requeued, exhausted = asyncio.run(run())
+
+    assert recovered == 2
+    assert requeued.status == JOB_QUEUED and requeued.attempts == 1
+    assert exhausted.status == JOB_FAILED and exhausted.attempts == 2
+
+
+def test_concurrent_claims_take_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def run():
+        # 每个队列实例使用独立的连接，模拟多个进程
+        queues = [TurnJobQueue(path, owner=f"worker-{i}") for i in range(4)]
+        jobs = [await queues[0].enqueue("chat", str(i)) for i in range(40)]
+
+        async def drain(queue):
+            claimed = []
+            while (job := await queue.claim()) is not None:
+                claimed.append(job)
+            return claimed
+
+        results = await asyncio.gather(*(drain(queue) for queue in queues))
+        for queue in queues:
+            queue.close()
+        return jobs, results
+
+    jobs, results = asyncio.run(run())
+
+    claimed = [job.id for result in results for job in result]
+    assert sorted(claimed) == sorted(job.id for job in jobs)
+    assert all(job.owner == f"worker-{i}" for i, result in enumerate(results) for job in result)
+
+
+def test_recover_skips_jobs_leased_by_other_owners(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def run():
+        running = TurnJobQueue(path, owner="a", lease_seconds=0.2)
+        restarted = TurnJobQueue(path, owner="b")
+        job = await running.enqueue("chat", "content")
+        await running.claim()
+        # 另一个进程启动时任务仍在租约内，不能被恢复
+        recovered_during_lease = await restarted.recover()
+        assert await running.renew(job.id)
+        await asyncio.sleep(0.3)
+        # 领取者停止续租后租约过期，任务重新入队
+        recovered_after_expiry = await restarted.recover()
+        requeued = await restarted.get(job.id)
+        renewed = await running.renew(job.id)
+        running.close()
+        restarted.close()
+        return recovered_during_lease, recovered_after_expiry, requeued, renewed
+
+    recovered_during_lease, recovered_after_expiry, requeued, renewed = asyncio.run(run())
+
+    assert recovered_during_lease == 0
+    assert recovered_after_expiry == 1
+    assert requeued.status == JOB_QUEUED and requeued.owner is None
+    assert not renewed
+
+
+def test_submit_limits_pending_jobs_per_user(tmp_path):
+    async def handler(job):
+        pass
+
+    async def run():
+        pool = TurnWorkerPool(TurnJobQueue(str(tmp_path / "jobs.db")), handler, max_pending_per_user=2)
+        accepted = [await pool.submit("chat", "content", user_id=1) for _ in range(3)]
+        other_user = await pool.submit("chat", "content", user_id=2)
+        # 任务结束后不再计入上限
+        await pool.queue.finish((await pool.queue.claim()).id)
+        after_finish = await pool.submit("chat", "content", user_id=1)
+        pool.queue.close()
+        return accepted, other_user, after_finish
+
+    accepted, other_user, after_finish = asyncio.run(run())
+
+    assert [job is not None for job in accepted] == [True, True, False]
+    assert other_user is not None and other_user.user_id == 2
+    assert after_finish is not None
@@ -0,0 +1,113 @@
+"""
+对话任务重新执行的测试
+
+任务执行到一半时进程退出，重启后任务重新入队并再次执行，
+验证用户消息只保存一次，上次执行留下的部分回复被删除。
+"""
+import asyncio
+
+import pytest
+
+chat_app = pytest.importorskip("chat.application.chat_service", exc_type=ImportError)
+
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import infra.database as database
+from chat.domain.models.enums import Role
+from chat.domain.models.tool_catalog import ToolCatalog
+from chat.domain.services import llm_service
+from chat.domain.services.llm_service import LLMDomainService
+from chat.infrastructure.job_queue import TurnJobQueue
+from chat.infrastructure.models import Chat, ChatData, Source
+from infra.database import UnitOfWork, metadata
+from user.infra.models import UserModel
+
+
+def make_chunk(content: str) -> ModelResponseStream:
+    return ModelResponseStream(
+        id="chunk",
+        model="test-model",
+        choices=[StreamingChoices(index=0, delta=Delta(content=content))]
+    )
+
+
+async def prepare() -> tuple:
+    """创建一个聊天，返回聊天主键和聊天ID"""
+    async with UnitOfWork() as uow:
+        session = uow.session
+        user = UserModel(username="user", email="user@example.com", hashed_password="-")
+        source = Source(name="source")
+        session.add_all([user, source])
+        await session.flush()
+        chat = Chat(name="chat", user_id=user.id, source_id=source.id)
+        session.add(chat)
+        await uow.commit()
+        return chat.id, chat.chat_id
+
+
+async def load_messages(chat_pk: int) -> list:
+    async with UnitOfWork() as uow:
+        result = await uow.session.execute(
+            select(ChatData.role, ChatData.content).where(ChatData.chat_id == chat_pk).order_by(ChatData.id)
+        )
+        return [tuple(row) for row in result]
+
+
+def test_recovered_job_reruns_without_duplicating_messages(tmp_path, monkeypatch):
+    async def fake_acompletion(**kwargs):
+        async def stream():
+            yield make_chunk("answer")
+
+        return stream()
+
+    async def get_tools(self):
+        return ToolCatalog.build([])
+
+    monkeypatch.setattr(llm_service, "acompletion", fake_acompletion)
+    monkeypatch.setattr(LLMDomainService, "_get_tools", get_tools)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        database.async_session_factory.configure(bind=engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+        chat_pk, chat_id = await prepare()
+
+        service = chat_app.ChatApplicationService(
+            mcp_server_url="http://localhost:8000",
+            model="test-model",
+            api_key="key",
+            api_base="http://localhost",
+            job_queue=TurnJobQueue(str(tmp_path / "jobs.db")),
+            job_workers=1
+        )
+        job = await service.submit_job(chat_id, "hello")
+
+        # 第一次执行保存了部分回复后进程退出，任务停留在运行中状态
+        assert (await service.job_pool.queue.claim()).id == job.id
+        async with UnitOfWork() as uow:
+            uow.session.add(ChatData(
+                chat_id=chat_pk,
+                content="partial",
+                role=Role.ASSISTANT,
+                extra={"turn_id": job.id}
+            ))
+            await uow.commit()
+
+        # 重启后重新入队并再次执行
+        await service.job_pool.start()
+        while service.job_pool.succeeded + service.job_pool.failed < 1:
+            await asyncio.sleep(0.01)
+        finished = await service.get_job(job.id)
+        messages = await load_messages(chat_pk)
+
+        await service.shutdown()
+        await engine.dispose()
+        return finished, messages
+
+    finished, messages = asyncio.run(run())
+
+    assert finished.attempts == 2 and finished.error is None
+    assert messages == [(Role.USER, "hello"), (Role.ASSISTANT, "answer")]
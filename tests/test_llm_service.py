@@ -0,0 +1,276 @@
+"""
+LLM调用不阻塞事件循环的测试
+
+模拟一次耗时的LLM调用，同时在事件循环中运行其他请求，
+验证并发请求的延迟不会被LLM调用拖慢。
+"""
+import asyncio
+import time
+
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices
+
+from chat.api.streaming import cancel_on_disconnect
+from chat.domain.models.chat import ChatEntity
+from chat.domain.models.tool_catalog import ToolCatalog
+from chat.domain.services import llm_service
+from chat.domain.services.llm_service import LLMDomainService
+from chat.infrastructure.llm_executor import SyncLLMExecutor
+from chat.infrastructure.model_router import ModelEndpoint, ModelRouter
+
+LLM_DELAY = 0.5
+
+
+def make_chunk(content: str) -> ModelResponseStream:
+    return ModelResponseStream(
+        id="chunk",
+        model="test-model",
+        choices=[StreamingChoices(index=0, delta=Delta(content=content))]
+    )
+
+
+class FakeChatService:
+    def __init__(self):
+        self.messages = []
+        self.batches = []
+
+    async def create_message(self, **kwargs):
+        self.messages.append(kwargs)
+
+    async def create_messages(self, messages):
+        self.batches.append(messages)
+        self.messages.extend(messages)
+        return messages
+
+
+def build_service(sync_client: bool = False, **kwargs) -> LLMDomainService:
+    endpoint = ModelEndpoint(name="test-model", api_key="key", api_base="http://localhost", sync_client=sync_client)
+    service = LLMDomainService(
+        mcp_server_url="http://localhost:8000",
+        model="test-model",
+        api_key="key",
+        api_base="http://localhost",
+        chat_domain_service=FakeChatService(),
+        model_router=ModelRouter([endpoint]),
+        mcp_pool=None,
+        sync_executor=SyncLLMExecutor(),
+        **kwargs
+    )
+
+    async def get_tools():
+        return ToolCatalog.build([])
+
+    service._get_tools = get_tools
+    return service
+
+
+async def run_with_probe(service: LLMDomainService):
+    """在LLM调用期间执行短请求，返回短请求的最大延迟和LLM结果"""
+    async def consume():
+        return [data async for data in service.chat(ChatEntity(id=1, system_prompt="system"), [])]
+
+    async def probe():
+        latencies = []
+        for _ in range(5):
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            latencies.append(time.perf_counter() - start)
+        return max(latencies)
+
+    turn = asyncio.create_task(consume())
+    await asyncio.sleep(0.05)
+    latency = await probe()
+    return latency, await turn
+
+
+def test_async_llm_call_does_not_block_event_loop(monkeypatch):
+    async def fake_acompletion(**kwargs):
+        await asyncio.sleep(LLM_DELAY)
+
+        async def stream():
+            yield make_chunk("hello")
+
+        return stream()
+
+    monkeypatch.setattr(llm_service, "acompletion", fake_acompletion)
+
+    latency, responses = asyncio.run(run_with_probe(build_service()))
+
+    assert latency < 0.1
+    assert [r["content"] for r in responses] == ["hello"]
+
+
+def test_sync_client_runs_in_thread_pool(monkeypatch):
+    def fake_completion(**kwargs):
+        time.sleep(LLM_DELAY)
+        return iter([make_chunk("hello")])
+
+    monkeypatch.setattr(llm_service, "completion", fake_completion)
+
+    latency, responses = asyncio.run(run_with_probe(build_service(sync_client=True)))
+
+    assert latency < 0.1
+    assert [r["content"] for r in responses] == ["hello"]
+
+
+def test_turn_messages_are_written_in_one_batch():
+    service = build_service(stream=False)
+
+    async def chat_llm(messages, tools=None, stream=False, **kwargs):
+        response = llm_service.stream_chunk_builder([make_chunk("hello")])
+        response.choices[0].message.reasoning_content = "think"
+        return response
+
+    service._chat_llm = chat_llm
+
+    async def consume():
+        return [data async for data in service.chat(ChatEntity(id=1, system_prompt="system"), [])]
+
+    responses = asyncio.run(consume())
+
+    batches = service.chat_service.batches
+    assert [r["content"] for r in responses] == ["hello", "think"]
+    assert len(batches) == 1
+    assert [m.content for m in batches[0]] == ["hello", "think"]
+    assert batches[0][0].created_at < batches[0][1].created_at
+
+
+def test_cancelled_turn_still_flushes_messages(monkeypatch):
+    async def fake_acompletion(**kwargs):
+        async def stream():
+            yield make_chunk("partial")
+            await asyncio.sleep(10)
+            yield make_chunk(" never")
+
+        return stream()
+
+    monkeypatch.setattr(llm_service, "acompletion", fake_acompletion)
+    service = build_service()
+    service.message_buffer.add(chat_id=1, content="pending")
+
+    async def consume():
+        turn = service.chat(ChatEntity(id=1, system_prompt="system"), [])
+        assert (await turn.__anext__())["content"] == "partial"
+        await turn.aclose()
+
+    asyncio.run(consume())
+
+    batches = service.chat_service.batches
+    assert [[m.content for m in batch] for batch in batches] == [["pending", "partial"]]
+    assert batches[0][1].extra == {"truncated": True}
+
+
+def test_client_disconnect_cancels_turn(monkeypatch):
+    closed = []
+
+    async def fake_acompletion(**kwargs):
+        async def stream():
+            try:
+                yield make_chunk("partial")
+                await asyncio.sleep(10)
+                yield make_chunk(" never")
+            finally:
+                closed.append(True)
+
+        return stream()
+
+    monkeypatch.setattr(llm_service, "acompletion", fake_acompletion)
+    service = build_service()
+
+    class FakeRequest:
+        async def receive(self):
+            await asyncio.sleep(0.1)
+            return {"type": "http.disconnect"}
+
+    async def consume():
+        turn = service.chat(ChatEntity(id=1, system_prompt="system"), [])
+        return [data async for data in cancel_on_disconnect(FakeRequest(), turn)]
+
+    start = time.perf_counter()
+    responses = asyncio.run(consume())
+
+    assert time.perf_counter() - start < 1
+    assert [r["content"] for r in responses] == ["partial"]
+    assert closed == [True]
+    saved = service.chat_service.batches[0]
+    assert [(m.content, m.extra) for m in saved] == [("partial", {"truncated": True})]
+
+
+def test_client_disconnect_closes_wrapped_upstream_stream(monkeypatch):
+    closed = []
+
+    class UpstreamStream:
+        """模拟 openai 的 AsyncStream，关闭时释放HTTP连接"""
+        def __init__(self):
+            self.chunks = [make_chunk("partial")]
+
+        async def __anext__(self):
+            if self.chunks:
+                return self.chunks.pop(0)
+            await asyncio.sleep(10)
+            raise StopAsyncIteration
+
+        async def close(self):
+            closed.append(True)
+
+    class StreamWrapper:
+        """模拟 litellm 的 CustomStreamWrapper：没有 aclose"""
+        def __init__(self, completion_stream):
+            self.completion_stream = completion_stream
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            return await self.completion_stream.__anext__()
+
+    async def fake_acompletion(**kwargs):
+        return StreamWrapper(UpstreamStream())
+
+    monkeypatch.setattr(llm_service, "acompletion", fake_acompletion)
+    service = build_service()
+
+    class FakeRequest:
+        async def receive(self):
+            await asyncio.sleep(0.1)
+            return {"type": "http.disconnect"}
+
+    async def consume():
+        turn = service.chat(ChatEntity(id=1, system_prompt="system"), [])
+        return [data async for data in cancel_on_disconnect(FakeRequest(), turn)]
+
+    responses = asyncio.run(consume())
+
+    assert [r["content"] for r in responses] == ["partial"]
+    assert closed == [True]
+
+
+def test_complete_returns_messages_without_saving():
+    service = build_service(stream=False)
+
+    async def chat_llm(messages, tools=None, stream=False, **kwargs):
+        return llm_service.stream_chunk_builder([make_chunk("hello")])
+
+    service._chat_llm = chat_llm
+
+    produced = asyncio.run(service.complete(ChatEntity(system_prompt="system"), []))
+
+    assert [m.content for m in produced] == ["hello"]
+    assert service.chat_service.batches == []
+    assert service.message_buffer.pending == []
+
+
+def test_sync_executor_works_across_event_loops():
+    executor = SyncLLMExecutor(max_workers=1)
+
+    async def contended():
+        # 两个调用争用同一个名额，信号量需要在当前事件循环中等待
+        return await asyncio.gather(
+            executor.run(time.sleep, 0.01),
+            executor.run(time.sleep, 0.01)
+        )
+
+    try:
+        asyncio.run(contended())
+        asyncio.run(contended())
+    finally:
+        executor.shutdown()
@@ -0,0 +1,192 @@
+"""
+模型路由的测试
+
+验证端点故障时切换、连续失败后熔断，以及流式请求只在首块之前切换。
+"""
+import asyncio
+
+import pytest
+from litellm import exceptions as llm_errors
+
+from chat.infrastructure.model_router import CIRCUIT_OPEN, ModelEndpoint, ModelRouter, is_retryable_error
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def build_router(**kwargs) -> ModelRouter:
+    return ModelRouter(
+        [
+            ModelEndpoint(name="m", api_key="k", api_base="http://a"),
+            ModelEndpoint(name="m", api_key="k", api_base="http://b"),
+        ],
+        **kwargs
+    )
+
+
+def test_failover_and_circuit_breaker():
+    router = build_router(failure_threshold=2, recovery_timeout=60)
+    calls = []
+
+    async def request(endpoint):
+        calls.append(endpoint.api_base)
+        if endpoint.api_base == "http://a":
+            raise ServerError("unavailable")
+        return endpoint.api_base
+
+    async def run():
+        return [await router.call(request, model="m") for _ in range(4)]
+
+    assert asyncio.run(run()) == ["http://b"] * 4
+    # a 熔断后不再分配请求
+    assert calls.count("http://a") == 2
+    assert router.state(router.endpoints[0]) == CIRCUIT_OPEN
+
+
+def test_client_error_is_not_retried():
+    router = build_router()
+    calls = []
+
+    async def request(endpoint):
+        calls.append(endpoint.api_base)
+        raise BadRequest("invalid")
+
+    with pytest.raises(BadRequest):
+        asyncio.run(router.call(request, model="m"))
+    assert len(calls) == 1
+
+
+def test_unknown_model_is_not_routed_to_other_models():
+    router = ModelRouter([
+        ModelEndpoint(name="m1", api_key="k", api_base="http://a"),
+        ModelEndpoint(name="m2", api_key="k", api_base="http://b"),
+    ])
+    assert [e.name for e in router.candidates("m2")] == ["m2"]
+    with pytest.raises(ValueError):
+        router.candidates("m3")
+
+    # 只配置了一个模型时，其他名称视为它的别名
+    assert len(build_router().candidates("alias")) == 2
+
+
+def provider_error(error_class):
+    return error_class(message="error", model="m", llm_provider="openai")
+
+
+@pytest.mark.parametrize("error_class, retryable", [
+    (llm_errors.Timeout, True),
+    (llm_errors.APIConnectionError, True),
+    (llm_errors.InternalServerError, True),
+    (llm_errors.ServiceUnavailableError, True),
+    (llm_errors.RateLimitError, True),
+    (llm_errors.BadRequestError, False),
+    (llm_errors.AuthenticationError, False),
+])
+def test_litellm_errors_are_classified(error_class, retryable):
+    assert is_retryable_error(provider_error(error_class)) is retryable
+
+
+def test_litellm_timeout_fails_over():
+    router = build_router()
+    calls = []
+
+    async def request(endpoint):
+        calls.append(endpoint.api_base)
+        if len(calls) == 1:
+            raise provider_error(llm_errors.Timeout)
+        return endpoint.api_base
+
+    assert asyncio.run(router.call(request, model="m")) in ("http://a", "http://b")
+    assert len(calls) == 2 and calls[0] != calls[1]
+
+
+def test_stream_fails_over_before_first_chunk():
+    router = build_router()
+
+    async def request(endpoint):
+        async def stream():
+            if endpoint.api_base == "http://a":
+                raise asyncio.TimeoutError()
+            yield "hello"
+            yield "world"
+
+        return stream()
+
+    async def run():
+        router.endpoints[1].latency_ewma = 1.0  # 让 a 优先
+        response = await router.call(request, model="m", stream=True)
+        return [chunk async for chunk in response]
+
+    assert asyncio.run(run()) == ["hello", "world"]
+    assert router.endpoints[0].failures == 1
+    assert all(e.in_flight == 0 for e in router.endpoints)
+
+
+def test_slow_request_is_hedged_and_loser_cancelled():
+    router = build_router(hedge_percentile=0.9, hedge_budget=1.0, hedge_min_samples=5)
+    router._latencies[False].extend([0.01] * 10)
+    router.endpoints[1].latency_ewma = 1.0  # 让 a 优先
+    cancelled = []
+
+    async def request(endpoint):
+        if endpoint.api_base == "http://a":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(endpoint.api_base)
+                raise
+        return endpoint.api_base
+
+    assert asyncio.run(router.call(request, model="m")) == "http://b"
+    assert cancelled == ["http://a"]
+    assert router.stats()["hedge"]["wins"] == 1
+    assert all(e.in_flight == 0 for e in router.endpoints)
+
+
+def test_hedge_deadline_is_tracked_per_stream_mode():
+    router = build_router(hedge_percentile=0.5, hedge_min_samples=3)
+
+    async def request(endpoint, stream=False):
+        if not stream:
+            await asyncio.sleep(0.05)
+            return endpoint.api_base
+
+        async def chunks():
+            yield "first"
+            await asyncio.sleep(0.05)
+            yield "rest"
+
+        return chunks()
+
+    async def run():
+        for _ in range(3):
+            await router.call(request, model="m")
+            response = await router.call(lambda e: request(e, stream=True), model="m", stream=True)
+            [chunk async for chunk in response]
+
+    asyncio.run(run())
+
+    # 流式请求只等首块，截止时间不受完整响应的延迟影响
+    assert router.hedge_deadline(stream=True) < 0.02
+    assert router.hedge_deadline(stream=False) >= 0.04
+
+
+def test_hedge_budget_limits_duplicate_requests():
+    router = build_router(hedge_percentile=0.9, hedge_budget=0.5, hedge_min_samples=5)
+    router._latencies[False].extend([0.001] * 100)
+
+    async def request(endpoint):
+        await asyncio.sleep(0.02)
+        return endpoint.api_base
+
+    async def run():
+        for _ in range(4):
+            await router.call(request, model="m")
+
+    asyncio.run(run())
+    assert router.stats()["hedge"]["requests"] == 2
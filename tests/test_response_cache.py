@@ -0,0 +1,169 @@
+"""
+LLM响应缓存的测试
+
+验证精确缓存的 TTL 过期和 LRU 淘汰、采样参数不同的请求不共享缓存、语义缓存的相似度阈值、
+非幂等工具相关的请求和回复不被缓存，以及上下文没有向量条目时请求前不计算向量。
+"""
+import asyncio
+from types import SimpleNamespace
+
+from chat.infrastructure.response_cache import ResponseCache
+
+SOURCE_ID = 1
+CONTEXT = [{"role": "system", "content": "system"}]
+
+VECTORS = {
+    "what is x": [1.0, 0.0],
+    "what's x": [0.99, 0.05],
+    "who is y": [0.0, 1.0],
+}
+
+
+class FakeEmbeddingService:
+    def __init__(self, events):
+        self.events = events
+
+    async def get_embedding(self, text):
+        self.events.append(("embed", text))
+        return VECTORS[text]
+
+
+def make_response(content, tool_names=()):
+    tool_calls = [SimpleNamespace(function=SimpleNamespace(name=name)) for name in tool_names]
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+def build_cache(events, **kwargs):
+    return ResponseCache(sources=[SOURCE_ID], embedding_service=FakeEmbeddingService(events), **kwargs)
+
+
+async def ask(cache, events, question, answer=None, tool_names=(), messages=None, **kwargs):
+    """发起一次请求，返回回复内容；loader 被调用时记录事件"""
+    async def loader():
+        events.append(("llm", question))
+        return make_response(answer or f"answer to {question}", tool_names)
+
+    messages = messages or [*CONTEXT, {"role": "user", "content": question}]
+    response = await cache.fetch(model="test-model", messages=messages, loader=loader, **kwargs)
+    # 让后台的向量计算完成
+    await asyncio.sleep(0)
+    return response.choices[0].message.content
+
+
+def llm_calls(events):
+    return [question for kind, question in events if kind == "llm"]
+
+
+def test_exact_entries_expire_after_ttl():
+    events = []
+    cache = build_cache(events, ttl=0.05, semantic_threshold=None)
+
+    async def run():
+        await ask(cache, events, "what is x")
+        await ask(cache, events, "what is x")
+        await asyncio.sleep(0.06)
+        await ask(cache, events, "what is x")
+
+    asyncio.run(run())
+
+    assert llm_calls(events) == ["what is x", "what is x"]
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    events = []
+    cache = build_cache(events, max_entries=2, semantic_threshold=None)
+
+    async def run():
+        await ask(cache, events, "a")
+        await ask(cache, events, "b")
+        await ask(cache, events, "a")  # a 最近使用过，淘汰 b
+        await ask(cache, events, "c")
+        await ask(cache, events, "a")
+        await ask(cache, events, "b")
+
+    asyncio.run(run())
+
+    assert llm_calls(events) == ["a", "b", "c", "b"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_sampling_params_are_part_of_the_key():
+    events = []
+    cache = build_cache(events, semantic_threshold=None)
+
+    async def run():
+        await ask(cache, events, "what is x", params={"max_tokens": 64})
+        await ask(cache, events, "what is x", params={"max_tokens": 4096})
+        await ask(cache, events, "what is x", params={"max_tokens": 64})
+
+    asyncio.run(run())
+
+    # 截断到 64 个token的回复不能用于 max_tokens 更大的请求
+    assert llm_calls(events) == ["what is x", "what is x"]
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_semantic_hit_requires_threshold():
+    events = []
+    cache = build_cache(events, semantic_threshold=0.95)
+
+    async def run():
+        first = await ask(cache, events, "what is x")
+        similar = await ask(cache, events, "what's x")
+        different = await ask(cache, events, "who is y")
+        return first, similar, different
+
+    first, similar, different = asyncio.run(run())
+
+    assert similar == first
+    assert different == "answer to who is y"
+    assert llm_calls(events) == ["what is x", "who is y"]
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_empty_context_bucket_skips_embedding_before_llm_call():
+    events = []
+    cache = build_cache(events, semantic_threshold=0.95)
+
+    async def run():
+        await ask(cache, events, "what is x")
+        await ask(cache, events, "who is y")
+
+    asyncio.run(run())
+
+    # 第一次请求先调用LLM，向量在写入缓存后计算；之后同一上下文的请求先查语义缓存
+    assert events == [
+        ("llm", "what is x"),
+        ("embed", "what is x"),
+        ("embed", "who is y"),
+        ("llm", "who is y"),
+    ]
+
+
+def test_non_idempotent_tools_are_not_cached():
+    events = []
+    cache = build_cache(events, semantic_threshold=None, idempotent_tools=["search"])
+
+    async def run():
+        # 回复调用了非幂等工具，不写入缓存
+        await ask(cache, events, "send mail", tool_names=["send_mail"])
+        await ask(cache, events, "send mail", tool_names=["send_mail"])
+        # 幂等工具的回复可以缓存
+        await ask(cache, events, "search x", tool_names=["search"])
+        await ask(cache, events, "search x", tool_names=["search"])
+        # 请求中包含非幂等工具的结果，直接调用LLM
+        messages = [
+            *CONTEXT,
+            {"role": "user", "content": "send mail"},
+            {"role": "tool", "name": "send_mail", "tool_call_id": "1", "content": "sent"},
+        ]
+        await ask(cache, events, "after tool", messages=messages)
+        await ask(cache, events, "after tool", messages=messages)
+
+    asyncio.run(run())
+
+    assert llm_calls(events) == ["send mail", "send mail", "search x", "after tool", "after tool"]
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["skipped"] == 4
@@ -0,0 +1,83 @@
+"""
+相同请求合并的测试
+
+验证并发的相同请求只调用一次上游，流式响应分发给每个订阅者，
+以及所有订阅者离开后取消上游调用。
+"""
+import asyncio
+
+from chat.infrastructure.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    singleflight = SingleFlight()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(singleflight.call("key", loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert len(calls) == 1
+    assert singleflight.stats()["coalesced"] == 4
+
+
+def test_stream_is_fanned_out_to_late_subscribers():
+    singleflight = SingleFlight()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+
+        async def stream():
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0.02)
+                yield chunk
+
+        return stream()
+
+    async def consume(delay):
+        await asyncio.sleep(delay)
+        response = await singleflight.call("key", loader, stream=True)
+        return [chunk async for chunk in response]
+
+    async def run():
+        return await asyncio.gather(consume(0), consume(0.03))
+
+    assert asyncio.run(run()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert len(calls) == 1
+
+
+def test_upstream_cancelled_when_all_subscribers_leave():
+    singleflight = SingleFlight()
+    cancelled = []
+
+    async def loader():
+        async def stream():
+            try:
+                yield "a"
+                await asyncio.sleep(5)
+                yield "b"
+            finally:
+                cancelled.append(True)
+
+        return stream()
+
+    async def run():
+        first = await singleflight.call("key", loader, stream=True)
+        second = await singleflight.call("key", loader, stream=True)
+        assert await first.__anext__() == "a"
+        assert await second.__anext__() == "a"
+        await first.aclose()
+        await asyncio.sleep(0.01)
+        assert not cancelled
+        await second.aclose()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert cancelled == [True]
+    assert singleflight.stats()["cancelled"] == 1
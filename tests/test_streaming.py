@@ -0,0 +1,29 @@
+"""
+WebSocket 客户端消息解析的测试
+
+格式错误的帧(非JSON、非对象、content 不是字符串、二进制帧)应抛出 ValueError，
+由长连接返回 400 错误事件后继续接收，而不是中断连接。
+"""
+import pytest
+
+from chat.api.streaming import parse_client_frame
+
+
+def test_valid_frames_are_parsed():
+    assert parse_client_frame('{"content": "hello"}') == {"content": "hello"}
+    assert parse_client_frame('{"type": "cancel"}') == {"type": "cancel"}
+
+
+@pytest.mark.parametrize("text", [
+    None,
+    "not json",
+    '["content"]',
+    '"hello"',
+    "null",
+    '{"content": 1}',
+    '{"content": {"text": "hello"}}',
+    "[" * 100000,
+])
+def test_malformed_frames_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_client_frame(text)
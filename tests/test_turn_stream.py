@@ -0,0 +1,88 @@
+"""
+可续传对话流的测试
+
+验证重连时从断点继续、断点移出缓冲区时发送快照、生成过程中重连，
+以及一直未开始且没有订阅者的对话流过期移除。
+"""
+import asyncio
+
+from chat.infrastructure.turn_stream import (
+    EVENT_DONE,
+    EVENT_MESSAGE,
+    EVENT_ERROR,
+    EVENT_RESET,
+    TurnStream,
+    TurnStreamRegistry,
+    parse_event_id,
+)
+
+
+def delta(content):
+    return {"content": content, "content_type": "msg", "delta": True}
+
+
+async def collect(stream, after):
+    return [(event, seq, data) async for event, seq, data in stream.subscribe(after)]
+
+
+def test_resume_after_last_event_id_while_generating():
+    async def run():
+        stream = TurnStream("chat")
+
+        async def produce():
+            for content in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                stream.publish(delta(content))
+            stream.close()
+
+        producer = asyncio.create_task(produce())
+        await asyncio.sleep(0.015)
+        turn_id, seq = parse_event_id(stream.event_id(1))
+        events = await collect(stream, seq)
+        await producer
+        return turn_id, stream.turn_id, events
+
+    turn_id, expected, events = asyncio.run(run())
+
+    assert turn_id == expected
+    assert [(e, s) for e, s, _ in events] == [(EVENT_MESSAGE, 2), (EVENT_MESSAGE, 3), (EVENT_DONE, 3)]
+    assert [d["content"] for e, _, d in events if e == EVENT_MESSAGE] == ["b", "c"]
+
+
+def test_reset_snapshot_when_events_were_dropped():
+    async def run():
+        stream = TurnStream("chat", max_events=2)
+        for content in ("he", "ll", "o"):
+            stream.publish(delta(content))
+        stream.publish({"content": "done", "content_type": "tool", "delta": False})
+        stream.close()
+        return await collect(stream, 1)
+
+    events = asyncio.run(run())
+
+    event, seq, snapshot = events[0]
+    assert event == EVENT_RESET and seq == 4
+    assert [(item["content"], item["delta"]) for item in snapshot] == [("hello", False), ("done", False)]
+    assert events[-1][0] == EVENT_DONE
+
+
+def test_unstarted_stream_without_subscribers_expires():
+    async def run():
+        registry = TurnStreamRegistry(retention=0.05)
+        abandoned = registry.create("chat", "abandoned")
+        watched = registry.create("chat", "watched")
+        started = registry.create("chat", "started")
+        started.publish(delta("a"))
+        subscriber = asyncio.create_task(collect(watched, 0))
+        await asyncio.sleep(0.1)
+
+        kept = [turn_id for turn_id in ("abandoned", "watched", "started") if registry.get(turn_id)]
+        # 工作协程开始执行时写入订阅者正在等待的对话流
+        registry.create("chat", "watched").close()
+        return kept, await collect(abandoned, 0), await subscriber
+
+    kept, abandoned_events, watched_events = asyncio.run(run())
+
+    assert kept == ["watched", "started"]
+    assert [event for event, _, _ in abandoned_events] == [EVENT_ERROR, EVENT_DONE]
+    assert [event for event, _, _ in watched_events] == [EVENT_DONE]